@@ -105,6 +105,7 @@ class Logit(pm.Deterministic):
       Deterministic, Lambda, InvLogit, StukelLogit, StukelInvLogit
     """
     def __init__(self, name, theta, doc='A logit transformation', *args, **kwds):
+        kwds.setdefault('jacobians', {'theta': lambda theta: 1./(theta*(1.-theta))})
         pm.Deterministic.__init__(self, eval=logit, name=name, parents={'theta': theta}, doc=doc, *args, **kwds)
 
 
@@ -128,6 +129,7 @@ class InvLogit(pm.Deterministic):
       Deterministic, Lambda, Logit, StukelLogit, StukelInvLogit
     """
     def __init__(self, name, ltheta, doc='An inverse logit transformation', *args, **kwds):
+        kwds.setdefault('jacobians', {'ltheta': lambda ltheta: 1./(2.+np.exp(ltheta)+np.exp(-ltheta))})
         pm.Deterministic.__init__(self, eval=invlogit, name=name, parents={'ltheta': ltheta}, doc=doc, *args, **kwds)
 
 
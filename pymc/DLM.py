@@ -0,0 +1,493 @@
+"""
+Dynamic linear models.
+
+The model for observations y[0..T-1] and states theta[0..T-1] is
+
+    theta[0] ~ N(m_0, C_0)
+    theta[t] | theta[t-1] ~ N(G[t] theta[t-1], W[t]),  t = 1..T-1
+    y[t] | theta[t] ~ N(F[t] theta[t], V[t]),          t = 0..T-1
+
+where the states are p-vectors and the observations q-vectors, and V, W
+and C_0 are covariance matrices, as in West and Harrison, `Bayesian
+Forecasting and Dynamic Models`.
+
+Each of F, G, V and W is either the same at all times, with shape (q,p),
+(p,p), (q,q) and (p,p) respectively, or given at every time with an extra
+leading axis of length T. G[0] and W[0] are not used. Univariate
+observations can be (T,) arrays, with V scalar or (T,) and F a (p,) or
+(T,p) array.
+
+Three stochastics are defined:
+  - DLM : the observations, with the states integrated out. Its
+    log-probability is computed by the Kalman filter.
+  - DLMStates : the states, with a Gauss-Markov prior.
+  - DLMObservations : the observations given the states.
+
+The FFBS step method draws the states of a DLMStates stochastic jointly,
+given DLMObservations, by forward filtering and backward sampling. Both
+the Kalman filter and FFBS take O(T p^3) time, and neither forms the
+(Tp,Tp) precision matrix of the states.
+"""
+
+import numpy as np
+from numpy.linalg import LinAlgError
+from PyMCObjects import Stochastic
+from Container import Container
+from GibbsStepMethods import ConjugateGibbs
+from distributions import valuewrapper
+
+__docformat__='reStructuredText'
+
+__all__ = ['kalman_filter', 'ffbs', 'dlm_like', 'rdlm', 'dlm_states_like', 'rdlm_states',
+    'dlm_observations_like', 'rdlm_observations', 'DLM', 'DLMStates', 'DLMObservations', 'FFBS']
+
+def _series(A, T, shape, name):
+    """
+    Return parameter A as an array of shape (1,)+shape if it is the same at
+    all times, or (T,)+shape if it is given at every time.
+    """
+    A = np.asarray(A, dtype=float)
+    size = int(np.prod(shape))
+    if A.size == size:
+        return A.reshape((1,) + shape)
+    elif A.size == T*size:
+        return A.reshape((T,) + shape)
+    raise ValueError, 'Parameter %s must have shape %s, or %s if it varies over time.' % (name, shape, (T,) + shape)
+
+def _initial(m_0, C_0):
+    m_0 = np.ravel(np.asarray(m_0, dtype=float))
+    p = len(m_0)
+    return m_0, _series(C_0, 1, (p, p), 'C_0')[0]
+
+def _obs_dim(V):
+    """The dimension of the observations, read from their covariance."""
+    if np.ndim(V) < 2:
+        return 1
+    return np.shape(V)[-1]
+
+def _observations(y):
+    y = np.asarray(y, dtype=float)
+    return y.reshape((len(y), -1))
+
+def _states(x, p):
+    x = np.asarray(x, dtype=float)
+    return x.reshape((len(x), p))
+
+def _predict(X, A):
+    """
+    Return the rows of X multiplied by the matrices A, which are either the
+    same for all rows or given for each row.
+    """
+    if len(A) == 1:
+        return np.dot(X, A[0].T)
+    return (A * X[:,np.newaxis,:]).sum(-1)
+
+def _normal_like(r, cov):
+    """
+    The summed log-densities of the rows of r, distributed as N(0, cov[t]).
+    """
+    T, d = r.shape
+    if d == 1:
+        var = cov[:,0,0]
+        if np.any(var <= 0):
+            raise LinAlgError, 'Covariance is not positive definite.'
+        logdet = np.log(var).sum() * (T / len(var))
+        z2 = (r[:,0]**2 / var).sum()
+    elif len(cov) == 1:
+        L = np.linalg.cholesky(cov[0])
+        logdet = 2. * np.log(np.diag(L)).sum() * T
+        z2 = (np.linalg.solve(L, r.T)**2).sum()
+    else:
+        logdet = z2 = 0.
+        for t in xrange(T):
+            L = np.linalg.cholesky(cov[t])
+            logdet += 2. * np.log(np.diag(L)).sum()
+            z2 += (np.linalg.solve(L, r[t])**2).sum()
+    return -.5 * (T*d*np.log(2.*np.pi) + logdet + z2)
+
+def _draw(mean, cov):
+    """Draw from N(mean, cov), allowing cov to be singular."""
+    try:
+        sig = np.linalg.cholesky(cov)
+    except LinAlgError:
+        val, vec = np.linalg.eigh(cov)
+        sig = vec * np.sqrt(np.maximum(val, 0.))
+    return mean + np.dot(sig, np.random.normal(size=len(mean)))
+
+def _filter(y, F, G, V, W, m_0, C_0, out=None):
+    """
+    Run the Kalman filter on (T,q) observations y, with the parameters as
+    returned by _series, and return the log-likelihood. If out is given, the
+    filtered means and covariances and the one-step predictive means and
+    covariances of the states are stored in the arrays it holds.
+
+    The parameters are indexed modulo their length, so that those that are
+    the same at all times are shared.
+    """
+    T, q = y.shape
+    p = len(m_0)
+    loglike = -.5 * T * q * np.log(2.*np.pi)
+
+    for t in xrange(T):
+        # Predict the state.
+        if t == 0:
+            a, R = m_0, C_0
+        else:
+            Gt = G[t % len(G)]
+            a = np.dot(Gt, m)
+            R = np.dot(np.dot(Gt, C), Gt.T) + W[t % len(W)]
+
+        # Predict the observation, with covariance Q.
+        Ft = F[t % len(F)]
+        RF = np.dot(R, Ft.T)
+        Q = np.dot(Ft, RF) + V[t % len(V)]
+        e = y[t] - np.dot(Ft, a)
+        sign, logdet = np.linalg.slogdet(Q)
+        if sign <= 0:
+            raise LinAlgError, 'Covariance is not positive definite.'
+        solved = np.linalg.solve(Q, np.column_stack((RF.T, e)))
+        loglike -= .5 * (logdet + np.dot(e, solved[:,p]))
+
+        # Update the state.
+        m = a + np.dot(RF, solved[:,p])
+        C = R - np.dot(RF, solved[:,:p])
+
+        if out is not None:
+            out[0][t] = m
+            out[1][t] = C
+            out[2][t] = a
+            out[3][t] = R
+
+    return loglike
+
+def _parameters(T, q, F, G, V, W, m_0, C_0):
+    m_0, C_0 = _initial(m_0, C_0)
+    p = len(m_0)
+    return _series(F, T, (q, p), 'F'), _series(G, T, (p, p), 'G'), \
+        _series(V, T, (q, q), 'V'), _series(W, T, (p, p), 'W'), m_0, C_0
+
+def kalman_filter(y, F, G, V, W, m_0, C_0):
+    """
+    m, C, a, R, loglike = kalman_filter(y, F, G, V, W, m_0, C_0)
+
+    Kalman filter for the dynamic linear model. Returns the filtered means
+    m[t] and covariances C[t] of theta[t] given y[0..t], the predictive
+    means a[t] and covariances R[t] of theta[t] given y[0..t-1], and the
+    log-likelihood of y.
+
+    :Parameters:
+      y : (T,) or (T,q) array
+        The observations.
+      F, G, V, W, m_0, C_0 : arrays
+        The parameters of the model; see the module's docstring.
+    """
+    y = _observations(y)
+    T, q = y.shape
+    F, G, V, W, m_0, C_0 = _parameters(T, q, F, G, V, W, m_0, C_0)
+    p = len(m_0)
+    out = (np.empty((T,p)), np.empty((T,p,p)), np.empty((T,p)), np.empty((T,p,p)))
+    loglike = _filter(y, F, G, V, W, m_0, C_0, out)
+    return out + (loglike,)
+
+def ffbs(y, F, G, V, W, m_0, C_0, out=None):
+    """
+    theta = ffbs(y, F, G, V, W, m_0, C_0[, out])
+
+    Draw the states of the dynamic linear model given the observations y, by
+    forward filtering, backward sampling. Returns a (T,p) array.
+
+    :Parameters:
+      y : (T,) or (T,q) array
+        The observations.
+      F, G, V, W, m_0, C_0 : arrays
+        The parameters of the model; see the module's docstring.
+      out : tuple
+        Optional (T,p), (T,p,p), (T,p) and (T,p,p) arrays for the filter's
+        output, which can be reused between calls.
+    """
+    y = _observations(y)
+    T, q = y.shape
+    F, G, V, W, m_0, C_0 = _parameters(T, q, F, G, V, W, m_0, C_0)
+    p = len(m_0)
+    if out is None:
+        out = (np.empty((T,p)), np.empty((T,p,p)), np.empty((T,p)), np.empty((T,p,p)))
+    _filter(y, F, G, V, W, m_0, C_0, out)
+    m, C, a, R = out
+
+    theta = np.empty((T,p))
+    theta[-1] = _draw(m[-1], C[-1])
+    for t in xrange(T-2, -1, -1):
+        # B = C[t] G' R[t+1]^-1 is the gain of the backward recursion.
+        GC = np.dot(G[(t+1) % len(G)], C[t])
+        B = np.linalg.solve(R[t+1], GC).T
+        theta[t] = _draw(m[t] + np.dot(B, theta[t+1] - a[t+1]), C[t] - np.dot(B, GC))
+    return theta
+
+def dlm_like(x, F, G, V, W, m_0, C_0):
+    """
+    dlm_like(x, F, G, V, W, m_0, C_0)
+
+    Log-likelihood of observations x of a dynamic linear model, with the
+    states integrated out by the Kalman filter.
+
+    :Parameters:
+      x : (T,) or (T,q) array
+        The observations.
+      F : (q,p) or (T,q,p) array
+        Design matrices.
+      G : (p,p) or (T,p,p) array
+        System matrices.
+      V : (q,q) or (T,q,q) array
+        Observation covariances.
+      W : (p,p) or (T,p,p) array
+        System covariances.
+      m_0 : (p,) array
+        Mean of the initial state.
+      C_0 : (p,p) array
+        Covariance of the initial state.
+    """
+    y = _observations(x)
+    T, q = y.shape
+    try:
+        return _filter(y, *_parameters(T, q, F, G, V, W, m_0, C_0))
+    except LinAlgError:
+        return -np.inf
+
+def rdlm_states(G, W, m_0, C_0, T):
+    """
+    rdlm_states(G, W, m_0, C_0, T)
+
+    Random states of a dynamic linear model, as a (T,p) array.
+    """
+    m_0, C_0 = _initial(m_0, C_0)
+    p = len(m_0)
+    G = _series(G, T, (p, p), 'G')
+    W = _series(W, T, (p, p), 'W')
+    theta = np.empty((T,p))
+    theta[0] = _draw(m_0, C_0)
+    for t in xrange(1, T):
+        theta[t] = _draw(np.dot(G[t % len(G)], theta[t-1]), W[t % len(W)])
+    return theta
+
+def dlm_states_like(x, G, W, m_0, C_0):
+    """
+    dlm_states_like(x, G, W, m_0, C_0)
+
+    Log-likelihood of the states x of a dynamic linear model.
+
+    :Parameters:
+      x : (T,p) array
+        The states.
+      G : (p,p) or (T,p,p) array
+        System matrices.
+      W : (p,p) or (T,p,p) array
+        System covariances.
+      m_0 : (p,) array
+        Mean of the initial state.
+      C_0 : (p,p) array
+        Covariance of the initial state.
+    """
+    m_0, C_0 = _initial(m_0, C_0)
+    p = len(m_0)
+    x = _states(x, p)
+    T = len(x)
+    G = _series(G, T, (p, p), 'G')
+    W = _series(W, T, (p, p), 'W')
+    try:
+        like = _normal_like((x[0] - m_0)[np.newaxis,:], C_0[np.newaxis])
+        if T > 1:
+            like += _normal_like(x[1:] - _predict(x[:-1], G[1:] if len(G) > 1 else G), W[1:] if len(W) > 1 else W)
+        return like
+    except LinAlgError:
+        return -np.inf
+
+def rdlm_observations(theta, F, V):
+    """
+    rdlm_observations(theta, F, V)
+
+    Random observations of a dynamic linear model given its states.
+    """
+    q = _obs_dim(V)
+    theta = np.asarray(theta, dtype=float)
+    T = len(theta)
+    theta = theta.reshape((T, -1))
+    univariate = np.ndim(V) < 2
+    F = _series(F, T, (q, theta.shape[1]), 'F')
+    V = _series(V, T, (q, q), 'V')
+    y = _predict(theta, F)
+    for t in xrange(T):
+        y[t] = _draw(y[t], V[t % len(V)])
+    if univariate:
+        y = y[:,0]
+    return y
+
+def dlm_observations_like(x, theta, F, V):
+    """
+    dlm_observations_like(x, theta, F, V)
+
+    Log-likelihood of the observations x of a dynamic linear model, given
+    its states theta.
+
+    :Parameters:
+      x : (T,) or (T,q) array
+        The observations.
+      theta : (T,p) array
+        The states.
+      F : (q,p) or (T,q,p) array
+        Design matrices.
+      V : (q,q) or (T,q,q) array
+        Observation covariances.
+    """
+    y = _observations(x)
+    T, q = y.shape
+    theta = np.asarray(theta, dtype=float).reshape((T, -1))
+    F = _series(F, T, (q, theta.shape[1]), 'F')
+    V = _series(V, T, (q, q), 'V')
+    try:
+        return _normal_like(y - _predict(theta, F), V)
+    except LinAlgError:
+        return -np.inf
+
+def rdlm(F, G, V, W, m_0, C_0, T):
+    """
+    rdlm(F, G, V, W, m_0, C_0, T)
+
+    Random observations of a dynamic linear model.
+    """
+    return rdlm_observations(rdlm_states(G, W, m_0, C_0, T), F, V)
+
+
+class DLM(Stochastic):
+    __doc__ = """
+    D = DLM(name, F, G, V, W, m_0, C_0, value=None, T=None, observed=False,
+        trace=True, rseed=True, doc=None, cache_depth=2, plot=None, verbose=None)
+
+    Observations of a dynamic linear model, with the states integrated out.
+    The length T of the series is that of value, or must be given if value
+    is None.
+
+    Docstring of log-probability function:
+    """ + dlm_like.__doc__
+
+    def __init__(   self,
+                    name,
+                    F, G, V, W, m_0, C_0,
+                    value=None,
+                    T=None,
+                    observed=False,
+                    trace=True,
+                    cache_depth=2,
+                    rseed=True,
+                    plot=None,
+                    verbose=None):
+
+        if value is None:
+            if T is None:
+                raise ValueError, 'DLM %s must be given an initial value or a length T.' % name
+            value = rdlm(*Container([F, G, V, W, m_0, C_0]).value + [T])
+        T = len(value)
+
+        parents = {'F':F, 'G':G, 'V':V, 'W':W, 'm_0':m_0, 'C_0':C_0}
+        random = lambda F, G, V, W, m_0, C_0, T=T: rdlm(F, G, V, W, m_0, C_0, T)
+        Stochastic.__init__(self, valuewrapper(dlm_like), 'A dynamic linear model', name, parents, random, trace, value, np.dtype('float'), rseed, observed, cache_depth, plot, verbose)
+
+
+class DLMStates(Stochastic):
+    __doc__ = """
+    S = DLMStates(name, G, W, m_0, C_0, value=None, T=None, observed=False,
+        trace=True, rseed=True, doc=None, cache_depth=2, plot=None, verbose=None)
+
+    The states of a dynamic linear model, as a (T,p) array. The length T of
+    the series is that of value, or must be given if value is None.
+
+    Docstring of log-probability function:
+    """ + dlm_states_like.__doc__
+
+    def __init__(   self,
+                    name,
+                    G, W, m_0, C_0,
+                    value=None,
+                    T=None,
+                    observed=False,
+                    trace=True,
+                    cache_depth=2,
+                    rseed=True,
+                    plot=None,
+                    verbose=None):
+
+        if value is None:
+            if T is None:
+                raise ValueError, 'DLMStates %s must be given an initial value or a length T.' % name
+            value = rdlm_states(*Container([G, W, m_0, C_0]).value + [T])
+        T = len(value)
+
+        parents = {'G':G, 'W':W, 'm_0':m_0, 'C_0':C_0}
+        random = lambda G, W, m_0, C_0, T=T: rdlm_states(G, W, m_0, C_0, T)
+        Stochastic.__init__(self, valuewrapper(dlm_states_like), 'The states of a dynamic linear model', name, parents, random, trace, value, np.dtype('float'), rseed, observed, cache_depth, plot, verbose)
+
+
+class DLMObservations(Stochastic):
+    __doc__ = """
+    Y = DLMObservations(name, theta, F, V, value=None, observed=False,
+        trace=True, rseed=True, doc=None, cache_depth=2, plot=None, verbose=None)
+
+    Observations of a dynamic linear model given its states theta.
+
+    Docstring of log-probability function:
+    """ + dlm_observations_like.__doc__
+
+    def __init__(   self,
+                    name,
+                    theta, F, V,
+                    value=None,
+                    observed=False,
+                    trace=True,
+                    cache_depth=2,
+                    rseed=True,
+                    plot=None,
+                    verbose=None):
+
+        if value is None:
+            value = rdlm_observations(*Container([theta, F, V]).value)
+
+        parents = {'theta':theta, 'F':F, 'V':V}
+        Stochastic.__init__(self, valuewrapper(dlm_observations_like), 'Observations of a dynamic linear model', name, parents, rdlm_observations, trace, value, np.dtype('float'), rseed, observed, cache_depth, plot, verbose)
+
+
+class FFBS(ConjugateGibbs):
+    """
+    Applies to theta in the following submodel:
+
+    y ~ DLMObservations(theta, F, V)
+    theta ~ DLMStates(G, W, m_0, C_0)
+
+    Draws all the states jointly by forward filtering, backward sampling,
+    in O(T p^3) time. The arrays used by the filter are allocated once.
+    """
+    target_class = DLMStates
+    child_class = DLMObservations
+    parent_label = 'theta'
+
+    def __init__(self, stochastic, verbose=None):
+        ConjugateGibbs.__init__(self, stochastic, verbose=verbose)
+        self.observations = list(self.children)[0]
+        T, p = self._shape
+        self._out = (np.empty((T,p)), np.empty((T,p,p)), np.empty((T,p)), np.empty((T,p,p)))
+
+    @classmethod
+    def check(cls, stochastic):
+        super(FFBS, cls).check(stochastic)
+        if len(stochastic.extended_children) > 1:
+            raise ValueError, 'Stochastic %s must have a single DLMObservations child for FFBS to apply.' % stochastic
+
+    @classmethod
+    def check_child(cls, stochastic, child):
+        if np.ndim(stochastic.value) != 2 or len(child.value) != len(stochastic.value):
+            raise ValueError, 'The states %s must be a (T,p) array, and %s must have T observations for FFBS to apply.' \
+                % (stochastic, child)
+
+    def propose(self):
+        states = self.stochastic.parents.value
+        observations = self.observations.parents.value
+        self.stochastic.value = ffbs(self.observations.value, observations['F'], states['G'], observations['V'],
+            states['W'], states['m_0'], states['C_0'], out=self._out)
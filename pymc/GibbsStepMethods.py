@@ -0,0 +1,363 @@
+"""
+Gibbs step methods for conjugate submodels.
+
+If, in the following model:
+
+B_i|A ~ d2(A, p2_i)
+A ~ d1(p1)
+
+every stochastic or potential whose log-probability depends on A is one of
+the B_i, the B_i are direct children of A, and A enters them only as the
+parameter for which d1 is the conjugate prior of d2, then A's distribution
+conditional on the B_i is d1 with updated parameters p1_*, and A can be
+drawn from it exactly.
+
+The step methods below check for such submodels when MCMC assigns step
+methods, and claim the stochastics they apply to with competence
+`pymc.StepMethods.conjugate_Gibbs_competence`. Setting it to 0 turns the
+automatic assignment off.
+
+Array-valued stochastics are updated in a single draw. As in the
+log-probability functions, the children's values are matched with the
+stochastic's value by broadcasting, and the sufficient statistics are
+summed over the broadcast axes.
+
+Deterministic children of A are allowed, as long as no stochastic or
+potential depends on them.
+"""
+
+import numpy as np
+import StepMethods
+from StepMethods import Gibbs
+from Node import ContainerBase
+import distributions
+import utils
+
+__docformat__='reStructuredText'
+
+__all__ = ['ConjugateGibbs', 'GammaNormal', 'GammaPoisson', 'GammaExponential', 'GammaGamma',
+    'NormalNormalMean', 'BetaBinomial', 'BetaGeometric', 'DirichletMultinomial', 'WishartMvNormal']
+
+def broadcasts_to(shape, target):
+    """
+    Return True if an array of the given shape is broadcast against an
+    array of shape target without enlarging it.
+    """
+    if len(shape) > len(target):
+        return False
+    for n, m in zip(shape[::-1], target[::-1]):
+        if n != m and n != 1:
+            return False
+    return True
+
+
+class ConjugateGibbs(Gibbs):
+    """
+    Base class for the conjugate Gibbs step methods.
+
+    Subclasses define:
+      - target_class : The distribution of the stochastic.
+      - child_class : The distribution, or tuple of distributions, of its
+        children.
+      - parent_label : The name of the children's parent the stochastic
+        must be.
+      - propose : Draw the stochastic's value from its full conditional
+        distribution.
+    """
+    conjugate = True
+
+    def __init__(self, stochastic, verbose=None):
+        self.check(stochastic)
+        Gibbs.__init__(self, stochastic, verbose=verbose)
+        self._shape = np.shape(stochastic.value)
+
+    @classmethod
+    def check(cls, stochastic):
+        """
+        Raise a ValueError unless the distribution of stochastic conditional
+        on its children is conjugate to its prior.
+        """
+        for attr in ['target_class', 'child_class', 'parent_label']:
+            if not hasattr(cls, attr):
+                raise ValueError, '%s is not a conjugate step method.' % cls.__name__
+
+        if not isinstance(stochastic, cls.target_class):
+            raise ValueError, 'Stochastic %s must be %s for %s to apply.' \
+                % (stochastic, cls.target_class.__name__, cls.__name__)
+
+        if len(stochastic.extended_children) == 0:
+            raise ValueError, 'Stochastic %s has no children for %s to apply.' % (stochastic, cls.__name__)
+
+        child_classes = cls.child_class
+        if not isinstance(child_classes, tuple):
+            child_classes = (child_classes,)
+
+        for child in stochastic.extended_children:
+            if not isinstance(child, child_classes) or not child in stochastic.children:
+                raise ValueError, 'Stochastic %s must only have direct %s children for %s to apply.' \
+                    % (stochastic, ' or '.join([c.__name__ for c in child_classes]), cls.__name__)
+
+            for key, parent in child.parents.iteritems():
+                if key == cls.parent_label:
+                    if parent is not stochastic:
+                        raise ValueError, 'Stochastic %s must be the %s parent of %s for %s to apply.' \
+                            % (stochastic, key, child, cls.__name__)
+                elif parent is stochastic or (isinstance(parent, ContainerBase) and stochastic in parent.variables):
+                    raise ValueError, 'Stochastic %s must only be the %s parent of %s for %s to apply.' \
+                        % (stochastic, cls.parent_label, child, cls.__name__)
+
+            cls.check_child(stochastic, child)
+
+    @classmethod
+    def check_child(cls, stochastic, child):
+        """
+        Raise a ValueError if the values of stochastic and child do not
+        match. By default, each element of the child's value must depend on
+        one element of the stochastic's value.
+        """
+        if not broadcasts_to(np.shape(stochastic.value), np.shape(child.value)):
+            raise ValueError, 'The value of stochastic %s must broadcast against the value of %s for %s to apply.' \
+                % (stochastic, child, cls.__name__)
+
+    @classmethod
+    def competence(cls, stochastic):
+        try:
+            cls.check(stochastic)
+        except ValueError:
+            return 0
+        return StepMethods.conjugate_Gibbs_competence
+
+    def sum(self, child, x):
+        """
+        Sum the contributions x of child's elements to the elements of the
+        stochastic.
+        """
+        return utils.sum_to_shape(x + np.zeros(np.shape(child.value)), self.stochastic.value)
+
+    def set_value(self, value):
+        value = np.reshape(value, self._shape)
+        if not self._shape:
+            value = value[()]
+        self.stochastic.value = value
+
+
+class GammaX(ConjugateGibbs):
+    """
+    Base class for the step methods of Gamma stochastics. Subclasses
+    define statistics, returning the terms added to the stochastic's alpha
+    and beta parameters.
+    """
+    target_class = distributions.Gamma
+
+    def propose(self):
+        a, b = self.statistics()
+        alpha = self.stochastic.parents.value['alpha'] + a
+        beta = self.stochastic.parents.value['beta'] + b
+        self.set_value(np.random.gamma(alpha, 1./beta))
+
+
+class GammaNormal(GammaX):
+    """
+    Applies to tau in the following submodel:
+
+    d_i ~ind Normal(mu_i, tau)
+    tau ~ Gamma(alpha, beta)
+    """
+    child_class = distributions.Normal
+    parent_label = 'tau'
+
+    def statistics(self):
+        a = b = 0.
+        for child in self.children:
+            delta = np.asarray(child.value, dtype=float) - child.parents.value['mu']
+            a = a + self.sum(child, .5)
+            b = b + self.sum(child, .5 * delta**2)
+        return a, b
+
+
+class GammaPoisson(GammaX):
+    """
+    Applies to mu in the following submodel:
+
+    d_i ~ind Poisson(mu)
+    mu ~ Gamma(alpha, beta)
+    """
+    child_class = distributions.Poisson
+    parent_label = 'mu'
+
+    def statistics(self):
+        a = b = 0.
+        for child in self.children:
+            a = a + self.sum(child, np.asarray(child.value, dtype=float))
+            b = b + self.sum(child, 1.)
+        return a, b
+
+
+class GammaExponential(GammaX):
+    """
+    Applies to beta in the following submodel:
+
+    d_i ~ind Exponential(beta)
+    beta ~ Gamma(alpha, beta)
+    """
+    child_class = distributions.Exponential
+    parent_label = 'beta'
+
+    def statistics(self):
+        a = b = 0.
+        for child in self.children:
+            a = a + self.sum(child, 1.)
+            b = b + self.sum(child, np.asarray(child.value, dtype=float))
+        return a, b
+
+
+class GammaGamma(GammaX):
+    """
+    Applies to beta in the following submodel:
+
+    d_i ~ind Gamma(alpha_i, beta)
+    beta ~ Gamma(alpha, beta)
+    """
+    child_class = distributions.Gamma
+    parent_label = 'beta'
+
+    def statistics(self):
+        a = b = 0.
+        for child in self.children:
+            a = a + self.sum(child, child.parents.value['alpha'])
+            b = b + self.sum(child, np.asarray(child.value, dtype=float))
+        return a, b
+
+
+class NormalNormalMean(ConjugateGibbs):
+    """
+    Applies to mu in the following submodel:
+
+    d_i ~ind Normal(mu, tau_i)
+    mu ~ Normal(mu_0, tau_0)
+    """
+    target_class = distributions.Normal
+    child_class = distributions.Normal
+    parent_label = 'mu'
+
+    def propose(self):
+        tau = self.stochastic.parents.value['tau']
+        weighted = tau * self.stochastic.parents.value['mu']
+        for child in self.children:
+            tau_child = child.parents.value['tau']
+            tau = tau + self.sum(child, tau_child)
+            weighted = weighted + self.sum(child, tau_child * np.asarray(child.value, dtype=float))
+        self.set_value(np.random.normal(weighted / tau, 1. / np.sqrt(tau)))
+
+
+class BetaX(ConjugateGibbs):
+    """
+    Base class for the step methods of Beta stochastics. Subclasses
+    define statistics, returning the terms added to the stochastic's alpha
+    and beta parameters.
+    """
+    target_class = distributions.Beta
+
+    def propose(self):
+        a, b = self.statistics()
+        alpha = self.stochastic.parents.value['alpha'] + a
+        beta = self.stochastic.parents.value['beta'] + b
+        self.set_value(np.random.beta(alpha, beta))
+
+
+class BetaBinomial(BetaX):
+    """
+    Applies to p in the following submodel:
+
+    d_i ~ind Binomial(n_i, p) or Bernoulli(p)
+    p ~ Beta(alpha, beta)
+    """
+    child_class = (distributions.Binomial, distributions.Bernoulli)
+    parent_label = 'p'
+
+    def statistics(self):
+        a = b = 0.
+        for child in self.children:
+            x = np.asarray(child.value, dtype=float)
+            n = child.parents.value.get('n', 1)
+            a = a + self.sum(child, x)
+            b = b + self.sum(child, n - x)
+        return a, b
+
+
+class BetaGeometric(BetaX):
+    """
+    Applies to p in the following submodel:
+
+    d_i ~ind Geometric(p)
+    p ~ Beta(alpha, beta)
+    """
+    child_class = distributions.Geometric
+    parent_label = 'p'
+
+    def statistics(self):
+        a = b = 0.
+        for child in self.children:
+            a = a + self.sum(child, 1.)
+            b = b + self.sum(child, np.asarray(child.value, dtype=float) - 1)
+        return a, b
+
+
+class DirichletMultinomial(ConjugateGibbs):
+    """
+    Applies to p in the following submodel:
+
+    d_i ~ind Multinomial(n_i, p)
+    p ~ Dirichlet(theta)
+
+    where p holds the first k-1 probabilities and the values of the d_i
+    are (k,) or (m,k) arrays of counts.
+    """
+    target_class = distributions.Dirichlet
+    child_class = distributions.Multinomial
+    parent_label = 'p'
+
+    @classmethod
+    def check_child(cls, stochastic, child):
+        shape, child_shape = np.shape(stochastic.value), np.shape(child.value)
+        if len(shape) != 1 or not len(child_shape) in (1, 2) or child_shape[-1] != shape[0] + 1:
+            raise ValueError, 'The values of %s must be counts of the %i categories of %s for %s to apply.' \
+                % (child, len(shape) and shape[0] + 1, stochastic, cls.__name__)
+
+    def propose(self):
+        theta = np.asarray(self.stochastic.parents.value['theta'], dtype=float).ravel()
+        for child in self.children:
+            theta = theta + np.atleast_2d(child.value).sum(0)
+        g = np.random.gamma(theta)
+        self.set_value((g / g.sum())[:-1])
+
+
+class WishartMvNormal(ConjugateGibbs):
+    """
+    Applies to tau in the following submodel:
+
+    d_i ~ind MvNormal(mu_i, tau)
+    tau ~ Wishart(n, Tau)
+
+    where the values of the d_i are (k,) vectors or (m,k) arrays of
+    vectors.
+    """
+    target_class = distributions.Wishart
+    child_class = distributions.MvNormal
+    parent_label = 'tau'
+
+    @classmethod
+    def check_child(cls, stochastic, child):
+        shape, child_shape = np.shape(stochastic.value), np.shape(child.value)
+        if len(shape) != 2 or not len(child_shape) in (1, 2) or child_shape[-1] != shape[0]:
+            raise ValueError, 'The values of %s must be vectors of the size of %s for %s to apply.' \
+                % (child, stochastic, cls.__name__)
+
+    def propose(self):
+        n = self.stochastic.parents.value['n']
+        Tau = np.array(self.stochastic.parents.value['Tau'], dtype=float)
+        for child in self.children:
+            delta = np.atleast_2d(np.asarray(child.value, dtype=float) - np.ravel(child.parents.value['mu']))
+            n = n + len(delta)
+            Tau = Tau + np.dot(delta.T, delta)
+        self.stochastic.value = distributions.rwishart(n, Tau)
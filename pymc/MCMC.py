@@ -11,6 +11,8 @@ from distributions import absolute_loss, squared_loss, chi_square_loss
 import sys, time, pdb
 import numpy as np
 from utils import crawl_dataless
+from NormalSubmodel import NormalSubmodel, find_normal_submodels
+from pymc import database
 
 GuiInterrupt = 'Computation halt'
 Paused = 'Computation paused'
@@ -60,6 +62,12 @@ class MCMC(Sampler):
               of the stochastics and deterministics sampled during the MCMC loop.
           - verbose : integer
               Level of output verbosity: 0=none, 1=low, 2=medium, 3=high
+          - buffer : integer
+              Number of iterations the database accumulates before writing
+              them as a block (see Sampler).
+          - online : bool
+              Keep running summary statistics of the tallied variables
+              (see Sampler).
           - **kwds :
               Keywords arguments to be passed to the database instantiation method.
         """
@@ -94,6 +102,8 @@ class MCMC(Sampler):
                 print '\t'+s.__name__
         if self._sm_assigned:
             self.step_methods.add(new_method)
+        if self.schedule is not None:
+            new_method.use_schedule(self.schedule)
             
         setattr(new_method, '_model', self)
     
@@ -132,6 +142,16 @@ class MCMC(Sampler):
                         if self.verbose > 1:
                             print 'Assigning step method %s to stochastic %s' % (new_method.__class__.__name__, d.__name__)
 
+            # Then update linear-Gaussian blocks jointly
+            unassigned = [s for s in self.stochastics if len(self.step_method_dict[s])==0]
+            for block in find_normal_submodels(unassigned):
+                new_method = NormalSubmodel(block)
+                setattr(new_method, '_model', self)
+                for s in block:
+                    self.step_method_dict[s].append(new_method)
+                    if self.verbose > 1:
+                        print 'Assigning step method %s to stochastic %s' % (new_method.__class__.__name__, s.__name__)
+
             for s in self.stochastics:
                 # If not handled by any step method, make it a new step method using the registry
                 if len(self.step_method_dict[s])==0:
@@ -150,12 +170,28 @@ class MCMC(Sampler):
                     for name in sm._tuning_info:
                         self._funs_to_tally[sm._id+'_'+name] = lambda name=name, sm=sm: getattr(sm, name)
 
+            if self.schedule is not None:
+                for sm in self.step_methods:
+                    sm.use_schedule(self.schedule)
+
         self.restore_sm_state()
         self._sm_assigned = True
 
-    def sample(self, iter, burn=0, thin=1, tune_interval=1000, tune_throughout=True, save_interval=None, verbose=0):
+    def compile(self):
+        """
+        Build the model's Schedule (see Model.compile) and let all step
+        methods, assigned now if necessary, evaluate log-probabilities
+        through it.
         """
-        sample(iter, burn, thin, tune_interval, tune_throughout, save_interval, verbose)
+        schedule = Sampler.compile(self)
+        self.assign_step_methods()
+        for sm in self.step_methods:
+            sm.use_schedule(schedule)
+        return schedule
+
+    def sample(self, iter, burn=0, thin=1, tune_interval=1000, tune_throughout=True, save_interval=None, verbose=0, chains=1, n_jobs=1):
+        """
+        sample(iter, burn, thin, tune_interval, tune_throughout, save_interval, verbose, chains, n_jobs)
 
         Initialize traces, run sampling loop, clean up afterward. Calls _loop.
 
@@ -174,8 +210,19 @@ class MCMC(Sampler):
           - save_interval : int or None
             If given, the model state will be saved at intervals of this many iterations
           - verbose : boolean
+          - chains : int
+            Number of independent chains to run, default 1. Each chain is
+            appended to the database as a separate chain.
+          - n_jobs : int
+            Number of worker processes running the chains, default 1. Each
+            worker is forked from the current process and seeded independently.
         """
 
+        if chains > 1 or n_jobs > 1:
+            self._sample_chains(chains, n_jobs, iter=iter, burn=burn, thin=thin, tune_interval=tune_interval,
+                tune_throughout=tune_throughout, save_interval=save_interval, verbose=verbose)
+            return
+
         self.assign_step_methods()
 
         if burn >= iter:
@@ -196,6 +243,48 @@ class MCMC(Sampler):
 
         Sampler.sample(self, iter, length, verbose)
 
+    def _sample_chains(self, chains, n_jobs, **kwds):
+        """
+        Run several independent chains, in up to n_jobs worker processes, and
+        append them to the database as separate chains.
+        """
+
+        if n_jobs <= 1:
+            for i in xrange(chains):
+                self.sample(**kwds)
+            return
+
+        try:
+            import multiprocessing
+        except ImportError:
+            raise ImportError, 'Sampling with n_jobs > 1 requires the multiprocessing module (Python 2.6 or later).'
+
+        # Step methods must exist before forking so that their tallied
+        # attributes are known to the parent's database.
+        self.assign_step_methods()
+
+        global _parallel_sampler
+        _parallel_sampler = self
+        seeds = np.random.randint(0, 2**30, size=chains)
+        pool = multiprocessing.Pool(min(n_jobs, chains))
+        try:
+            # Chains are merged into the database as soon as they complete.
+            for values, state in pool.imap_unordered(_sample_chain, [(seed, kwds) for seed in seeds]):
+                if self.verbose > 0:
+                    print 'Chain %i of %i complete.' % (self.db.chains+1, chains)
+                self.db._append_chain(values)
+                self.db.savestate(state)
+        finally:
+            pool.close()
+            pool.join()
+            _parallel_sampler = None
+
+        # Leave the model in the state reached at the end of the last chain.
+        self.restore_sampler_state()
+        self.restore_sm_state()
+        for v in self._variables_to_tally:
+            v.trace = self.db._traces[v.__name__]
+
     def _loop(self):
         # Set status flag
         self.status='running'
@@ -351,3 +440,26 @@ class MCMC(Sampler):
     dic = property(_get_dic)
 
 
+# The sampler forked by MCMC._sample_chains. Worker processes inherit it from
+# the parent, so that models need not be picklable.
+_parallel_sampler = None
+
+def _sample_chain(args):
+    """
+    Sample one chain of the forked sampler in a worker process and return the
+    traces of that chain along with the sampler's final state.
+    """
+    seed, kwds = args
+    M = _parallel_sampler
+    np.random.seed(seed)
+
+    # Never share the parent's files or connections; tally in memory and
+    # let the parent write to its own backend.
+    M.db = database.ram.Database(M.__name__ + '.ram')
+    M.db.connect_model(M)
+    M.sample(**kwds)
+
+    values = {}
+    for name in M.db.trace_names[-1]:
+        values[name] = M.db._traces[name].gettrace(chain=-1)
+    return values, M.get_state()
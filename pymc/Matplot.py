@@ -17,7 +17,7 @@ from pprint import pformat
 from numpy import arange, log, ravel, rank, swapaxes, linspace, concatenate, asarray, ndim
 from numpy import histogram2d, mean, std, sort, prod, floor, shape, size, transpose
 from numpy import apply_along_axis, atleast_1d, min as nmin, max as nmax, abs, append, ones, dtype
-from utils import autocorr as _autocorr
+from utils import autocorr_all as _autocorr_all
 import pdb
 from scipy import special
 
@@ -630,14 +630,15 @@ def autocorrelation(data, name, maxlag=100, format='png', suffix='-acf', path='.
             Specifies location for saving plots (defaults to local directory).
     """
 
-    # If there is just one data series, wrap it in a list
-    if rank(data)==1:
-        data = [data]
+    # Autocorrelations of all the elements of the trace, one series per
+    # element.
+    data = asarray(data)
+    acf = transpose(_autocorr_all(data.reshape(len(data), -1), maxlag))
 
     # Number of plots per page
-    rows = min(len(data), 4)
+    rows = min(len(acf), 4)
 
-    for i,values in enumerate(data):
+    for i,y in enumerate(acf):
         if verbose>0:
             print 'Plotting', name+suffix
 
@@ -647,8 +648,7 @@ def autocorrelation(data, name, maxlag=100, format='png', suffix='-acf', path='.
 
         # New subplot
         subplot(rows, 1, i - (rows*(i/rows)) + 1)
-        x = arange(maxlag)
-        y = [_autocorr(values, lag=i) for i in x]
+        x = arange(len(y))
 
         bar(x, y)
 
@@ -664,7 +664,7 @@ def autocorrelation(data, name, maxlag=100, format='png', suffix='-acf', path='.
         setp(tlabels, 'fontsize', fontmap[rows])
 
         # Save to file
-        if not (i+1) % rows or i == len(values)-1:
+        if not (i+1) % rows or i == len(acf)-1:
 
             # Label X-axis on last subplot
             xlabel('Lag', fontsize='x-small')
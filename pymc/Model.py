@@ -7,13 +7,15 @@ Base classes Model and Sampler are defined here.
 # 20/03/2007 -DH- Separated Model from Sampler. Removed _prepare(). Commented __setattr__ because it breaks properties.
 
 __docformat__='reStructuredText'
-__all__ = ['Model', 'Sampler']
+__all__ = ['Model', 'Sampler', 'Schedule']
 
 """ Summary"""
 
 from numpy import zeros, floor
+import numpy as np
 from pymc import database
-from PyMCObjects import Stochastic, Deterministic, Node, Variable, Potential
+from PyMCObjects import Stochastic, Deterministic, Node, Variable, Potential, d_neg_inf
+from Node import ZeroProbability
 from Container import Container, ObjectContainer
 import sys,os
 from copy import copy
@@ -31,6 +33,71 @@ Paused = 'Computation paused'
 class EndofSampling(Exception):
     pass
 
+class _NotVectorizable(Exception):
+    # Raised when a batch of points cannot be pushed through a node without
+    # setting the model's values.
+    pass
+
+
+class Schedule(object):
+    """
+    A flat, topologically ordered representation of a model's directed acyclic
+    graph, built once by Model.compile. Step methods evaluate the
+    log-probabilities of their Markov blankets through it, calling the nodes'
+    lazy log-probability functions directly instead of going through their
+    logp attributes.
+
+      >>> S = Schedule(nodes)
+
+    :Parameters:
+      - nodes : iterable
+          Variables and potentials. Their ancestors are included automatically.
+
+    :Attributes:
+      - nodes : tuple
+          All the nodes, each one after all its parents.
+      - index : dictionary
+          The position of each node in nodes.
+      - parents : tuple
+          For each node, an integer array holding the positions of its parents.
+      - logp_functions : tuple
+          For each node, the get method of the LazyFunction computing its
+          log-probability, or None for deterministics and nodes without one.
+
+    :Note:
+      The schedule holds references to the nodes' LazyFunctions, which are
+      replaced when a node's parents change. Compile the model again after
+      changing parents.
+
+    :SeeAlso: Model.compile, StepMethod.use_schedule
+    """
+    def __init__(self, nodes):
+        self.nodes = tuple(utils.find_topological_order(nodes))
+        self.index = dict([(node, i) for i, node in enumerate(self.nodes)])
+
+        parents = []
+        logp_functions = []
+        for node in self.nodes:
+            parents.append(np.array([self.index[p] for p in node.parents.variables], dtype=int))
+            lazy_logp = getattr(node, '_logp', None)
+            if isinstance(node, Deterministic) or lazy_logp is None:
+                logp_functions.append(None)
+            else:
+                logp_functions.append(lazy_logp.get)
+        self.parents = tuple(parents)
+        self.logp_functions = tuple(logp_functions)
+
+    def terms(self, nodes):
+        """
+        Return the (node, logp function) pairs of the given stochastics and
+        potentials, in schedule order. Pass the result to logp_of_terms.
+        """
+        index = self.index
+        return tuple([(node, self.logp_functions[index[node]]) for node in sorted(nodes, key=index.__getitem__)])
+
+    def __len__(self):
+        return len(self.nodes)
+
 
 class Model(ObjectContainer):
     """
@@ -91,6 +158,7 @@ class Model(ObjectContainer):
         if name is not None:
             self.__name__ = name
         self.verbose = verbose
+        self.schedule = None
 
     def _get_generations(self):
         if not hasattr(self, '_generations'):
@@ -121,6 +189,208 @@ class Model(ObjectContainer):
                 except:
                     pass
 
+    def compile(self):
+        """
+        Order the model's nodes topologically and build the Schedule through
+        which step methods evaluate log-probabilities. The schedule is stored
+        as self.schedule and returned.
+
+        Call compile again after changing the parents of any node.
+        """
+        nodes = set(self.nodes)
+        for s in self.stochastics:
+            nodes |= s.extended_children
+        self.schedule = Schedule(nodes)
+        return self.schedule
+
+    def grad_logp(self, stochastics=None):
+        """
+        Return the gradient of the model's joint log-probability with respect
+        to the values of some stochastics, as a dictionary keyed by stochastic.
+
+        :Parameters:
+          - stochastics (optional) : list
+            The stochastics to differentiate with respect to. Defaults to all
+            of self's float-valued free stochastics.
+
+        The gradients are computed analytically from the `grad` and
+        `parent_grads` attributes of the log-probability functions (see
+        distributions.py), and are chained through Deterministics that
+        declare Jacobians. NotImplementedError is raised if any of these are
+        missing.
+
+        :SeeAlso: logp, utils.logp_gradient
+        """
+        if stochastics is None:
+            stochastics = [s for s in self.stochastics if s.dtype in utils.float_dtypes]
+
+        grads = {}
+        for s in stochastics:
+            grad = utils.logp_gradient(s, s)
+            for child in s.extended_children:
+                grad = grad + utils.logp_gradient(child, s)
+            grads[s] = grad
+        return grads
+
+    def logp_batch(self, points):
+        """
+        Return the joint log-probability of the model at many points at once.
+
+        :Parameters:
+          - points : dictionary or array
+            Either a dictionary mapping free stochastics (or their names) to
+            arrays whose first axis indexes the points, or a two-dimensional
+            array with one row per point whose columns hold the raveled values
+            of all of self's stochastics, sorted by name. Stochastics missing
+            from a dictionary keep their current value.
+
+        :Returns: An array holding one log-probability per point; points outside
+            the support get -inf.
+
+        Log-probability functions carrying an `elementwise` attribute (see
+        distributions.py) are evaluated for all points in a single call.
+        Deterministics and other log-probability functions are evaluated point
+        by point. The values of the nodes are left untouched.
+
+        :SeeAlso: logp
+        """
+        n, batched = self._batch_points(points)
+
+        olderr = np.seterr(all='ignore')
+        try:
+            try:
+                return self._logp_batch(n, batched)
+            except _NotVectorizable:
+                return self._logp_pointwise(n, batched)
+        finally:
+            np.seterr(**olderr)
+
+    def _batch_points(self, points):
+        # Return the number of points and a dictionary mapping free
+        # stochastics to their values at all points.
+
+        if isinstance(points, dict):
+            names = dict([(s.__name__, s) for s in self.stochastics])
+            batched = {}
+            for key, value in points.iteritems():
+                s = names.get(key, key)
+                if not s in self.stochastics:
+                    raise ValueError, 'Can only evaluate batches of values of free stochastics of %s, got %s.' % (self.__name__, key)
+                batched[s] = np.asarray(value)
+        else:
+            points = np.atleast_2d(points)
+            stochastics = sorted(self.stochastics, key=lambda s: s.__name__)
+            sizes = [np.size(s.value) for s in stochastics]
+            if points.shape[1] != sum(sizes):
+                raise ValueError, 'Points must have %i columns, one per element of %s.' % (sum(sizes), ', '.join([s.__name__ for s in stochastics]))
+            batched = {}
+            start = 0
+            for s, size in zip(stochastics, sizes):
+                value = points[:, start:start+size].reshape((-1,) + np.shape(s.value))
+                batched[s] = value.astype(s.dtype)
+                start += size
+
+        lengths = set([len(value) for value in batched.itervalues()])
+        if len(lengths) != 1:
+            raise ValueError, 'All stochastics must be given the same number of points.'
+        return lengths.pop(), batched
+
+    def _logp_batch(self, n, batched):
+        # Vectorized evaluation. Each variable's value is stored with a flag
+        # indicating whether it carries a leading axis indexing the points.
+
+        logp_nodes = self.stochastics | self.observed_stochastics | self.potentials
+        values = {}
+
+        def parent_values(node):
+            out = {}
+            for key, parent in node.parents.iteritems():
+                if isinstance(parent, Variable):
+                    out[key] = values[parent]
+                elif isinstance(parent, ContainerBase):
+                    for v in parent.variables:
+                        if values[v][1]:
+                            raise _NotVectorizable
+                    out[key] = (parent.value, False)
+                else:
+                    out[key] = (parent, False)
+            return out
+
+        def row(args, i):
+            return dict([(key, v[i] if b else v) for key, (v, b) in args.iteritems()])
+
+        def pointwise(fun, args):
+            logp = np.empty(n)
+            for i in xrange(n):
+                try:
+                    logp[i] = fun(**row(args, i))
+                except ZeroProbability:
+                    logp[i] = -np.inf
+            logp[logp <= d_neg_inf] = -np.inf
+            return logp
+
+        for node in utils.find_topological_order(logp_nodes):
+            if isinstance(node, Potential):
+                continue
+            if node in batched:
+                values[node] = (batched[node], True)
+            elif isinstance(node, Deterministic):
+                args = parent_values(node)
+                if any([b for v, b in args.itervalues()]):
+                    values[node] = (np.array([node._eval_fun(**row(args, i)) for i in xrange(n)]), True)
+                else:
+                    values[node] = (node.value, False)
+            else:
+                values[node] = (node.value, False)
+
+        logp = np.zeros(n)
+        for node in logp_nodes:
+            args = parent_values(node)
+            if isinstance(node, Stochastic):
+                args['value'] = values[node]
+
+            if not any([b for v, b in args.itervalues()]):
+                try:
+                    logp += node.logp
+                except ZeroProbability:
+                    logp[:] = -np.inf
+                continue
+
+            elementwise = getattr(node._logp_fun, 'elementwise', None)
+            if elementwise is None or not isinstance(node, Stochastic):
+                logp += pointwise(node._logp_fun, args)
+                continue
+
+            # Align the trailing axes of the batched arguments with those of
+            # the others before broadcasting.
+            ndim = max([np.ndim(v) - b for v, b in args.itervalues()])
+            aligned = {}
+            for key, (v, b) in args.iteritems():
+                if b:
+                    v = np.reshape(v, (n,) + (1,)*(ndim - np.ndim(v) + 1) + np.shape(v)[1:])
+                aligned[key] = v
+            value = aligned.pop('value')
+            logp += np.reshape(elementwise(value, **aligned), (n, -1)).sum(1)
+
+        return logp
+
+    def _logp_pointwise(self, n, batched):
+        # Fallback: set the values of the stochastics point by point.
+        current = dict([(s, s.value) for s in batched])
+        logp = np.empty(n)
+        try:
+            for i in xrange(n):
+                for s, value in batched.iteritems():
+                    s.value = value[i]
+                try:
+                    logp[i] = self.logp
+                except ZeroProbability:
+                    logp[i] = -np.inf
+        finally:
+            for s, value in current.iteritems():
+                s.value = value
+        return logp
+
 
 
 
@@ -157,7 +427,7 @@ class Sampler(Model):
 
     :SeeAlso: Model, MCMC.
     """
-    def __init__(self, input=None, db='ram', name='Sampler', reinit_model=True, calc_deviance=False, verbose=0, **kwds):
+    def __init__(self, input=None, db='ram', name='Sampler', reinit_model=True, calc_deviance=False, verbose=0, buffer=None, online=None, **kwds):
         """Initialize a Sampler instance.
 
         :Parameters:
@@ -171,6 +441,14 @@ class Sampler(Model):
               Flag for reinitialization of Model superclass.
           - calc_deviance : bool
               Flag for calculating model deviance.
+          - buffer : int
+              Number of iterations the database accumulates before writing
+              them as a block. 1 disables buffering. By default, the
+              backend's own setting is used.
+          - online : bool
+              If True, the database keeps running summary statistics of
+              the tallied variables, available during sampling and with
+              the no_trace backend. See `Sampler.stats`.
           - **kwds :
               Keywords arguments to be passed to the database instantiation method.
         """
@@ -189,6 +467,10 @@ class Sampler(Model):
         # Specify database backend and save its keywords
         self._db_args = kwds
         self._assign_database_backend(db)
+        if buffer is not None:
+            self.db.buffer = buffer
+        if online is not None:
+            self.db.online = online
 
         # Flag for model state
         self.status = 'ready'
@@ -288,6 +570,11 @@ class Sampler(Model):
     def stats(self, alpha=0.05, start=0, variable=None):
         """
         Statistical output for variables.
+
+        The statistics are computed from the traces. If the traces cannot be
+        read, as with the no_trace backend, and the sampler was created with
+        `online=True`, the running summaries of the last chain are returned
+        (see Variable.stats and Variable.online_stats).
         """
         if variable is not None:
             return variable.stats(alpha=alpha, start=start)
@@ -337,6 +624,7 @@ class Sampler(Model):
           - `ram` : Traces stored in memory.
           - `txt` : Traces stored in memory and saved in txt files at end of
                 sampling.
+          - `npy` : Traces stored in memory-mapped NumPy .npy files.
           - `sqlite` : Traces stored in sqlite database.
           - `mysql` : Traces stored in a mysql database.
           - `hdf5` : Traces stored in an HDF5 file.
@@ -467,12 +755,28 @@ class Sampler(Model):
         self._sampling_thread.start()
         self.iprompt()
 
+    def _print_summaries(self, out=sys.stdout):
+        """Print the running summaries of the tallied variables."""
+        if not self.db.online:
+            print >> out, 'No running summaries: create the sampler with online=True.'
+            return
+        for v in sorted(self._variables_to_tally, key=lambda v: v.__name__):
+            stats = v.online_stats()
+            if not stats:
+                continue
+            print >> out, v.__name__
+            for key in ['mean', 'standard deviation', 'mc error']:
+                print >> out, '\t%s: %s' % (key, stats[key])
+            print >> out, '\tquantiles: %s' % ', '.join(['%s: %s' % (q, stats['quantiles'][q]) for q in sorted(stats['quantiles'])])
+
     def iprompt(self, out=sys.stdout):
         """Start a prompt listening to user input."""
 
         cmds = """
         Commands:
           i -- index: print current iteration index
+          s -- stats: print the running summaries of the variables,
+                      if the sampler was created with online=True.
           p -- pause: interrupt sampling and return to the main console.
                       Sampling can be resumed later with icontinue().
           h -- halt:  stop sampling and truncate trace. Sampling cannot be
@@ -508,6 +812,9 @@ class Sampler(Model):
                     if cmd == 'i':
                         print >> out,  'Current iteration: ', self._current_iter
                         prompt = True
+                    elif cmd == 's':
+                        self._print_summaries(out)
+                        prompt = True
                     elif cmd == 'p':
                         self.status = 'paused'
                         break
@@ -10,6 +10,7 @@ import os, sys, pdb
 import numpy as np
 import types
 
+d_neg_inf = float(-1.7976931348623157e+308)
 
 def logp_of_set(s):
     exc = None
@@ -28,6 +29,22 @@ def logp_of_set(s):
     else:
         raise exc[0], exc[1], exc[2]
 
+def logp_of_terms(terms):
+    """
+    Sum the log-probabilities of a sequence of (node, logp function) pairs,
+    as produced by Schedule.terms. The functions are called directly, skipping
+    the checks done by the nodes' logp attributes.
+    """
+    logp = 0.
+    for node, fun in terms:
+        term = fun()
+        if term <= d_neg_inf:
+            raise ZeroProbability, node.errmsg
+        logp += term
+    if logp != logp:
+        raise ValueError, 'Computed log-probability is NaN'
+    return logp
+
 
 def batchsd(trace, batches=5):
     """
@@ -36,27 +53,17 @@ def batchsd(trace, batches=5):
     the batch means is calculated.
     """
 
-    if len(np.shape(trace)) > 1:
-
-        dims = np.shape(trace)
-        #ttrace = np.transpose(np.reshape(trace, (dims[0], sum(dims[1:]))))
-        ttrace = np.transpose([t.ravel() for t in trace])
+    # All the elements of multidimensional traces are handled at once.
+    trace = np.asarray(trace)
+    if batches == 1: return np.std(trace, 0)/np.sqrt(len(trace))
 
-        return np.reshape([batchsd(t, batches) for t in ttrace], dims[1:])
-
-    else:
-        if batches == 1: return np.std(trace)/np.sqrt(len(trace))
-
-        try:
-            batched_traces = np.resize(trace, (batches, len(trace)/batches))
-        except ValueError:
-            # If batches do not divide evenly, trim excess samples
-            resid = len(trace) % batches
-            batched_traces = np.resize(trace[:-resid], (batches, len(trace)/batches))
+    # If batches do not divide evenly, trim excess samples
+    size = len(trace) // batches
+    batched_traces = np.reshape(trace[:size*batches], (batches, size) + trace.shape[1:])
 
-        means = np.mean(batched_traces, 1)
+    means = np.mean(batched_traces, 1)
 
-        return np.std(means)/np.sqrt(batches)
+    return np.std(means, 0)/np.sqrt(batches)
 
 class ZeroProbability(ValueError):
     "Log-probability is undefined or negative infinity"
@@ -216,12 +223,24 @@ class Variable(Node):
     def stats(self, alpha=0.05, start=0, batches=100):
         """
         Generate posterior statistics for node.
+
+        If the trace cannot be read, as with the no_trace backend, and start
+        is 0, the running summary of the last chain is returned instead if
+        the database keeps one (see online_stats).
         """
         from utils import hpd, quantiles
         from numpy import sqrt
 
         try:
-            trace = np.squeeze(np.array(self.trace(), float)[start:])
+            values = self.trace()
+        except:
+            # No trace is kept, as with the no_trace backend.
+            values = None
+        if values is None and start == 0 and self.online_stats() is not None:
+            return self.online_stats()
+
+        try:
+            trace = np.squeeze(np.array(values, float)[start:])
 
             n = len(trace)
             if not n:
@@ -241,6 +260,20 @@ class Variable(Node):
             print 'Could not generate output statistics for', self.__name__
             return
 
+    def online_stats(self):
+        """
+        Return the running summary statistics of the last chain, if the
+        database keeps them (online=True), or None.
+
+        The dictionary has the 'n', 'mean', 'standard deviation', 'mc error'
+        and 'quantiles' keys, with estimated quantiles, and 'min' and 'max',
+        but no HPD interval.
+        """
+        summary = getattr(getattr(self, 'trace', None), 'summary', None)
+        if summary is None:
+            return None
+        return summary.stats()
+
 ContainerRegistry = []
 
 class ContainerMeta(type):
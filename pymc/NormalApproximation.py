@@ -198,6 +198,15 @@ class MAP(Model):
         else:
             self.eps[:] = eps
 
+        # Stochastics whose Markov blankets can be differentiated analytically.
+        self._analytic_stochastics = set()
+        for stochastic in self.stochastics:
+            try:
+                self.grad_logp([stochastic])
+                self._analytic_stochastics.add(stochastic)
+            except NotImplementedError:
+                pass
+
         self.diff_order = diff_order
 
         self._len_range = arange(self.len)
@@ -330,8 +339,11 @@ class MAP(Model):
         if needed.
         """
         self._set_stochastics(p)
+        for stochastic, g in self.grad_logp(self._analytic_stochastics).iteritems():
+            self.grad[self._slices[stochastic]] = ravel(g)
         for i in xrange(self.len):
-            self.grad[i] = self.diff(i)
+            if not self.stochastic_indices[i][0] in self._analytic_stochastics:
+                self.grad[i] = self.diff(i)
 
         return -1 * self.grad
 
@@ -370,8 +382,12 @@ class MAP(Model):
         """
         N.diff(i, order=1)
 
-        Derivative wrt index i to given order.
+        Derivative wrt index i to given order. First derivatives are
+        computed analytically if possible.
         """
+        p, j = self.stochastic_indices[i]
+        if order == 1 and p in self._analytic_stochastics:
+            return ravel(self.grad_logp([p])[p])[j]
 
         old_val = copy(self[i])
         d = derivative(func=self.func_for_diff, x0=old_val, dx=self.eps[i], n=order, args=[i], order=self.diff_order)
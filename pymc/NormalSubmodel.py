@@ -0,0 +1,401 @@
+"""
+Joint updates of linear-Gaussian submodels.
+
+A set of Normal, MvNormal, MvNormalCov and MvNormalChol stochastics whose
+children are all normal, and which only enter their children's means,
+directly or through LinearCombinations, is jointly normal conditional on the
+rest of the model. NormalSubmodel draws such a block from its joint full
+conditional distribution in a single step, instead of updating its
+stochastics one at a time, which mixes very slowly when they are strongly
+correlated (random walks, hierarchical regressions).
+
+The joint precision matrix of the block is assembled as a SciPy sparse
+matrix. Its sparsity pattern is found once, when the step method is created,
+along with a reverse Cuthill-McKee ordering that gathers the nonzeros in a
+narrow band around the diagonal. The reordered precision is factored by a
+banded Cholesky decomposition, which does not fill in outside the band. The
+factor is kept until the precision parents of the block and of its children,
+or the coefficients of the LinearCombinations, change; otherwise only the
+block's mean is recomputed at each step.
+
+MCMC assigns a NormalSubmodel to each block of two or more stochastics found
+by find_normal_submodels before consulting the step method registry. Setting
+`pymc.StepMethods.conjugate_Gibbs_competence` to 0 turns this off. Single
+stochastics are left to the conjugate Gibbs step methods.
+
+Requires SciPy.
+"""
+
+import numpy as np
+import StepMethods
+from StepMethods import StepMethod
+from Node import ContainerBase
+from PyMCObjects import Stochastic
+from CommonDeterministics import LinearCombination
+from GibbsStepMethods import broadcasts_to
+from utils import value
+import distributions
+
+try:
+    from scipy import sparse, linalg
+    from scipy.sparse.csgraph import reverse_cuthill_mckee
+except ImportError:
+    sparse = None
+
+__docformat__='reStructuredText'
+
+__all__ = ['NormalSubmodel', 'normal_classes', 'crawl_normal_submodel', 'find_normal_submodels']
+
+normal_classes = (distributions.Normal, distributions.MvNormal, distributions.MvNormalCov, distributions.MvNormalChol)
+
+def _depends(parent, node):
+    return parent is node or (isinstance(parent, ContainerBase) and node in parent.variables)
+
+def _linear_terms(L):
+    """
+    Return the (stochastic, coefficient, side) terms of LinearCombination L,
+    where the stochastic appears on the given side of the coefficient.
+    """
+    terms = []
+    if isinstance(L.x, (list, tuple)) and isinstance(L.y, (list, tuple)):
+        for x, y in zip(L.x, L.y):
+            if isinstance(x, Stochastic):
+                terms.append((x, y, 'L'))
+            if isinstance(y, Stochastic):
+                terms.append((y, x, 'R'))
+    return terms
+
+def _mean_terms(node):
+    """
+    Return the (stochastic, coefficient, side) terms of the mean of a normal
+    node. The coefficient and side are None if the stochastic is the mean
+    itself.
+    """
+    mu = node.parents['mu']
+    if isinstance(mu, Stochastic):
+        return [(mu, None, None)]
+    elif isinstance(mu, LinearCombination):
+        return _linear_terms(mu)
+    return []
+
+def _normal_child(node, mu):
+    """
+    Return True if node is normal and mu is its mean and none of its other
+    parents.
+    """
+    if not node.__class__ in normal_classes or not node.parents['mu'] is mu:
+        return False
+    for key, parent in node.parents.iteritems():
+        if key != 'mu' and _depends(parent, mu):
+            return False
+    return broadcasts_to(np.shape(node.parents.value['mu']), np.shape(node.value))
+
+def _linear_gaussian(s):
+    """
+    Return True if s can belong to a linear-Gaussian block: s is normal and
+    unobserved, its children are all normal, and s only enters their means,
+    directly or as a term of a LinearCombination.
+    """
+    if s.observed or not s.__class__ in normal_classes:
+        return False
+    shape = np.shape(s.value)
+    if not s.__class__ is distributions.Normal and len(shape) != 1:
+        return False
+
+    for child in s.children:
+        if isinstance(child, Stochastic):
+            if not _normal_child(child, s):
+                return False
+            if child.__class__ is not distributions.Normal and np.shape(child.value) != shape:
+                return False
+
+        elif isinstance(child, LinearCombination):
+            if len(shape) > 1:
+                return False
+            for grandchild in child.children:
+                if not isinstance(grandchild, Stochastic) or not _normal_child(grandchild, child):
+                    return False
+            terms = [term for term in _linear_terms(child) if term[0] is s]
+            if len(terms) == 0:
+                return False
+            for t, coef, side in terms:
+                # The product of two normals is not normal.
+                if isinstance(coef, Stochastic) and coef.__class__ in normal_classes and not coef.observed:
+                    return False
+
+        else:
+            return False
+
+    return True
+
+def crawl_normal_submodel(stochastic, within=None):
+    """
+    Return the largest linear-Gaussian block containing stochastic, as a
+    set, or an empty set if stochastic cannot belong to one.
+
+    :Parameters:
+      stochastic : Stochastic
+        The stochastic the block is grown from.
+      within : set
+        If given, the block only contains stochastics from this set.
+    """
+    if not _linear_gaussian(stochastic):
+        return set()
+    block = set([stochastic])
+    front = [stochastic]
+    while front:
+        s = front.pop()
+        neighbors = set([term[0] for term in _mean_terms(s)])
+        for child in s.extended_children:
+            neighbors.add(child)
+            neighbors |= set([term[0] for term in _mean_terms(child)])
+        for n in neighbors:
+            if n in block or not isinstance(n, Stochastic) or (within is not None and not n in within):
+                continue
+            if _linear_gaussian(n):
+                block.add(n)
+                front.append(n)
+    return block
+
+def find_normal_submodels(stochastics):
+    """
+    Split the stochastics into linear-Gaussian blocks, and return the blocks
+    of two or more stochastics as a list of sets.
+
+    Returns an empty list if SciPy is not installed or
+    `pymc.StepMethods.conjugate_Gibbs_competence` is 0.
+    """
+    if sparse is None or StepMethods.conjugate_Gibbs_competence <= 0:
+        return []
+    remaining = set(stochastics)
+    blocks = []
+    while remaining:
+        s = remaining.pop()
+        block = crawl_normal_submodel(s, remaining | set([s]))
+        remaining -= block
+        if len(block) > 1:
+            blocks.append(block)
+    return blocks
+
+
+class NormalSubmodel(StepMethod):
+    """
+    Draws a linear-Gaussian block of stochastics jointly from its full
+    conditional distribution.
+
+      >>> S = NormalSubmodel(stochastics)
+
+    :Parameters:
+      stochastics : set or list
+        Normal, MvNormal, MvNormalCov or MvNormalChol stochastics whose
+        children are all normal, and which only enter their means, directly
+        or through LinearCombinations. See crawl_normal_submodel.
+      verbose : integer
+        Level of output verbosity.
+
+    :Attributes:
+      ordering : array
+        The fill-reducing ordering of the elements of the block.
+      bandwidth : integer
+        The bandwidth of the reordered precision matrix.
+
+    :SeeAlso: find_normal_submodels, NormalNormalMean
+    """
+
+    def __init__(self, stochastics, verbose=None):
+        if sparse is None:
+            raise ImportError, 'NormalSubmodel requires scipy.sparse.'
+
+        StepMethod.__init__(self, stochastics, verbose, tally=False)
+
+        for s in self.stochastics:
+            if not _linear_gaussian(s):
+                raise ValueError, 'Stochastic %s is not linear-Gaussian for NormalSubmodel to apply.' % s
+
+        # The elements of the stochastics are stacked in a single vector,
+        # and the normal nodes of the block and its children in another.
+        self._members = sorted(self.stochastics, key=lambda s: s.__name__)
+        self._nodes = self._members + sorted(self.children, key=lambda s: s.__name__)
+
+        self._cols = {}
+        n = 0
+        for s in self._members:
+            size = np.size(s.value)
+            self._cols[s] = slice(n, n + size)
+            n += size
+        self.n = n
+
+        self._rows = []
+        self._terms = []
+        m = 0
+        for node in self._nodes:
+            size = np.size(node.value)
+            self._rows.append(slice(m, m + size))
+            m += size
+
+            # Index of the element of the mean of each element of the node.
+            mu_shape = np.shape(node.parents.value['mu'])
+            index = (np.arange(np.size(node.parents.value['mu'])).reshape(mu_shape) \
+                + np.zeros(np.shape(node.value), dtype=int)).ravel()
+
+            terms = []
+            for s, coef, side in _mean_terms(node):
+                if not self._cols.has_key(s):
+                    continue
+                if coef is not None:
+                    term_size = len(self._coefficient(s, coef, side))
+                    if term_size == 1:
+                        term_index = np.zeros(size, dtype=int)
+                    elif term_size == np.size(node.parents.value['mu']):
+                        term_index = index
+                    else:
+                        raise ValueError, 'The terms of the mean of %s must have its size for NormalSubmodel to apply.' % node
+                    terms.append((s, coef, side, term_index))
+                else:
+                    terms.append((s, None, None, index))
+            self._terms.append(terms)
+        self._m = m
+
+        # Find the sparsity pattern of the precision and its ordering.
+        B, T = self._assemble(pattern=True)
+        Q = (B.T * T * B).tocsr()
+        self.ordering = reverse_cuthill_mckee(Q, symmetric_mode=True)
+        Q = Q[self.ordering][:, self.ordering].tocoo()
+        self.bandwidth = max(0, np.max(Q.col - Q.row))
+
+        self._hyperparameters = None
+
+    def _coefficient(self, s, coef, side):
+        """
+        The matrix multiplying the elements of s in a term of a
+        LinearCombination, with a row for each element of the term.
+        """
+        coef = np.asarray(value(coef), dtype=float)
+        size = np.size(s.value)
+        if np.ndim(s.value) == 0:
+            return coef.reshape((-1, 1))
+        if side == 'R':
+            return np.dot(coef, np.eye(size)).reshape((-1, size))
+        return np.dot(np.eye(size), coef).reshape((size, -1)).T
+
+    def _precision(self, node):
+        """
+        The precision of a node, as a vector for Normal nodes and as a matrix
+        otherwise.
+        """
+        if node.__class__ is distributions.Normal:
+            return np.ravel(np.asarray(node.parents.value['tau'], dtype=float) + np.zeros(np.shape(node.value)))
+        elif node.__class__ is distributions.MvNormal:
+            return np.asarray(node.parents.value['tau'], dtype=float)
+        elif node.__class__ is distributions.MvNormalCov:
+            return np.linalg.inv(node.parents.value['C'])
+        else:
+            sig = np.asarray(node.parents.value['sig'], dtype=float)
+            return np.linalg.inv(np.dot(sig, sig.T))
+
+    def _assemble(self, pattern=False):
+        """
+        Return sparse matrices B and T, such that the residuals of the nodes
+        are B times the elements of the block, plus terms that do not depend
+        on the block, and T is their joint precision. The joint precision of
+        the block is B.T * T * B.
+
+        If pattern is True, all the structural nonzeros are set to 1.
+        """
+        B = ([], [], [])
+        T = ([], [], [])
+
+        def add(entries, rows, cols, data):
+            entries[0].append(rows)
+            entries[1].append(cols)
+            entries[2].append(data)
+
+        for node, rows, terms in zip(self._nodes, self._rows, self._terms):
+            r = np.arange(rows.start, rows.stop)
+            if self._cols.has_key(node):
+                cols = self._cols[node]
+                add(B, r, np.arange(cols.start, cols.stop), np.ones(len(r)))
+
+            for s, coef, side, index in terms:
+                cols = self._cols[s]
+                if coef is None:
+                    add(B, r, cols.start + index, -np.ones(len(r)))
+                else:
+                    c = np.arange(cols.start, cols.stop)
+                    if pattern:
+                        A = np.ones((len(r), len(c)))
+                    else:
+                        A = self._coefficient(s, coef, side)[index]
+                    add(B, np.repeat(r, len(c)), np.tile(c, len(r)), -A.ravel())
+
+            if pattern:
+                tau = np.ones(len(r)) if node.__class__ is distributions.Normal else np.ones((len(r), len(r)))
+            else:
+                tau = self._precision(node)
+            if np.ndim(tau) == 1:
+                add(T, r, r, tau)
+            else:
+                add(T, np.repeat(r, len(r)), np.tile(r, len(r)), np.ravel(tau))
+
+        B = sparse.coo_matrix((np.concatenate(B[2]), (np.concatenate(B[0]), np.concatenate(B[1]))), shape=(self._m, self.n))
+        T = sparse.coo_matrix((np.concatenate(T[2]), (np.concatenate(T[0]), np.concatenate(T[1]))), shape=(self._m, self._m))
+        return B.tocsr(), T.tocsr()
+
+    def _current_hyperparameters(self):
+        values = []
+        for node, terms in zip(self._nodes, self._terms):
+            for key, v in node.parents.value.iteritems():
+                if key != 'mu':
+                    values.append(v)
+            for s, coef, side, index in terms:
+                if coef is not None:
+                    values.append(value(coef))
+        return values
+
+    def _factor(self):
+        """
+        Factor the precision of the block, unless the hyperparameters are
+        unchanged since the last factorization.
+        """
+        current = self._current_hyperparameters()
+        if self._hyperparameters is not None:
+            for a, b in zip(current, self._hyperparameters):
+                if np.shape(a) != np.shape(b) or not np.all(a == b):
+                    break
+            else:
+                return
+        self._hyperparameters = [np.array(v, copy=True) for v in current]
+
+        B, T = self._assemble()
+        self._B = B
+        self._BT = (B.T * T).tocsr()
+        Q = (self._BT * B).tocsr()[self.ordering][:, self.ordering].tocoo()
+        upper = Q.row <= Q.col
+        ab = np.zeros((self.bandwidth + 1, self.n))
+        ab[self.bandwidth + Q.row[upper] - Q.col[upper], Q.col[upper]] = Q.data[upper]
+        self._chol = linalg.cholesky_banded(ab, lower=False)
+
+    def step(self):
+        self._factor()
+
+        x = np.empty(self.n)
+        for s in self._members:
+            x[self._cols[s]] = np.ravel(s.value)
+
+        residuals = np.empty(self._m)
+        for node, rows in zip(self._nodes, self._rows):
+            residuals[rows] = np.ravel(np.asarray(node.value, dtype=float) - node.parents.value['mu'])
+
+        # The full conditional precision times mean, in the ordering of the
+        # factor.
+        eta = (self._BT * (self._B * x - residuals))[self.ordering]
+
+        draw = linalg.cho_solve_banded((self._chol, False), eta) \
+            + linalg.solve_banded((0, self.bandwidth), self._chol, np.random.normal(size=self.n))
+        x[self.ordering] = draw
+
+        for s in self._members:
+            new_value = x[self._cols[s]].reshape(np.shape(s.value))
+            if np.ndim(s.value) == 0:
+                new_value = new_value[()]
+            s.value = new_value
@@ -6,14 +6,12 @@ __all__ = ['extend_children', 'extend_parents', 'ParentDict', 'Stochastic', 'Det
 from copy import copy
 from numpy import array, ndarray, reshape, Inf, asarray, dot, sum, float, isnan, size, NaN, asanyarray
 import numpy as np
-from Node import Node, ZeroProbability, Variable, PotentialBase, StochasticBase, DeterministicBase
+from Node import Node, ZeroProbability, Variable, PotentialBase, StochasticBase, DeterministicBase, d_neg_inf
 import Container
 from Container import DictContainer, ContainerBase, file_items, ArrayContainer
 import sys
 import pdb
 
-d_neg_inf = float(-1.7976931348623157e+308)
-
 # from PyrexLazyFunction import LazyFunction
 from LazyFunction import LazyFunction, Counter
 
@@ -322,6 +320,14 @@ class Deterministic(DeterministicBase):
         A flag indicating whether this variable is to be plotted.
       verbose (optional) : integer
         Level of output verbosity: 0=none, 1=low, 2=medium, 3=high
+      jacobians (optional) : dictionary
+        Functions returning the derivative of the value with respect to
+        some of the parents, keyed by parent name. They take the parents'
+        values as keyword arguments, like eval. Used by Model.grad_logp.
+      jacobian_formats (optional) : dictionary
+        The format of each Jacobian, keyed by parent name. 'broadcast'
+        (default) means the Jacobian is elementwise, and broadcasts against
+        the value. 'full' means it has shape value.shape + parent.shape.
 
     :Attributes:
       value : any object
@@ -332,12 +338,15 @@ class Deterministic(DeterministicBase):
       Stochastic, Potential, deterministic, MCMC, Lambda,
       LinearCombination, Index
     """
-    def __init__(self, eval,  doc, name, parents, dtype=None, trace=True, cache_depth=2, plot=None, verbose=None):
+    def __init__(self, eval,  doc, name, parents, dtype=None, trace=True, cache_depth=2, plot=None, verbose=None, jacobians=None, jacobian_formats=None):
         self.ParentDict = ParentDict
 
         # This function gets used to evaluate self's value.
         self._eval_fun = eval
 
+        self.jacobians = jacobians or {}
+        self.jacobian_formats = jacobian_formats or {}
+
         Variable.__init__(  self,
                         doc=doc,
                         name=name,
@@ -711,11 +720,10 @@ class Stochastic(StochasticBase):
     coparents = property(_get_coparents, doc="All the variables whose extended children intersect with self's.")
 
     def _get_moral_neighbors(self):
-        moral_neighbors = self.coparents | self.extended_parents | self.extended_children
-        for neighbor in copy(moral_neighbors):
-            if isinstance(neighbor, PotentialBase):
-                moral_neighbors.remove(neighbor)
-        return moral_neighbors
+        coparents = self.coparents
+        coparents |= self.extended_parents
+        coparents |= self.extended_children
+        return set([neighbor for neighbor in coparents if not isinstance(neighbor, PotentialBase)])
     moral_neighbors = property(_get_moral_neighbors, doc="Self's neighbors in the moral graph: self's Markov blanket with self removed.")
 
     def _get_markov_blanket(self):
@@ -1,7 +1,7 @@
 from __future__ import division
 
 import numpy as np
-from utils import msqrt, check_type, round_array, float_dtypes, integer_dtypes, bool_dtypes, safe_len, find_generations, logp_of_set, symmetrize
+from utils import msqrt, check_type, round_array, float_dtypes, integer_dtypes, bool_dtypes, safe_len, find_generations, logp_of_set, logp_of_terms, logp_gradient, symmetrize
 from numpy import ones, zeros, log, shape, cov, ndarray, inner, reshape, sqrt, any, array, all, abs, exp, where, isscalar, iterable, multiply, transpose, tri
 from numpy.linalg.linalg import LinAlgError
 from numpy.linalg import pinv, cholesky
@@ -18,6 +18,12 @@ from InstantiationDecorators import deterministic
 import pdb, warnings, sys
 import inspect
 
+try:
+    from scipy import derivative
+    scipy_imported = True
+except ImportError:
+    scipy_imported = False
+
 __docformat__='reStructuredText'
 
 
@@ -25,13 +31,17 @@ __docformat__='reStructuredText'
 # 22/03/2007 -DH- Added a _state attribute containing the name of the attributes that make up the state of the step method, and a method to return that state in a dict. Added an id.
 # TODO: Test cases for binary and discrete Metropolises.
 
-conjugate_Gibbs_competence = 0
+# Competence of the Gibbs step methods for conjugate submodels (see
+# GibbsStepMethods). Set pymc.StepMethods.conjugate_Gibbs_competence to 0
+# to leave conjugate stochastics to Metropolis; the copy in the pymc
+# namespace is not read.
+conjugate_Gibbs_competence = 3
 nonconjugate_Gibbs_competence = 0
 
 class AdaptationError(ValueError): pass
 
 
-__all__=['DiscreteMetropolis', 'Metropolis', 'PDMatrixMetropolis', 'StepMethod', 'assign_method',  'pick_best_methods', 'StepMethodRegistry', 'NoStepper', 'BinaryMetropolis', 'AdaptiveMetropolis','Gibbs','conjugate_Gibbs_competence', 'nonconjugate_Gibbs_competence', 'DrawFromPrior']
+__all__=['DiscreteMetropolis', 'Metropolis', 'ElementwiseMetropolis', 'HamiltonianMC', 'PDMatrixMetropolis', 'StepMethod', 'assign_method',  'pick_best_methods', 'StepMethodRegistry', 'NoStepper', 'BinaryMetropolis', 'AdaptiveMetropolis','Gibbs','conjugate_Gibbs_competence', 'nonconjugate_Gibbs_competence', 'DrawFromPrior']
 
 
 StepMethodRegistry = []
@@ -164,6 +174,13 @@ class StepMethod(object):
 
     __metaclass__ = StepMethodMeta
 
+    # Log-probability terms taken from a compiled model's Schedule.
+    _children_terms = None
+    _blanket_terms = None
+
+    # See _cached_sum.
+    _dependencies = None
+
     def __init__(self, variables, verbose=None, tally=False):
         # StepMethod initialization
 
@@ -206,9 +223,21 @@ class StepMethod(object):
         self.children -= self.stochastics
         self.parents -= self.stochastics
 
-        # self.markov_blanket is a list, because we want self.stochastics to have the chance to
+        # self.markov_blanket is a tuple, because we want self.stochastics to have the chance to
         # raise ZeroProbability exceptions before self.children.
-        self.markov_blanket = list(self.stochastics)+list(self.children)
+        self.markov_blanket = tuple(self.stochastics)+tuple(self.children)
+
+        # The stochastics whose values the log-probability of the Markov blanket
+        # depends on. Their counters tell whether a cached sum is still current.
+        dependencies = set()
+        for node in self.markov_blanket:
+            dependencies |= node.extended_parents
+            if isinstance(node, StochasticBase):
+                dependencies.add(node)
+        if all([hasattr(s, 'counter') for s in dependencies]):
+            self._dependencies = tuple(dependencies)
+        self._loglike_cache = []
+        self._logp_plus_loglike_cache = []
 
         # ID string for verbose feedback
         self._id = self.__class__.__name__ + '_' + '_'.join([s.__name__ for s in self.stochastics])
@@ -262,9 +291,61 @@ class StepMethod(object):
     def tune(self, *args, **kwargs):
         return False
 
+    def use_schedule(self, schedule):
+        """
+        Evaluate loglike and logp_plus_loglike through a Schedule built by
+        Model.compile. As in markov_blanket, self's stochastics come before
+        their children.
+        """
+        children_terms = schedule.terms(self.children)
+        blanket_terms = schedule.terms(self.stochastics) + children_terms
+
+        # Some nodes (eg GP realizations) have no lazy log-probability.
+        for node, fun in blanket_terms:
+            if fun is None:
+                return
+
+        self._children_terms = children_terms
+        self._blanket_terms = blanket_terms
+
+    def _cached_sum(self, cache, fun):
+        """
+        Return fun(), a sum of log-probabilities over (part of) the Markov
+        blanket, reusing an earlier value if none of the stochastics it
+        depends on have changed since. The state of each stochastic is
+        identified by its counter, so the value from before a rejected
+        proposal is found again once the proposal is reverted. cache is a
+        list holding the last two evaluations.
+
+        The dependencies are found when self is created, so step methods
+        must be created again if the model's parents are reassigned.
+        """
+        if self._dependencies is None:
+            return fun()
+        state = tuple([s.counter.get_count() for s in self._dependencies])
+        for cached_state, sum in cache:
+            if cached_state == state:
+                return sum
+        sum = fun()
+        cache.insert(0, (state, sum))
+        del cache[2:]
+        return sum
+
+    def _sum_loglike(self):
+        if self._children_terms is not None:
+            return logp_of_terms(self._children_terms)
+        else:
+            return logp_of_set(self.children)
+
+    def _sum_logp_plus_loglike(self):
+        if self._blanket_terms is not None:
+            return logp_of_terms(self._blanket_terms)
+        else:
+            return logp_of_set(self.markov_blanket)
+
     def _get_loglike(self):
         # Fetch log-probability (as sum of childrens' log probability)
-        sum = logp_of_set(self.children)
+        sum = self._cached_sum(self._loglike_cache, self._sum_loglike)
         if self.verbose>1:
             print '\t' + self._id + ' Current log-likelihood ', sum
         return sum
@@ -273,7 +354,7 @@ class StepMethod(object):
     loglike = property(fget = _get_loglike, doc="The summed log-probability of all stochastic variables that depend on \n self.stochastics, with self.stochastics removed.")
 
     def _get_logp_plus_loglike(self):
-        sum = logp_of_set(self.markov_blanket)
+        sum = self._cached_sum(self._logp_plus_loglike_cache, self._sum_logp_plus_loglike)
         if self.verbose>1:
             print '\t' + self._id + ' Current log-likelihood plus current log-probability', sum
         return sum
@@ -844,6 +925,397 @@ class BinaryMetropolis(Metropolis):
             self.stochastic.value = new_value
 
 
+class ElementwiseMetropolis(Metropolis):
+    """
+    Metropolis step method for array-valued stochastics whose elements are
+    conditionally independent given the rest of the model, such as vectors of
+    random effects.
+
+    All elements are proposed simultaneously, but each one is accepted or
+    rejected separately based on its own contribution to the log-probability
+    of the stochastic and of its children. Each element has its own adaptive
+    scale factor.
+
+    To instantiate an ElementwiseMetropolis called M with jurisdiction over a
+    Stochastic P:
+
+      >>> M = ElementwiseMetropolis(P, scale=1, proposal_sd=None)
+
+    :Arguments:
+    - stochastic : Stochastic
+            The variable over which self has jurisdiction. Its log-probability
+            function and those of its children must carry an `elementwise`
+            attribute (see distributions.py), and the children's values must
+            have the same shape as the stochastic's, element i of each child
+            depending only on element i of the stochastic. Deterministics
+            between the stochastic and its children must act elementwise.
+
+    - scale (optional) : number
+            The proposal jump width is set to scale * variable.value.
+
+    - proposal_sd (optional) : number or array
+            The proposal jump width is set to proposal_sd.
+
+    - verbose (optional) : None or integer
+            Level of output verbosity: 0=none, 1=low, 2=medium, 3=high.
+
+    :SeeAlso: Metropolis, StepMethod
+    """
+
+    def __init__(self, stochastic, scale=1., proposal_sd=None, verbose=None, tally=True):
+
+        Metropolis.__init__(self, stochastic, scale=scale, proposal_sd=proposal_sd, proposal_distribution="Normal", verbose=verbose, tally=tally)
+
+        shape = np.shape(self.stochastic.value)
+        self.adaptive_scale_factor = ones(shape)
+        self.accepted = zeros(shape)
+        self.rejected = zeros(shape)
+        self.proposal_sd = ones(shape) * self.proposal_sd
+
+        self._terms = [self.stochastic] + list(self.children)
+        for node in self._terms:
+            if getattr(node, '_logp_fun', None) is None or not hasattr(node._logp_fun, 'elementwise'):
+                raise ValueError, 'ElementwiseMetropolis: the log-probability of %s cannot be evaluated elementwise.' % node.__name__
+        if np.shape(self.logp_elementwise()) != shape:
+            raise ValueError, "ElementwiseMetropolis: the children of %s do not have the same shape as its value." % self.stochastic.__name__
+
+    @staticmethod
+    def competence(s):
+        """
+        ElementwiseMetropolis must be assigned explicitly, since conditional
+        independence of the elements cannot be checked automatically.
+        """
+        return 0
+
+    def logp_elementwise(self):
+        """
+        The log-probability of self's stochastic plus that of its children,
+        as an array with one entry per element of the stochastic.
+        """
+        logp = zeros(np.shape(self.stochastic.value))
+        olderr = np.seterr(all='ignore')
+        try:
+            for node in self._terms:
+                logp = logp + node._logp_fun.elementwise(node.value, **node.parents.value)
+        finally:
+            np.seterr(**olderr)
+        return logp
+
+    def step(self):
+        """
+        Propose a jump for all elements and accept or reject each of them
+        independently.
+        """
+        logp = self.logp_elementwise()
+        current = self.stochastic.value
+
+        self.propose()
+        logp_p = self.logp_elementwise()
+
+        # NaNs compare False, so they are rejected along with -inf.
+        accept = log(random(np.shape(current))) < logp_p - logp
+
+        self.accepted += accept
+        self.rejected += ~accept
+
+        if self.verbose > 1:
+            print '%s accepting %i of %i elements.' % (self._id, accept.sum(), accept.size)
+
+        if not accept.any():
+            self.reject()
+        elif not accept.all():
+            self.stochastic.value = where(accept, self.stochastic.value, current)
+
+    def tune(self, divergence_threshold=1e10, verbose=0):
+        """
+        Tunes the scaling parameter of each element separately, following
+        the same rule as Metropolis.tune.
+        """
+        if self.verbose is not None:
+            verbose = self.verbose
+
+        total = self.accepted + self.rejected
+        if not total.all():
+            return True
+        acc_rate = self.accepted / total
+
+        factor = np.select([acc_rate<0.001, acc_rate<0.05, acc_rate<0.2, acc_rate>0.95, acc_rate>0.75, acc_rate>0.5],
+                           [0.1, 0.5, 0.9, 10.0, 2.0, 1.1], 1.)
+        self.adaptive_scale_factor *= factor
+        tuning = (factor != 1.).any()
+
+        self.rejected = zeros(np.shape(total))
+        self.accepted = zeros(np.shape(total))
+
+        if verbose > 0:
+            print '\t%s tuning:' % self._id
+            print '\t\tmean acceptance rate:', acc_rate.mean()
+            print '\t\telements still tuning:', (factor != 1.).sum()
+
+        return tuning
+
+
+class HamiltonianMC(StepMethod):
+    """
+    Hamiltonian (hybrid) Monte Carlo step method for continuous stochastics.
+
+    A momentum variable is drawn from a standard normal distribution, and
+    the stochastics and momentum are moved jointly along a trajectory of
+    n_steps leapfrog steps, guided by the gradient of the log-probability
+    of the Markov blanket. The endpoint is accepted or rejected by a
+    Metropolis test on the total energy. Unlike random-walk methods, long
+    trajectories can be accepted in high-dimensional problems.
+
+    Terms of the log-probability are differentiated analytically where
+    possible, using the gradients attached to the likelihoods in
+    distributions.py (see utils.logp_gradient). The other terms are
+    differentiated numerically with scipy's derivative function, as in
+    NormalApproximation.
+
+    To instantiate a HamiltonianMC called H with jurisdiction over
+    Stochastics P and Q:
+
+      >>> H = HamiltonianMC([P, Q], step_size=.1, n_steps=10)
+
+    :Parameters:
+      - stochastic : Stochastic or list of Stochastics
+          Float-valued stochastics to be block-updated.
+
+      - step_size : float
+          Leapfrog step size. It is multiplied by an adaptive scale factor
+          during tuning, which targets an acceptance rate of about 0.65.
+
+      - n_steps : integer
+          Number of leapfrog steps per trajectory.
+
+      - eps : float
+          'h' for computing numerical derivatives.
+
+      - diff_order : integer
+          The order of the approximation used to compute numerical
+          derivatives.
+
+      - verbose : None or integer
+          Level of output verbosity: 0=none, 1=low, 2=medium, 3=high.
+
+    :SeeAlso: Metropolis, AdaptiveMetropolis, NormalApproximation.
+
+    :Reference:
+      Neal, R. M., MCMC using Hamiltonian dynamics, in Handbook of Markov
+          Chain Monte Carlo, Chapman & Hall/CRC, 2011.
+    """
+    def __init__(self, stochastic, step_size=.1, n_steps=10, eps=.001, diff_order=5, verbose=None, tally=True):
+
+        if not np.iterable(stochastic) or isinstance(stochastic, Variable):
+            stochastic = [stochastic]
+
+        # Initialize superclass
+        StepMethod.__init__(self, stochastic, verbose, tally)
+
+        self._id = 'HamiltonianMC_'+'_'.join([p.__name__ for p in self.stochastics])
+
+        self.step_size = step_size
+        self.n_steps = n_steps
+        self.eps = eps
+        self.diff_order = diff_order
+
+        self.adaptive_scale_factor = 1.
+        self.accepted = 0.
+        self.rejected = 0.
+        self._state = ['accepted', 'rejected', 'adaptive_scale_factor', 'step_size', 'n_steps']
+        self._tuning_info = ['adaptive_scale_factor']
+
+        for s in self.stochastics:
+            if not s.dtype in float_dtypes:
+                raise ValueError, 'HamiltonianMC: %s is not float-valued.' % s.__name__
+        self.dimension()
+
+        # Sort out which terms of the Markov blanket are differentiated
+        # analytically and which numerically, for each stochastic.
+        self._analytic_terms = {}
+        self._numerical_terms = {}
+        for s in self.stochastics:
+            self._analytic_terms[s] = []
+            self._numerical_terms[s] = set()
+            for term in [s] + list(s.extended_children):
+                try:
+                    logp_gradient(term, s)
+                    self._analytic_terms[s].append(term)
+                except NotImplementedError:
+                    self._numerical_terms[s].add(term)
+
+        for s in self.stochastics:
+            if self._numerical_terms[s] and not scipy_imported:
+                raise ImportError, 'HamiltonianMC: scipy is required to differentiate the log-probability numerically.'
+
+    @staticmethod
+    def competence(s):
+        """
+        HamiltonianMC must be assigned explicitly, since its step size and
+        trajectory length need to be chosen with the model in mind.
+        """
+        return 0
+
+    def dimension(self):
+        """Compute the dimension of the sampling space and identify the slices
+        belonging to each stochastic.
+        """
+        self.dim = 0
+        self._slices = {}
+        for stochastic in self.stochastics:
+            p_len = np.size(stochastic.value)
+            self._slices[stochastic] = slice(self.dim, self.dim + p_len)
+            self.dim += p_len
+
+    def stoch2array(self):
+        """Return the stochastic objects' values as a flat array."""
+        a = np.empty(self.dim)
+        for stochastic in self.stochastics:
+            a[self._slices[stochastic]] = np.ravel(stochastic.value)
+        return a
+
+    def array2stoch(self, a):
+        """Set the stochastic objects' values from a flat array."""
+        for stochastic in self.stochastics:
+            value = a[self._slices[stochastic]]
+            if np.shape(stochastic.value) == ():
+                stochastic.value = value[0]
+            else:
+                stochastic.value = np.reshape(value, np.shape(stochastic.value))
+
+    def _set_element(self, stochastic, j, x):
+        if np.shape(stochastic.value) == ():
+            stochastic.value = x
+        else:
+            value = np.array(stochastic.value, dtype=float)
+            value.flat[j] = x
+            stochastic.value = value
+
+    def _logp_for_diff(self, x, stochastic, j):
+        """
+        The function that gets passed to the derivatives.
+        """
+        self._set_element(stochastic, j, x)
+        try:
+            return logp_of_set(self._numerical_terms[stochastic])
+        except ZeroProbability:
+            return -np.inf
+
+    def gradient(self):
+        """
+        The gradient of logp_plus_loglike with respect to the flattened
+        values of self's stochastics.
+        """
+        grad = np.zeros(self.dim)
+        for s in self.stochastics:
+            sl = self._slices[s]
+
+            for term in self._analytic_terms[s]:
+                grad[sl] += np.ravel(logp_gradient(term, s))
+
+            if self._numerical_terms[s]:
+                value = s.value
+                x = np.ravel(value)
+                for j in xrange(len(x)):
+                    grad[sl.start + j] += derivative(func=self._logp_for_diff, x0=x[j], dx=self.eps, n=1, args=[s, j], order=self.diff_order)
+                s.value = value
+        return grad
+
+    def step(self):
+        """
+        Simulate a leapfrog trajectory from a fresh momentum draw, and accept
+        or reject its endpoint.
+        """
+        self._original_values = [(s, s.value) for s in self.stochastics]
+
+        logp = self.logp_plus_loglike
+        q = self.stoch2array()
+        p = rnormal(size=self.dim)
+        H = logp - .5 * np.dot(p, p)
+        step_size = self.step_size * self.adaptive_scale_factor
+
+        if self.verbose > 1:
+            print self._id + ' starting trajectory with step size', step_size
+
+        accept = False
+        try:
+            grad = self.gradient()
+            for k in xrange(self.n_steps):
+                p = p + .5 * step_size * grad
+                q = q + step_size * p
+                self.array2stoch(q)
+                grad = self.gradient()
+                p = p + .5 * step_size * grad
+                if not np.all(np.isfinite(grad)):
+                    raise ZeroProbability
+            logp_p = self.logp_plus_loglike
+            H_p = logp_p - .5 * np.dot(p, p)
+            # NaNs compare False, so they are rejected.
+            accept = np.log(random()) < H_p - H
+        except ZeroProbability:
+            if self.verbose > 2:
+                print self._id + ' rejecting with ZeroProbability error.'
+
+        if accept:
+            self.accepted += 1
+            if self.verbose > 2:
+                print self._id + ' accepting'
+        else:
+            self.rejected += 1
+            self.reject()
+            if self.verbose > 2:
+                print self._id + ' rejecting'
+
+    def reject(self):
+        for stochastic, value in self._original_values:
+            stochastic.value = value
+
+    def tune(self, divergence_threshold=1e10, verbose=0):
+        """
+        Tunes the step size according to the acceptance rate of the last
+        trajectories, aiming for a rate of about 0.65:
+
+        Rate    Step size adaptation
+        ----    --------------------
+        <0.001        x 0.1
+        <0.2          x 0.5
+        <0.5          x 0.8
+        >0.95         x 2
+        >0.8          x 1.2
+        """
+        if self.verbose is not None:
+            verbose = self.verbose
+
+        if not (self.accepted + self.rejected):
+            return True
+        acc_rate = self.accepted / (self.accepted + self.rejected)
+
+        tuning = True
+        if acc_rate < 0.001:
+            self.adaptive_scale_factor *= 0.1
+        elif acc_rate < 0.2:
+            self.adaptive_scale_factor *= 0.5
+        elif acc_rate < 0.5:
+            self.adaptive_scale_factor *= 0.8
+        elif acc_rate > 0.95:
+            self.adaptive_scale_factor *= 2.0
+        elif acc_rate > 0.8:
+            self.adaptive_scale_factor *= 1.2
+        else:
+            tuning = False
+
+        self.rejected = 0.
+        self.accepted = 0.
+
+        if verbose > 0:
+            print '\t%s tuning:' % self._id
+            print '\t\tacceptance rate:', acc_rate
+            print '\t\tadaptive scale factor:', self.adaptive_scale_factor
+            print
+
+        return tuning
+
+
 class AdaptiveMetropolis(StepMethod):
     """
     The AdaptativeMetropolis (AM) sampling algorithm works like a regular
@@ -32,6 +32,9 @@ from CommonDeterministics import *
 from distributions import *
 from Model import *
 from StepMethods import *
+from GibbsStepMethods import *
+from NormalSubmodel import *
+from DLM import *
 from MCMC import *
 from NormalApproximation import *
 
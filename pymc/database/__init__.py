@@ -15,6 +15,8 @@ strategies:
   - `pickle` : put traces in a dictionnary and pickle it once sampling is over.
   - `txt` : keep everything in RAM, and dump samples in txt files once
             sampling is completed,
+  - `npy` : write samples to memory-mapped NumPy .npy files as they are
+            drawn,
   - `sqlite` : store data in a sqlite database,
   - `mysql` : store data in a mysql database,
   - `hdf5` : store data in a hdf5 file, using pytables.
@@ -33,12 +35,13 @@ file. Look at base.py for skeleton classes, and the other modules for examples.
 
 """
 
-__modules__ = ['no_trace', 'txt', 'ram', 'pickle', 'sqlite', 'mysql', 'hdf5', 'hdf52', "__test_import__"]
+__modules__ = ['no_trace', 'txt', 'ram', 'pickle', 'npy', 'sqlite', 'mysql', 'hdf5', 'hdf52', "__test_import__"]
 
 import no_trace
 import txt
 import ram
 import pickle
+import npy
 
 try:
     import sqlite
@@ -44,12 +44,216 @@ that problem.
 
 Some backends require being closed before saving the results. This needs to be
 done explicitly by the user.
+
+Tallies can be buffered: if the Database's `buffer` attribute is larger than
+one, the values of all variables are accumulated in a NumPy record array and
+handed to the traces through `Trace.tally_block` once `buffer` iterations
+have been collected, and when the chain is finalized or truncated. Backends
+writing to disk or to a server override `tally_block` to store a whole block
+in a single operation. The buffer size can be set through
+``MCMC(db=..., buffer=...)``.
+
+Posterior summaries can also be computed online: if the Database's `online`
+attribute is True, each trace of the last chain is given a `summary`
+attribute, a Summary instance updated at each tally with the running mean,
+variance, extrema, quantile estimates and batch-means Monte Carlo error of
+the variable. These are available during sampling and with the no_trace
+backend, where no samples are kept. This is set through
+``MCMC(db=..., online=True)``.
 """
 import pymc
+import numpy as np
 import types
 import sys, traceback, warnings
 import copy
-__all__=['Trace', 'Database']
+__all__=['Trace', 'Database', 'Summary']
+
+class Summary(object):
+    """Streaming summary statistics of the values of a variable.
+
+    The values are never stored. The mean and variance are updated with
+    Welford's algorithm, the quantiles are estimated with the P-square
+    algorithm of Jain and Chlamtac (1985), and the Monte Carlo error is
+    the standard deviation of between `batches` and 2*`batches` batch
+    means, the batch size doubling as the chain grows.
+    """
+
+    # Percentiles estimated, as for utils.quantiles.
+    qlist = (2.5, 25, 50, 75, 97.5)
+
+    def __init__(self, shape, qlist=None, batches=100, reference=None):
+        """
+        :Parameters:
+        shape : tuple
+          The shape of the values.
+        qlist : sequence
+          The percentiles to estimate. Defaults to Summary.qlist.
+        batches : int
+          The minimum number of batches used for the Monte Carlo error.
+        reference : array
+          If given, the number of values smaller than reference is also
+          counted (see `below`).
+        """
+        self.shape = tuple(shape)
+        if qlist is not None:
+            self.qlist = tuple(qlist)
+        self.batches = batches
+        k = int(np.prod(self.shape))
+
+        self.reference = reference
+        if reference is not None:
+            self._reference = np.resize(np.asarray(reference, dtype=float), k)
+            self._below = np.zeros(k)
+
+        self.n = 0
+        self._mean = np.zeros(k)
+        self._m2 = np.zeros(k)
+        self._min = np.zeros(k)
+        self._max = np.zeros(k)
+
+        # P-square markers: heights, positions, desired positions and
+        # increments of the desired positions, for each quantile.
+        p = np.array(self.qlist, dtype=float)[:, np.newaxis] / 100.
+        self._first = np.zeros((5, k))
+        self._heights = np.zeros((len(p), 5, k))
+        self._positions = np.tile(np.arange(1., 6.)[:, np.newaxis], (len(p), 1, k))
+        self._desired = np.tile((np.hstack((0*p, 2*p, 4*p, 2+2*p, 4+0*p)) + 1)[:, :, np.newaxis], (1, 1, k))
+        self._increments = np.hstack((0*p, p/2, p, (1+p)/2, 1+0*p))[:, :, np.newaxis]
+
+        # Batch means
+        self._bsize = 1
+        self._bsum = np.zeros(k)
+        self._bcount = 0
+        self._bmeans = []
+
+    def update(self, value):
+        """Account for one value."""
+        self.update_block(np.reshape(value, (1,) + self.shape))
+
+    def update_block(self, values):
+        """Account for a block of values. The first axis indexes the
+        iterations."""
+        values = np.asarray(values, dtype=float)
+        values = values.reshape(len(values), -1)
+        b = len(values)
+        if b == 0:
+            return
+
+        # Mean and variance
+        mean = values.mean(0)
+        delta = mean - self._mean
+        n = self.n + b
+        self._m2 += ((values - mean)**2).sum(0) + delta**2 * self.n * b / n
+        self._mean += delta * b / n
+
+        if self.reference is not None:
+            self._below += (values < self._reference).sum(0)
+
+        # Extrema
+        if self.n == 0:
+            self._min = values.min(0)
+            self._max = values.max(0)
+        else:
+            np.minimum(self._min, values.min(0), self._min)
+            np.maximum(self._max, values.max(0), self._max)
+
+        for x in values:
+            self._update_quantiles(x)
+            self._update_batches(x)
+            self.n += 1
+
+    def _update_quantiles(self, x):
+        if self.n < 5:
+            self._first[self.n] = x
+            if self.n == 4:
+                self._heights[:] = np.sort(self._first, 0)
+            return
+
+        q, pos = self._heights, self._positions
+        np.minimum(q[:,0], x, q[:,0])
+        np.maximum(q[:,4], x, q[:,4])
+        pos[:,1:4] += q[:,1:4] > x
+        pos[:,4] += 1
+        self._desired += self._increments
+
+        # Adjust the heights of the middle markers, with the parabolic
+        # formula or, if it breaks the ordering of the markers, linearly.
+        for i in (1, 2, 3):
+            d = self._desired[:,i] - pos[:,i]
+            up = (d >= 1) & (pos[:,i+1] - pos[:,i] > 1)
+            down = (d <= -1) & (pos[:,i-1] - pos[:,i] < -1)
+            move = up | down
+            if not move.any():
+                continue
+            s = np.where(up, 1., -1.)
+            qi, qlo, qhi = q[:,i], q[:,i-1], q[:,i+1]
+            ni, nlo, nhi = pos[:,i], pos[:,i-1], pos[:,i+1]
+            parabolic = qi + s / (nhi - nlo) * ((ni - nlo + s) * (qhi - qi) / (nhi - ni) + (nhi - ni - s) * (qi - qlo) / (ni - nlo))
+            linear = np.where(up, qi + (qhi - qi) / (nhi - ni), qi - (qlo - qi) / (nlo - ni))
+            new = np.where((qlo < parabolic) & (parabolic < qhi), parabolic, linear)
+            q[:,i] = np.where(move, new, qi)
+            pos[:,i] += np.where(move, s, 0)
+
+    def _update_batches(self, x):
+        self._bsum += x
+        self._bcount += 1
+        if self._bcount < self._bsize:
+            return
+        self._bmeans.append(self._bsum / self._bsize)
+        self._bsum = np.zeros_like(self._bsum)
+        self._bcount = 0
+        # Merge pairs of batches once there are twice as many as needed.
+        if len(self._bmeans) == 2 * self.batches:
+            self._bmeans = [(a + b) / 2. for a, b in zip(self._bmeans[::2], self._bmeans[1::2])]
+            self._bsize *= 2
+
+    def _reshape(self, x):
+        x = np.reshape(x, self.shape)
+        if x.ndim == 0:
+            return x[()]
+        return x
+
+    def quantiles(self):
+        """Return a dictionary of the estimated quantiles."""
+        if self.n == 0:
+            return None
+        if self.n < 5:
+            # Too few values for the markers: use the sorted values.
+            sx = np.sort(self._first[:self.n], 0)
+            quants = [sx[int(self.n * q / 100.)] for q in self.qlist]
+        else:
+            quants = self._heights[:,2]
+        return dict([(q, self._reshape(v)) for q, v in zip(self.qlist, quants)])
+
+    def below(self):
+        """Return the fraction of the values smaller than the reference."""
+        if self.reference is None or self.n == 0:
+            return None
+        return self._reshape(self._below / self.n)
+
+    def mcse(self):
+        """Return the batch-means estimate of the Monte Carlo error of the
+        mean."""
+        if len(self._bmeans) < 2:
+            return None
+        return self._reshape(np.std(self._bmeans, 0) / np.sqrt(len(self._bmeans)))
+
+    def stats(self):
+        """Return a dictionary of the current summary statistics, with the
+        keys of Variable.stats, except for the HPD interval, which cannot be
+        computed without the samples."""
+        if self.n == 0:
+            return None
+        return {
+            'n': self.n,
+            'mean': self._reshape(self._mean),
+            'standard deviation': self._reshape(np.sqrt(self._m2 / self.n)),
+            'min': self._reshape(self._min),
+            'max': self._reshape(self._max),
+            'mc error': self.mcse(),
+            'quantiles': self.quantiles()
+        }
+
 
 class Trace(object):
     """Base class for Trace objects.
@@ -59,6 +263,9 @@ class Trace(object):
     or by the user.
     """
 
+    # Summary of the last chain, if the database computes summaries online.
+    summary = None
+
     def __init__(self, name, getfunc=None, db=None):
         """Create a Trace instance.
 
@@ -93,6 +300,26 @@ class Trace(object):
         """
         pass
 
+    def tally_block(self, chain, values):
+        """Append a block of values to a chain.
+
+        :Parameters:
+        chain : integer
+          Chain index.
+        values : array
+          The values to append. The first axis indexes the iterations.
+
+        This implementation tallies the values one by one. Backends able to
+        store several values at once should override it.
+        """
+        getfunc = self._getfunc
+        try:
+            for value in values:
+                self._getfunc = lambda value=value: value
+                self.tally(chain)
+        finally:
+            self._getfunc = getfunc
+
     def truncate(self, index, chain):
         """For backends that preallocate memory, removed the unused memory."""
         pass
@@ -142,6 +369,18 @@ class Database(object):
     with its Trace objects to tally values.
     """
 
+    # Number of iterations tallied in the write-behind buffer before they are
+    # handed to the traces as a block. 1 means no buffering.
+    buffer = 1
+    _block = None
+    _buffered = 0
+
+    # Whether the traces of the last chain keep a Summary updated at each
+    # tally, and optionally a dictionary of reference values, by name, for
+    # the summaries to count the values below.
+    online = False
+    references = None
+
     def __init__(self, dbname):
         """Create a Database instance.
 
@@ -186,6 +425,60 @@ class Database(object):
         self.trace_names.append(funs_to_tally.keys())
 
         self.chains += 1
+        self._init_buffer()
+        self._init_summaries()
+
+    def _init_summaries(self):
+        """Give the traces of the last chain a fresh Summary, if self.online
+        is True. Object-valued variables are not summarized."""
+        for name in self.trace_names[-1]:
+            trace = self._traces[name]
+            trace.summary = None
+            if self.online:
+                value = np.asarray(trace._getfunc())
+                if value.dtype != np.dtype('object'):
+                    trace.summary = Summary(value.shape, reference=(self.references or {}).get(name))
+
+    def _init_buffer(self):
+        """Allocate the write-behind buffer for the last chain, if
+        self.buffer is larger than one."""
+        self._block = None
+        self._buffered = 0
+        if self.buffer is None or self.buffer <= 1:
+            return
+        descr = []
+        for name in self.trace_names[-1]:
+            value = np.asarray(self._traces[name]._getfunc())
+            if value.dtype == np.dtype('object'):
+                descr.append((name, object))
+            else:
+                descr.append((name, value.dtype, value.shape))
+        self._block = np.zeros(self.buffer, dtype=descr)
+
+    def _flush_buffer(self, chain=-1):
+        """Hand the values accumulated in the buffer to the traces."""
+        if self._block is None or self._buffered == 0:
+            return
+        chain = range(self.chains)[chain]
+        n = self._buffered
+        self._buffered = 0
+        for name in list(self.trace_names[chain]):
+            try:
+                self._traces[name].tally_block(chain, self._block[name][:n])
+            except:
+                self._tally_error(chain, name)
+
+    def _tally_error(self, chain, name):
+        cls, inst, tb = sys.exc_info()
+        warnings.warn("""
+Error tallying %s, will not try to tally it again this chain.
+Did you make all the samevariables and step methods tallyable
+as were tallyable last time you used the database file?
+
+Error:
+
+%s"""%(name, ''.join(traceback.format_exception(cls, inst, tb))))
+        self.trace_names[chain].remove(name)
 
     def tally(self, chain=-1):
         """Append the current value of all tallyable object.
@@ -197,21 +490,62 @@ class Database(object):
         """
 
         chain = range(self.chains)[chain]
-        for name in self.trace_names[chain]:
-            try:
-                self._traces[name].tally(chain)
-            except:
-                cls, inst, tb = sys.exc_info()
-                warnings.warn("""
-Error tallying %s, will not try to tally it again this chain.
-Did you make all the samevariables and step methods tallyable
-as were tallyable last time you used the database file?
+        if self._block is None:
+            for name in list(self.trace_names[chain]):
+                trace = self._traces[name]
+                try:
+                    trace.tally(chain)
+                    if trace.summary is not None:
+                        trace.summary.update(trace._getfunc())
+                except:
+                    self._tally_error(chain, name)
+        else:
+            i = self._buffered
+            for name in list(self.trace_names[chain]):
+                trace = self._traces[name]
+                try:
+                    self._block[name][i] = trace._getfunc()
+                    if trace.summary is not None:
+                        trace.summary.update(self._block[name][i])
+                except:
+                    self._tally_error(chain, name)
+            self._buffered += 1
+            if self._buffered == len(self._block):
+                self._flush_buffer(chain)
+
+
+    def _append_chain(self, values):
+        """Append a complete chain sampled elsewhere, for instance in another
+        process, as a new chain.
 
-Error:
+        :Parameters:
+        values : dict
+          Name - array pairs. The first axis of each array indexes the
+          tallied iterations.
+        """
+        length = min([len(v) for v in values.itervalues()] or [0])
+        index = [0]
 
-%s"""%(name, ''.join(traceback.format_exception(cls, inst, tb))))
-                self.trace_names[chain].remove(name)
+        funs = {}
+        for name, arr in values.iteritems():
+            funs[name] = lambda arr=arr: arr[index[0]]
+
+        getfuncs = dict([(name, trace._getfunc) for name, trace in self._traces.iteritems()])
+        self._initialize(funs, length)
+        chain = self.chains - 1
+
+        # Tally the stored values instead of the model's current values.
+        for name in self.trace_names[chain]:
+            self._traces[name]._getfunc = funs[name]
+        try:
+            while index[0] < length:
+                self.tally(chain)
+                index[0] += 1
+        finally:
+            for name in self.trace_names[chain]:
+                self._traces[name]._getfunc = getfuncs.get(name, self.model._funs_to_tally.get(name))
 
+        self._finalize(chain)
 
     def connect_model(self, model):
         """Link the Database to the Model instance.
@@ -256,6 +590,7 @@ Error:
     def _finalize(self, chain=-1):
         """Finalize the chain for all tallyable objects."""
         chain = range(self.chains)[chain]
+        self._flush_buffer(chain)
         for name in self.trace_names[chain]:
             self._traces[name]._finalize(chain)
         self.commit()
@@ -263,6 +598,7 @@ Error:
     def truncate(self, index, chain=-1):
         """Tell the traces to truncate themselves at the given index."""
         chain = range(self.chains)[chain]
+        self._flush_buffer(chain)
         for name in self.trace_names[chain]:
             self._traces[name].truncate(index, chain)
 
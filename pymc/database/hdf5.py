@@ -9,6 +9,14 @@ This version supports arbitrary objects through ObjectAtom and VLArray
 constructs. Ordinary numerical objects are stored in a Table. Each chain
 is stored in an individual group called ``chain#``.
 
+Samples are appended to the table in blocks of `Database.buffer`
+iterations. The chunk shape of the table is chosen from the expected
+length of the chain so that chunks hold about `Database.chunk_bytes`
+bytes. Variables given their own compression filter through `dbfilters`
+are stored in an EArray of their own in the chain group instead of a table
+column, since the filters of a table apply to all of its columns. Traces
+are read from disk with strided selections, one column at a time.
+
 Additional Dependencies
 -----------------------
  * HDF5 version 1.6.5, required by pytables.
@@ -25,7 +33,29 @@ from copy import copy
 import tables
 import os, warnings, sys, traceback
 
-__all__ = ['Trace', 'Database', 'load']
+__all__ = ['Trace', 'ArrayTrace', 'Database', 'load']
+
+def _chunkrows(rowsize, length, target):
+    """Return the number of rows of a chunk holding about target bytes, and
+    no more rows than the expected length of the chain."""
+    rows = max(1, target // max(1, rowsize))
+    if length:
+        rows = min(rows, length)
+    return int(rows)
+
+def _strided_read(read, n, slicing):
+    """Read the elements of a node of length n selected by slicing.
+
+    read(start, stop, step) reads the selection from disk; step must be
+    positive.
+    """
+    start, stop, step = slicing.indices(n)
+    indices = xrange(start, stop, step)
+    if len(indices) == 0:
+        return read(0, 0, 1)
+    if step > 0:
+        return read(start, indices[-1]+1, step)
+    return read(indices[-1], start+1, -step)[::-1]
 
 class TraceObject(base.Trace):
     """HDF5 Trace for Objects."""
@@ -72,23 +102,17 @@ class TraceObject(base.Trace):
           A slice overriding burn and thin assignement.
         """
         
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+
         if chain is not None:
-            vlarrays = [self._vlarrays[chain]]
-        else:
-            vlarrays =  self._vlarrays
-            
-        for i, vlarray in enumerate(vlarrays):
-            if slicing is not None:
-                burn, stop, thin = slicing.start, slicing.stop, slicing.step
-            if slicing is None or stop is None:
-                stop = len(vlarray)
-            col = vlarray[burn:stop:thin]
-            if i==0:
-                data = np.asarray(col)
-            else:
-                data = hstack((data, col))
-
-        return data
+            vlarray = self._vlarrays[chain]
+            return np.asarray(_strided_read(lambda start, stop, step: vlarray.read(start, stop, step), len(vlarray), slicing))
+
+        data = []
+        for vlarray in self._vlarrays:
+            data.extend(vlarray.read())
+        return np.asarray(data[slicing])
 
     __call__ = gettrace
 
@@ -130,23 +154,19 @@ class Trace(base.Trace):
           A slice overriding burn and thin assignement.
         """
 
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+
         if chain is not None:
-            tables = [self.db._gettables()[chain],]
+            return self._read(self.db._gettables()[chain], slicing)
         else:
-            tables = self.db._gettables()
-
-        for i,table in enumerate(tables):
-            if slicing is not None:
-                burn, stop, thin = slicing.start, slicing.stop, slicing.step
-            if slicing is None or stop is None:
-                stop = table.nrows
-            col = table.read(start=burn, stop=stop, step=thin, field=self.name)
-            if i == 0:
-                data = np.asarray(col)
-            else:
-                data = hstack((data, col))
+            data = [self._read(table, slice(None)) for table in self.db._gettables()]
+            return np.concatenate(data)[slicing]
 
-        return data
+    def _read(self, table, slicing):
+        """Read the selected rows of the object's column from disk."""
+        read = lambda start, stop, step: table.read(start=start, stop=stop, step=step, field=self.name)
+        return np.asarray(_strided_read(read, table.nrows, slicing))
 
     __call__ = gettrace
 
@@ -177,6 +197,93 @@ class Trace(base.Trace):
         n = asarray([table.nrows for table in tables])
         return n.sum()
 
+class ArrayTrace(base.Trace):
+    """HDF5 Trace for numerical objects stored in an EArray of their own,
+    compressed with a specific filter."""
+
+    def __init__(self, name, getfunc=None, db=None, earrays=None):
+        """Create an ArrayTrace instance.
+
+        :Parameters:
+        name : string
+          The trace object name.
+        getfunc : function
+          A function returning the value to tally.
+        db : Database instance
+          The database owning this Trace.
+        earrays : sequence
+          The nodes storing the data for this object, one per chain.
+        """
+        base.Trace.__init__(self, name, getfunc=getfunc, db=db)
+        if earrays is None:
+            earrays = []
+        self._earrays = earrays
+
+    def _initialize(self, chain, length):
+        """Create the EArray in the chain's group."""
+        base.Trace._initialize(self, chain, length)
+        arr = asarray(self._getfunc())
+        filter = self.db._filter(self.name)
+        rows = _chunkrows(arr.nbytes, length, self.db.chunk_bytes)
+        self._earrays.append(self.db._h5file.createEArray(self.db._chains[chain],
+            self.name,
+            tables.Atom.from_dtype(arr.dtype),
+            (0,) + arr.shape,
+            title=self.name + ' samples.',
+            filters=filter,
+            expectedrows=length,
+            chunkshape=(rows,) + arr.shape))
+
+    def tally(self, chain):
+        """Adds current value to trace"""
+        self._earrays[chain].append(asarray(self._getfunc())[np.newaxis])
+
+    def tally_block(self, chain, values):
+        """Adds a block of values to the trace."""
+        self._earrays[chain].append(values)
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        """Return the trace (last by default).
+
+        :Parameters:
+        burn : integer
+          The number of transient steps to skip.
+        thin : integer
+          Keep one in thin.
+        chain : integer
+          The index of the chain to fetch. If None, return all chains. The
+          default is to return the last chain.
+        slicing : slice object
+          A slice overriding burn and thin assignement.
+        """
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+
+        if chain is not None:
+            return self._read(self._earrays[chain], slicing)
+        else:
+            data = [self._read(earray, slice(None)) for earray in self._earrays]
+            return np.concatenate(data)[slicing]
+
+    def _read(self, earray, slicing):
+        read = lambda start, stop, step: earray.read(start, stop, step)
+        return _strided_read(read, earray.nrows, slicing)
+
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        """Return the length of the trace.
+
+        :Parameters:
+        chain : int or None
+          The chain index. If None, returns the combined length of all chains.
+        """
+        if chain is not None:
+            return self._earrays[chain].nrows
+        else:
+            return sum([earray.nrows for earray in self._earrays])
+
+
 class Database(pickle.Database):
     """HDF5 database
 
@@ -184,7 +291,14 @@ class Database(pickle.Database):
     stochastics and deterministics are stored as arrays in each group.
 
     """
-    def __init__(self, dbname, dbmode='a', dbcomplevel=0, dbcomplib='zlib', **kwds):
+
+    # Append the samples to the table in blocks of this many iterations.
+    buffer = 1000
+
+    # Approximate size of the chunks of the tables and arrays, in bytes.
+    chunk_bytes = 2**16
+
+    def __init__(self, dbname, dbmode='a', dbcomplevel=0, dbcomplib='zlib', dbfilters=None, **kwds):
         """Create an HDF5 database instance, where samples are stored in tables.
 
         :Parameters:
@@ -195,7 +309,11 @@ class Database(pickle.Database):
         dbcomplevel : integer (0-9)
           Compression level, 0: no compression.
         dbcomplib : string
-          Compression library (zlib, bzip2, lzo)
+          Compression library (zlib, bzip2, lzo, blosc, lzf)
+        dbfilters : dict
+          Compression of specific variables, as name: (complib, complevel)
+          pairs or name: tables.Filters pairs. These variables are stored in
+          arrays of their own.
 
         :Notes:
           * zlib has a good compression ratio, although somewhat slow, and
@@ -203,6 +321,8 @@ class Database(pickle.Database):
           * LZO is a fast compression library offering however a low compression
             ratio.
           * bzip2 has an excellent compression ratio but requires more CPU.
+          * blosc and lzf, when supported by PyTables, are very fast
+            compressors suited to traces that are read back often.
         """
         self.__name__ = 'hdf5'
         self.dbname = dbname
@@ -227,6 +347,13 @@ class Database(pickle.Database):
         self.filter = getattr(self._h5file, 'filters', \
                               tables.Filters(complevel=dbcomplevel, complib=dbcomplib))
 
+        self._filters = {}
+        for name, f in (dbfilters or {}).iteritems():
+            if not isinstance(f, tables.Filters):
+                complib, complevel = f
+                f = tables.Filters(complevel=complevel, complib=complib)
+            self._filters[name] = f
+
 
         self._tables = self._gettables()  # This should be a dict keyed by chain.
         self._rows = len(self._tables) * [None,] # This should be a dict keyed by chain.
@@ -258,6 +385,15 @@ class Database(pickle.Database):
                 db._traces[k] = TraceObject(name=k, db=db, vlarrays=vlarrays)
                 setattr(db, k, db._traces[k])
 
+            # Create traces from objects stored in their own EArray.
+            arrays = {}
+            for chain in self._chains:
+                for node in chain._f_listNodes(classname='EArray'):
+                    arrays.setdefault(node._v_name, []).append(node)
+            for k, earrays in arrays.iteritems():
+                db._traces[k] = ArrayTrace(name=k, db=db, earrays=earrays)
+                setattr(db, k, db._traces[k])
+
             # Restore table attributes.
             # This restores the sampler's state for the last chain.
             table = db._tables[-1]
@@ -266,10 +402,10 @@ class Database(pickle.Database):
 
             # Restore group attributes.
             for k in db._chains[-1]._f_listNodes():
-                if k.__class__ not in [tables.Table, tables.Group]:
+                if k.__class__ not in [tables.Table, tables.Group, tables.EArray]:
                     setattr(db, k.name, k)
 
-            varnames = db._tables[-1].colnames+ objects.keys()
+            varnames = db._tables[-1].colnames+ objects.keys() + arrays.keys()
             db.trace_names = db.chains * [varnames,]
 
     def connect_model(self, model):
@@ -310,9 +446,15 @@ class Database(pickle.Database):
             for name, fun in model._funs_to_tally.iteritems():
                 if np.array(fun()).dtype is np.dtype('object'):
                     self._traces[name] = TraceObject(name, getfunc=fun, db=self)
+                elif self._filters.has_key(name):
+                    self._traces[name] = ArrayTrace(name, getfunc=fun, db=self)
                 else:
                     self._traces[name] = Trace(name, getfunc=fun, db=self)
 
+    def _filter(self, name):
+        """Return the compression filter of a variable."""
+        return self._filters.get(name, self.filter)
+
     def nchains(self):
         """Return the number of existing chains."""
         return len(self._h5file.listNodes('/'))
@@ -331,6 +473,7 @@ class Database(pickle.Database):
         current_object_group = self._h5file.createGroup(self._chains[-1], 'group0', 'Group storing objects.')
         group_counter = 0
         object_counter = 0
+        rowsize = 0
 
         # Create the Table in the chain# group, and ObjectAtoms in chain#/group#.
         table_descr = {}
@@ -345,7 +488,7 @@ class Database(pickle.Database):
                             name, \
                             tables.ObjectAtom(),  \
                             title=name + ' samples.',
-                            filters=self.filter))
+                            filters=self._filter(name)))
 
                 object_counter += 1
                 if object_counter % 4096 == 0:
@@ -354,8 +497,9 @@ class Database(pickle.Database):
                         'group%d'%group_counter, 'Group storing objects.')
 
 
-            else:
+            elif not self._filters.has_key(name):
                 table_descr[name] = tables.Col.from_dtype(dtype((arr.dtype,arr.shape)))
+                rowsize += arr.nbytes
 
 
         table = self._h5file.createTable(self._chains[-1], \
@@ -363,7 +507,8 @@ class Database(pickle.Database):
             table_descr, \
             title='PyMC samples', \
             filters=self.filter,
-            expectedrows=length)
+            expectedrows=length,
+            chunkshape=(_chunkrows(rowsize, length, self.chunk_bytes),))
 
         self._tables.append(table)
         self._rows.append(self._tables[-1].row)
@@ -376,11 +521,14 @@ class Database(pickle.Database):
 
        # Make sure the variables have a corresponding Trace instance.
         for name, fun in funs_to_tally.iteritems():
-            if not self._traces.has_key(name):
-                if np.array(fun()).dtype is np.dtype('object'):
+            if np.array(fun()).dtype is np.dtype('object'):
+                if not isinstance(self._traces.get(name), TraceObject):
                     self._traces[name] = TraceObject(name, getfunc=fun, db=self)
-                else:
-                    self._traces[name] = Trace(name, getfunc=fun, db=self)
+            elif self._filters.has_key(name):
+                if not isinstance(self._traces.get(name), ArrayTrace):
+                    self._traces[name] = ArrayTrace(name, getfunc=fun, db=self)
+            elif not self._traces.has_key(name):
+                self._traces[name] = Trace(name, getfunc=fun, db=self)
 
 
             self._traces[name]._initialize(self.chains, length)
@@ -388,30 +536,58 @@ class Database(pickle.Database):
 
         self.trace_names.append(funs_to_tally.keys())
         self.chains += 1
+        self._init_buffer()
+        self._init_summaries()
 
     def tally(self, chain=-1):
+        if self._block is not None:
+            return base.Database.tally(self, chain)
+
         chain = range(self.chains)[chain]
-        for name in self.trace_names[chain]:
+        for name in list(self.trace_names[chain]):
+            trace = self._traces[name]
             try:
-                self._traces[name].tally(chain)
+                trace.tally(chain)
+                if trace.summary is not None:
+                    trace.summary.update(trace._getfunc())
             except:
-                cls, inst, tb = sys.exc_info()
-                warnings.warn("""
-Error tallying %s, will not try to tally it again this chain.
-Did you make all the samevariables and step methods tallyable
-as were tallyable last time you used the database file?
-
-Error:
-
-%s"""%(name, ''.join(traceback.format_exception(cls, inst, tb))))
-                self.trace_names[chain].remove(name)
+                self._tally_error(chain, name)
 
         self._rows[chain].append()
         self._tables[chain].flush()
         self._rows[chain] = self._tables[chain].row
 
+    def _flush_buffer(self, chain=-1):
+        """Append the buffered iterations to the chain's table in a single
+        operation."""
+        if self._block is None or self._buffered == 0:
+            return
+        chain = range(self.chains)[chain]
+        n = self._buffered
+        self._buffered = 0
+
+        # Fill a record array with the table's dtype one column at a time,
+        # rather than building a tuple per row.
+        table = self._tables[chain]
+        rows = np.empty(n, dtype=table.description._v_dtype)
+        for name in table.colnames:
+            rows[name] = self._block[name][:n]
+        table.append(rows)
+        table.flush()
+        self._rows[chain] = table.row
+
+        for name in self.trace_names[chain]:
+            if not isinstance(self._traces[name], Trace):
+                self._traces[name].tally_block(chain, self._block[name][:n])
+
+    def commit(self):
+        """Write the buffered iterations to the file and flush it."""
+        self._flush_buffer()
+        self._h5file.flush()
+
     def _finalize(self, chain=-1):
         """Close file."""
+        self._flush_buffer(chain)
         # add attributes. Computation time.
         #self._tables[chain].flush()
         self._h5file.flush()
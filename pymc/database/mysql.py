@@ -5,12 +5,22 @@ Store traces from tallyable objects in individual SQL tables.
 
 Implementation Notes
 --------------------
-For each object, a table is created with the following format:
+The tables have the same layout as those of the sqlite backend:
 
-key (INT), trace (INT),  v1 (FLOAT), v2 (FLOAT), v3 (FLOAT) ...
+recid (INT), trace (INT), value (DOUBLE, BIGINT or LONGBLOB)
 
-The key is autoincremented each time a new row is added to the table.
-trace denotes the chain index, and starts at 0.
+with (trace, recid) as primary key, and the dtype and shape of each trace
+are kept in the _pymc_traces table.
+
+Samples are handed to the traces in blocks of `Database.buffer` iterations,
+and each block is written with multi-row ``INSERT ... VALUES (...),(...)``
+queries by a background thread, so that sampling does not wait for the
+server. The thread and the queries fetching traces draw their connections
+from a small pool. `Database.commit` waits until the queued blocks have
+been written.
+
+The DB-API module used to connect to the server can be given as `dbdriver`.
+It defaults to MySQLdb; the test suite uses a stand-in backed by SQLite.
 
 Additional Dependencies
 -----------------------
@@ -22,58 +32,156 @@ Updated by CF 2008-07-13.
 DB API changes, October 2008, DH.
 """
 
-# TODO: Commit multiple tallies with single database call.
-# TODO: Add support for integer valued objects.
-
-from numpy import zeros, shape, squeeze, transpose
+import numpy as np
 import base, pickle, ram, pymc, sqlite
-import MySQLdb, pdb
+import sys, threading, Queue
+
+try:
+    import MySQLdb
+except ImportError:
+    MySQLdb = None
+
+__all__ = ['Trace', 'Database', 'ConnectionPool', 'load']
 
-__all__ = ['Trace', 'Database', 'load']
+# MySQL types of the value columns.
+COLUMN_TYPES = {'REAL':'DOUBLE', 'INTEGER':'BIGINT', 'BLOB':'LONGBLOB'}
 
 class Trace(sqlite.Trace):
     """MySQL Trace class."""
 
     def _initialize(self, chain, length):
-        """Initialize the trace. Create a table.
-        """
-        # If the table already exists, exit now.
-        if chain != 0:
-            return
+        """Create the table if it does not exist yet."""
+        if self._getfunc is None:
+            self._getfunc = self.db.model._funs_to_tally[self.name]
 
-        # Determine size
-        try:
-            size = len(self._getfunc())
-        except TypeError:
-            size = 1
+        value = np.asarray(self._getfunc())
+        self._set_layout(value.dtype, value.shape)
+        self._index[chain] = 0
 
-        query = "create table %s (recid INTEGER PRIMARY KEY AUTO_INCREMENT, trace int(5), %s FLOAT)" % (self.name, ' FLOAT, '.join(['v%s' % (x+1) for x in range(size)]))
+        query = "CREATE TABLE IF NOT EXISTS `%s` (recid INTEGER NOT NULL, trace INTEGER NOT NULL, value %s, PRIMARY KEY (trace, recid))" % (self.name, COLUMN_TYPES[self._column])
         self.db.cur.execute(query)
-
-    def tally(self, chain):
-        """Adds current value to trace."""
-        size = 1
+        self.db.cur.execute("REPLACE INTO %s VALUES (%%s, %%s, %%s)" % sqlite.META_TABLE, (self.name, self._dtype.str, repr(self._shape)))
+        self.db.DB.commit()
+
+    def _encode(self, values):
+        data = sqlite.Trace._encode(self, values)
+        if self._column == 'BLOB':
+            data = [str(d) for d in data]
+        return data
+
+    def tally_block(self, chain, values):
+        """Queue a block of values to be written by multi-row inserts."""
+        data = self._encode(values)
+        i = self._index[chain]
+        n = self.db.rows_per_insert
+        queries = []
+        for j in range(0, len(data), n):
+            block = data[j:j+n]
+            params = []
+            for k, d in enumerate(block):
+                params.extend((i+j+k, chain, d))
+            query = "INSERT INTO `%s` (recid, trace, value) VALUES %s" % (self.name, ', '.join(['(%s, %s, %s)']*len(block)))
+            queries.append((query, params))
+        self.db._write(queries)
+        self._index[chain] = i + len(data)
+
+    def truncate(self, index, chain):
+        """Delete the samples of the chain from index on."""
+        self.db._write([("DELETE FROM `%s` WHERE trace=%%s AND recid>=%%s" % self.name, (chain, index))])
+        self._index[chain] = min(index, self._index.get(chain, index))
+
+    def _fetch(self, query, params=()):
+        """Execute a SELECT query written for sqlite on a pooled connection,
+        once the queued writes are done."""
+        query = query.replace('%', '%%').replace('?', '%s').replace('"', '`')
+        return self.db._read(query, params)
+
+
+class ConnectionPool(object):
+    """A fixed-size pool of DB-API connections, opened as they are needed."""
+
+    def __init__(self, connect, size=2):
+        """
+        :Parameters:
+        connect : function
+          Called without arguments to open a new connection.
+        size : int
+          Maximum number of connections.
+        """
+        self._connect = connect
+        self.size = size
+        self._connections = []
+        self._idle = Queue.Queue()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return an idle connection, waiting for one if all are in use."""
         try:
-            size = len(self._getfunc())
-        except TypeError:
+            return self._idle.get_nowait()
+        except Queue.Empty:
             pass
-
+        self._lock.acquire()
         try:
-            valstring = ', '.join(['%f'%x for x in self._getfunc()])
-        except:
-            valstring = str(self._getfunc())
-
-        # Add value to database
-        query = "INSERT INTO %s (trace, %s) values (%s, %s)" % (self.name, ' ,'.join(['v%s' % (x+1) for x in range(size)]), chain, valstring)
-
-        self.db.cur.execute(query)
-
+            if len(self._connections) < self.size:
+                connection = self._connect()
+                self._connections.append(connection)
+                return connection
+        finally:
+            self._lock.release()
+        return self._idle.get()
+
+    def put(self, connection):
+        """Return a connection to the pool."""
+        self._idle.put(connection)
+
+    def close(self):
+        """Close all connections."""
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+        self._idle = Queue.Queue()
+
+
+class Writer(threading.Thread):
+    """Thread executing the queued write queries, each list of queries in a
+    single transaction."""
+
+    def __init__(self, pool):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.pool = pool
+        self.queue = Queue.Queue()
+        self.error = None
+
+    def run(self):
+        while True:
+            queries = self.queue.get()
+            try:
+                if queries is None:
+                    return
+                if self.error is None:
+                    connection = self.pool.get()
+                    try:
+                        cur = connection.cursor()
+                        for query, params in queries:
+                            cur.execute(query, params)
+                        cur.close()
+                        connection.commit()
+                    finally:
+                        self.pool.put(connection)
+            except:
+                self.error = sys.exc_info()
+            finally:
+                self.queue.task_done()
 
 
 class Database(sqlite.Database):
     """MySQL database."""
 
-    def __init__(self, dbname, dbuser='', dbpass='', dbhost='localhost', dbport=3306, dbmode='a'):
+    # Maximum number of rows inserted by a single query.
+    rows_per_insert = 250
+
+    def __init__(self, dbname, dbuser='', dbpass='', dbhost='localhost', dbport=3306, dbmode='a', dbpool=2, dbdriver=None):
         """Open or create a MySQL database.
 
         :Parameters:
@@ -90,6 +198,10 @@ class Database(sqlite.Database):
         dbmode : {'a', 'w'}
           File mode.  Use `a` to append values, and `w` to overwrite
           an existing database.
+        dbpool : int
+          The number of connections used to write and read the traces.
+        dbdriver : module
+          The DB-API module used to connect to the server. Defaults to MySQLdb.
         """
         self.__name__ = 'mysql'
         self.dbname = dbname
@@ -105,28 +217,84 @@ class Database(sqlite.Database):
         self._port = dbport
         self.mode = dbmode
 
+        if dbdriver is None:
+            dbdriver = MySQLdb
+        if dbdriver is None:
+            raise ImportError, 'The mysql backend requires MySQLdb.'
+        self._driver = dbdriver
+
         # Connect to database
-        self.DB = MySQLdb.connect(user=self._user, passwd=self._passwd, host=self._host, port=self._port)
+        self.DB = self._driver.connect(user=self._user, passwd=self._passwd, host=self._host, port=self._port)
         self.cur = self.DB.cursor()
 
-        # Try and create database with model name
+        # Create database with model name if it does not exist.
+        self.cur.execute('CREATE DATABASE IF NOT EXISTS %s' % self.dbname)
+        self.cur.execute('USE %s' % self.dbname)
+
+        # If in write mode, remove existing tables.
+        if self.mode == 'w':
+            self.clean()
+
+        self.cur.execute('CREATE TABLE IF NOT EXISTS %s (name VARCHAR(255) PRIMARY KEY, dtype VARCHAR(32), shape VARCHAR(255))' % sqlite.META_TABLE)
+        self.DB.commit()
+
+        self._pool = ConnectionPool(self._connect, dbpool)
+        self._writer = Writer(self._pool)
+        self._writer.start()
+
+    def _connect(self):
+        return self._driver.connect(db=self.dbname, user=self._user, passwd=self._passwd, host=self._host, port=self._port)
+
+    def _write(self, queries):
+        """Queue a list of queries to be executed in one transaction by the
+        writer thread."""
+        self._writer.queue.put(queries)
+
+    def _wait(self):
+        """Wait until the queued queries have been executed, and raise the
+        error that stopped the writer thread, if any."""
+        self._writer.queue.join()
+        if self._writer.error is not None:
+            cls, inst, tb = self._writer.error
+            self._writer.error = None
+            raise cls, inst, tb
+
+    def _read(self, query, params=()):
+        """Execute a query on a pooled connection and return the rows."""
+        self._wait()
+        connection = self._pool.get()
         try:
-            self.cur.execute('CREATE DATABASE %s' % self.dbname)
-        except Exception:
-            # If already exists, switch to database
-            self.cur.execute('USE %s' % self.dbname)
-
-            # If in write mode, remove existing tables.
-            if self.mode == 'w':
-                self.clean()
-
+            cur = connection.cursor()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            cur.close()
+            # End the transaction so that later reads see new samples.
+            connection.rollback()
+        finally:
+            self._pool.put(connection)
+        return rows
 
     def clean(self):
         """Deletes tables from database"""
-        tables = get_table_list(self.cur)
+        self.cur.execute("SHOW TABLES")
+        tables = [row[0] for row in self.cur.fetchall()]
 
         for t in tables:
-            self.cur.execute('DROP TABLE %s' % t)
+            self.cur.execute('DROP TABLE `%s`' % t)
+
+    def commit(self):
+        """Wait until the queued samples are written."""
+        self._wait()
+        self.DB.commit()
+
+    def close(self, *args, **kwds):
+        """Close database."""
+        self.commit()
+        self._writer.queue.put(None)
+        self._writer.join()
+        self._pool.close()
+        self.cur.close()
+        self.DB.close()
 
     def savestate(self, state):
         """Store a dictionnary containing the state of the Sampler and its
@@ -139,25 +307,32 @@ class Database(sqlite.Database):
         return {}
 
 
-def load(dbname='', dbuser='', dbpass='', dbhost='localhost', dbport=3306):
+def load(dbname='', dbuser='', dbpass='', dbhost='localhost', dbport=3306, dbpool=2, dbdriver=None):
     """Load an existing MySQL database.
 
     Return a Database instance.
     """
-    db = Database(dbname=dbname, dbuser=dbuser, dbpass=dbpass, dbhost=dbhost, dbport=dbport, dbmode='a')
-    db.DB = MySQLdb.connect(db=dbname, user=dbuser, passwd=dbpass, host=dbhost, port=dbport)
-    db.cur = db.DB.cursor()
+    db = Database(dbname=dbname, dbuser=dbuser, dbpass=dbpass, dbhost=dbhost, dbport=dbport, dbmode='a', dbpool=dbpool, dbdriver=dbdriver)
 
     # Get the name of the objects
     tables = get_table_list(db.cur)
+    db.cur.execute('SELECT name, dtype, shape FROM %s' % sqlite.META_TABLE)
+    layouts = dict([(name, (dtype, eval(shape))) for name, dtype, shape in db.cur.fetchall()])
 
     # Create a Trace instance for each object
     chains = 0
     for name in tables:
-        db._traces[name] = Trace(name=name, db=db)
+        if layouts.has_key(name):
+            db._traces[name] = Trace(name=name, db=db)
+            db._traces[name]._set_layout(*layouts[name])
+        else:
+            db._traces[name] = sqlite.ColumnTrace(name=name, db=db)
+            db._traces[name]._shape = ()
         setattr(db, name, db._traces[name])
-        db.cur.execute('SELECT MAX(trace) FROM %s'%name)
-        chains = max(chains, db.cur.fetchall()[0][0]+1)
+        db.cur.execute('SELECT MAX(trace) FROM `%s`'%name)
+        last = db.cur.fetchall()[0][0]
+        if last is not None:
+            chains = max(chains, last+1)
 
     db.chains=chains
     db.trace_names = chains * [tables,]
@@ -166,8 +341,7 @@ def load(dbname='', dbuser='', dbpass='', dbhost='localhost', dbport=3306):
 
 # Copied form Django.
 def get_table_list(cursor):
-    """Returns a list of table names in the current database."""
-    # Skip the sqlite_sequence system table used for autoincrement key
-    # generation.
+    """Returns a list of table names in the current database, without the
+    table holding the layout of the traces."""
     cursor.execute("SHOW TABLES")
-    return [row[0] for row in cursor.fetchall()]
+    return [row[0] for row in cursor.fetchall() if row[0] != sqlite.META_TABLE]
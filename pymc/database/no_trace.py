@@ -18,11 +18,14 @@ class Trace(base.Trace):
 class Database(base.Database):
     """The no-trace backend provides a minimalistic backend where no
     trace of the values sampled is kept. This may be useful for testing
-    purposes.
+    purposes, or with online summaries (``MCMC(db='no_trace', online=True)``).
     """
     def __init__(self, dbname):
         """Get the Trace from the local scope."""
         self.__Trace__ = Trace
         self.__name__ = 'notrace'
         self.dbname = dbname
+        self.trace_names = []
+        self._traces = {}
+        self.chains = 0
 
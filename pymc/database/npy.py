@@ -0,0 +1,355 @@
+"""
+NPY database module
+
+Store the traces in NumPy .npy files, accessed through memory maps.
+
+For each chain, a directory named `Chain_#` is created. In this directory,
+one .npy file per tallyable object holds the values of the object.
+
+Implementation Notes
+--------------------
+The files are grown by `dbchunk` rows at a time during sampling, so chains
+do not need to fit in memory and their length need not be known in
+advance. The headers are written with enough padding to be rewritten in
+place as the chains grow. They are updated each time the database
+commits, so the files can be opened read-only, e.g. with
+``np.load(filename, mmap_mode='r')`` or `load`, by other processes while
+sampling continues. When a chain is finalized, its files are cut down to
+their exact length.
+
+Object-valued variables cannot be stored in .npy files and are not
+tallied.
+"""
+
+import base
+import os, sys, shutil, struct, warnings, cPickle
+import numpy as np
+
+__all__ = ['Trace', 'Database', 'load']
+
+CHAIN_NAME = 'Chain_%d'
+
+def _header_length(dtype, shape):
+    """Return the length of a header leaving room for any number of rows."""
+    n = len(_header_dict(dtype, (sys.maxint,) + shape)) + 11
+    return 64 * ((n + 63) // 64)
+
+def _header_dict(dtype, shape):
+    return "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % \
+        (np.lib.format.dtype_to_descr(dtype), tuple(shape))
+
+def _write_header(filename, dtype, shape, length):
+    """Write a version 1.0 .npy header of the given total length."""
+    d = _header_dict(dtype, shape)
+    f = open(filename, 'r+b')
+    try:
+        f.write(np.lib.format.MAGIC_PREFIX + '\x01\x00' + struct.pack('<H', length - 10) + d.ljust(length - 11) + '\n')
+    finally:
+        f.close()
+
+def _resize(filename, size):
+    """Extend or cut a file to the given size."""
+    f = open(filename, 'r+b')
+    try:
+        if size > os.path.getsize(filename):
+            f.seek(size - 1)
+            f.write('\0')
+        else:
+            f.truncate(size)
+    finally:
+        f.close()
+
+def _open(filename):
+    """Memory-map a .npy file read-only."""
+    f = open(filename, 'rb')
+    try:
+        np.lib.format.read_magic(f)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+    finally:
+        f.close()
+    if shape[0] == 0:
+        return np.zeros(shape, dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+class Trace(base.Trace):
+    """NPY Trace
+
+    Store the samples of each chain in a memory-mapped .npy file.
+    """
+
+    def __init__(self, name, getfunc=None, db=None):
+        """Create a Trace instance.
+
+        :Parameters:
+        name : string
+          The trace object name. This name should uniquely identify
+          the pymc variable.
+        getfunc : function
+          A function returning the value to tally.
+        db : Database instance
+          The database owning this Trace.
+        """
+        self._files = {}
+        self._maps = {}
+        self._index = {}
+        self._capacity = {}
+        self._layout = {}
+        base.Trace.__init__(self, name=name, getfunc=getfunc, db=db)
+
+    def _initialize(self, chain, length):
+        """Create the .npy file for a new chain, with room for one chunk."""
+        if self._getfunc is None:
+            self._getfunc = self.db.model._funs_to_tally[self.name]
+
+        value = np.asarray(self._getfunc())
+        shape = value.shape
+        header = _header_length(value.dtype, shape)
+        self._layout[chain] = (value.dtype, shape, header)
+        self._files[chain] = os.path.join(self.db._directory, CHAIN_NAME % chain, self.name + '.npy')
+        self._index[chain] = 0
+        self._capacity[chain] = 0
+        self._maps[chain] = None
+
+        open(self._files[chain], 'wb').close()
+        _resize(self._files[chain], header)
+        self._write_header(chain)
+        self._grow(chain)
+
+    def _rowsize(self, chain):
+        dtype, shape, header = self._layout[chain]
+        return dtype.itemsize * int(np.prod(shape))
+
+    def _write_header(self, chain):
+        dtype, shape, header = self._layout[chain]
+        _write_header(self._files[chain], dtype, (self._index[chain],) + shape, header)
+
+    def _map(self, chain, rows, mode):
+        dtype, shape, header = self._layout[chain]
+        self._maps[chain] = None
+        if rows > 0:
+            self._maps[chain] = np.memmap(self._files[chain], dtype=dtype, mode=mode, offset=header, shape=(rows,) + shape)
+
+    def _grow(self, chain):
+        """Extend the file of a chain by one chunk."""
+        if self._maps[chain] is not None:
+            self._maps[chain].flush()
+        self._capacity[chain] += self.db.chunk
+        dtype, shape, header = self._layout[chain]
+        _resize(self._files[chain], header + self._capacity[chain] * self._rowsize(chain))
+        self._map(chain, self._capacity[chain], 'r+')
+
+    def tally(self, chain):
+        """Store the object's current value to a chain.
+
+        :Parameters:
+        chain : integer
+          Chain index.
+        """
+        i = self._index[chain]
+        if i == self._capacity[chain]:
+            self._grow(chain)
+        self._maps[chain][i] = self._getfunc()
+        self._index[chain] = i + 1
+
+    def tally_block(self, chain, values):
+        """Store a block of values to a chain.
+
+        :Parameters:
+        chain : integer
+          Chain index.
+        values : array
+          The values to store, one per row.
+        """
+        i = self._index[chain]
+        while i + len(values) > self._capacity[chain]:
+            self._grow(chain)
+        self._maps[chain][i:i+len(values)] = values
+        self._index[chain] = i + len(values)
+
+    def commit(self, chain):
+        """Flush the values of a chain to disk and record its length in the
+        file header."""
+        if self._maps.get(chain) is not None:
+            self._maps[chain].flush()
+        self._write_header(chain)
+
+    def truncate(self, index, chain):
+        """
+        Truncate the trace to some index.
+
+        :Parameters:
+        index : int
+          The index within the chain after which all values will be removed.
+        chain : int
+          The chain index (>=0).
+        """
+        self._index[chain] = min(index, self._index[chain])
+        self.commit(chain)
+
+    def _finalize(self, chain):
+        """Cut the file of a chain down to its exact length."""
+        self.commit(chain)
+        dtype, shape, header = self._layout[chain]
+        self._maps[chain] = None
+        _resize(self._files[chain], header + self._index[chain] * self._rowsize(chain))
+        self._capacity[chain] = self._index[chain]
+        self._map(chain, self._index[chain], 'r')
+
+    def _chain_trace(self, chain):
+        # Return the memmap of a chain, empty rows excluded.
+        m = self._maps.get(chain)
+        if m is None:
+            if not self._layout.has_key(chain):
+                # Chain stored on disk by another session or process.
+                return _open(self._files[chain])
+            dtype, shape, header = self._layout[chain]
+            return np.zeros((0,) + shape, dtype)
+        return m[:self._index[chain]]
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        """Return the trace.
+
+        :Stochastics:
+          - burn (int): The number of transient steps to skip.
+          - thin (int): Keep one in thin.
+          - chain (int): The index of the chain to fetch. If None, return all chains.
+          - slicing: A slice, overriding burn and thin assignement.
+        """
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return np.asarray(self._chain_trace(chain)[slicing])
+        else:
+            chains = sorted(self._files.keys())
+            return np.concatenate([self._chain_trace(c) for c in chains])[slicing]
+
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        """Return the length of the trace.
+
+        :Parameters:
+        chain : int or None
+          The chain index. If None, returns the combined length of all chains.
+        """
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return len(self._chain_trace(chain))
+        else:
+            return sum([len(self._chain_trace(c)) for c in self._files.keys()])
+
+
+class Database(base.Database):
+    """NPY Database class."""
+
+    def __init__(self, dbname=None, dbmode='a', dbchunk=4096):
+        """Create a NPY Database.
+
+        :Parameters:
+        dbname : string
+          Name of the directory where the traces are stored.
+        dbmode : {a, w}
+          Opening mode: a:append, w:write.
+        dbchunk : int
+          Number of rows by which the files are grown.
+        """
+        self.__name__ = 'npy'
+        self._directory = dbname
+        self.__Trace__ = Trace
+        self.mode = dbmode
+        self.chunk = dbchunk
+
+        self.trace_names = []   # A list of sequences of names of the objects to tally.
+        self._traces = {} # A dictionary of the Trace objects.
+        self.chains = 0
+
+        if os.path.exists(self._directory):
+            if dbmode=='w':
+                shutil.rmtree(self._directory)
+                os.mkdir(self._directory)
+        else:
+            os.mkdir(self._directory)
+
+    def get_chains(self):
+        """Return an ordered list of the `Chain_#` directories in the db
+        directory."""
+        chains = []
+        for c in os.listdir(self._directory):
+            if os.path.isdir(os.path.join(self._directory, c)) and c.startswith(CHAIN_NAME[:-2]):
+                chains.append(c)
+        chains.sort(key=lambda c: int(c[len(CHAIN_NAME)-2:]))
+        return chains
+
+    def _initialize(self, funs_to_tally, length):
+        """Create a folder to store the chain's files."""
+        os.mkdir(os.path.join(self._directory, CHAIN_NAME%self.chains))
+
+        funs = {}
+        for name, fun in funs_to_tally.iteritems():
+            if np.asarray(fun()).dtype == np.dtype('object'):
+                warnings.warn('The npy backend cannot store object-valued %s; it will not be tallied.' % name)
+            else:
+                funs[name] = fun
+
+        base.Database._initialize(self, funs, length)
+
+    def commit(self):
+        """Flush the values of the last chain to disk and update the file
+        headers."""
+        if self.chains == 0:
+            return
+        chain = self.chains - 1
+        for name in self.trace_names[chain]:
+            self._traces[name].commit(chain)
+
+    def savestate(self, state):
+        """Store a dictionary containing the state of the Sampler and its
+        StepMethods."""
+        self._state_ = state
+        file = open(os.path.join(self._directory, 'state.pkl'), 'wb')
+        try:
+            cPickle.dump(state, file)
+        finally:
+            file.close()
+
+
+def load(dirname):
+    """Create a Database instance from the files stored in the directory.
+
+    The files are memory-mapped read-only, and only the rows committed
+    by the time `load` is called are visible.
+    """
+    if not os.path.exists(dirname):
+        raise AttributeError, 'No npy database named %s'%dirname
+
+    db = Database(dirname, dbmode='a')
+    chains = db.get_chains()
+    db.chains = len(chains)
+
+    for chain, folder in enumerate(chains):
+        names = []
+        for file in os.listdir(os.path.join(dirname, folder)):
+            name, ext = os.path.splitext(file)
+            if ext != '.npy':
+                continue
+            names.append(name)
+            if not db._traces.has_key(name):
+                db._traces[name] = Trace(name=name, db=db)
+                setattr(db, name, db._traces[name])
+            db._traces[name]._files[chain] = os.path.join(dirname, folder, file)
+        db.trace_names.append(names)
+
+    # Load the state.
+    statefile = os.path.join(dirname, 'state.pkl')
+    if os.path.exists(statefile):
+        file = open(statefile, 'rb')
+        db._state_ = cPickle.load(file)
+        file.close()
+    else:
+        db._state_= {}
+
+    return db
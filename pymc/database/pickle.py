@@ -12,17 +12,131 @@ versions. Users should use this backend only for shortlived projects.
 
 import ram, no_trace, base
 import os, datetime, numpy
-import string, cPickle
+import string, cPickle, struct
 
 __all__ = ['Trace', 'Database', 'load']
 
+# Files start with MAGIC, followed by frames made of a header, the name of
+# the trace the frame belongs to and a pickled block of rows. Files without
+# MAGIC hold a single pickled dictionary, as written by earlier versions.
+MAGIC = 'PyMCpkl\x01'
+
+# Name length, chain, index of the first row, number of rows, pickle size.
+HEADER = struct.Struct('<HiqqQ')
+
+def _write_frame(file, name, chain, start, rows, obj):
+    data = cPickle.dumps(obj, -1)
+    file.write(HEADER.pack(len(name), chain, start, rows, len(data)))
+    file.write(name)
+    file.write(data)
+
 class Trace(ram.Trace):
-    pass
+    """Pickle Trace
+
+    Store the samples in memory like ram.Trace. The rows of chains loaded
+    from disk are only unpickled when they are first accessed.
+    """
+
+    def __init__(self, name, getfunc=None, db=None, value=None, blocks=None):
+        """Create a Trace instance.
+
+        :Parameters:
+        name : string
+          The trace object name. This name should uniquely identify
+          the pymc variable.
+        getfunc : function
+          A function returning the value to tally.
+        db : Database instance
+          The database owning this Trace.
+        value : dict
+          The chain - array pairs, when loading the Trace from disk.
+        blocks : dict
+          The chain - frame list pairs, when loading the Trace from disk.
+          Each frame is given as (start, rows, offset, size).
+        """
+        ram.Trace.__init__(self, name=name, getfunc=getfunc, db=db, value=value)
+        self._blocks = blocks or {}
+        for chain, frames in self._blocks.iteritems():
+            n = 0
+            for start, rows, offset, size in frames:
+                n = min(n, start) + rows
+            self._index[chain] = n
+        # Number of rows of each chain already written to disk.
+        self._committed = dict(self._index)
+
+    def _initialize(self, chain, length):
+        ram.Trace._initialize(self, chain, length)
+        self._committed[chain] = 0
+
+    def _read(self, chain=None):
+        """Unpickle the frames of a chain and concatenate them. If chain is
+        None, read all chains."""
+        if chain is None:
+            for c in self._blocks.keys():
+                self._read(c)
+            return
+        frames = self._blocks.pop(chain, None)
+        if frames is None:
+            return
+        file = open(self.db.filename, 'rb')
+        try:
+            pieces, n = [], 0
+            for start, rows, offset, size in frames:
+                # Drop the rows removed by a truncation.
+                while n > start:
+                    last = pieces.pop()
+                    n -= len(last)
+                    if n < start:
+                        pieces.append(last[:start-n])
+                        n = start
+                file.seek(offset)
+                pieces.append(cPickle.loads(file.read(size)))
+                n += rows
+        finally:
+            file.close()
+        self._trace[chain] = numpy.concatenate(pieces)
+
+    def _uncommitted(self):
+        """Return a list of (chain, start, values) holding the rows tallied
+        since the last commit, and mark them as committed. start is smaller
+        than the number of rows already committed if the chain has been
+        truncated since."""
+        blocks = []
+        for chain, trace in self._trace.iteritems():
+            n = min(len(trace), self._index[chain])
+            start = self._committed.get(chain, 0)
+            if n != start:
+                start = min(start, n)
+                blocks.append((chain, start, trace[start:n]))
+                self._committed[chain] = n
+        return blocks
+
+    def truncate(self, index, chain):
+        self._read(chain)
+        ram.Trace.truncate(self, index, chain)
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        if chain is not None and chain < 0:
+            chain = range(self.db.chains)[chain]
+        self._read(chain)
+        return ram.Trace.gettrace(self, burn, thin, chain, slicing)
+
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        if chain is not None and chain < 0:
+            chain = range(self.db.chains)[chain]
+        if chain is not None and self._blocks.has_key(chain):
+            return self._index[chain]
+        self._read(chain)
+        return ram.Trace.length(self, chain)
 
 class Database(base.Database):
     """Pickle database backend.
 
-    Save the trace to a pickle file.
+    Save the trace to a pickle file. Each commit appends the rows tallied
+    since the previous commit to the file, so the cost of a commit does not
+    grow with the length of the chains.
     """
 
     def __init__(self, dbname=None, dbmode='a'):
@@ -41,35 +155,96 @@ class Database(base.Database):
         self.trace_names = []   # A list of sequences of names of the objects to tally.
         self._traces = {} # A dictionary of the Trace objects.
         self.chains = 0
+        # Whether the file already holds the committed frames. If not, it is
+        # rewritten from scratch at the next commit.
+        self._append = False
+        self._committed_state = None
+        # End of the last complete frame, if the file was loaded. Anything
+        # after it is an incomplete frame, dropped at the next commit.
+        self._end = None
 
         if os.path.exists(dbname):
             if dbmode=='w':
                 os.remove(dbname)
 
     def commit(self):
-        """Dump traces using cPickle."""
-        container={}
+        """Append the rows tallied since the last commit to the file."""
+        if self._append:
+            file = open(self.filename, 'ab')
+            if self._end is not None and os.path.getsize(self.filename) > self._end:
+                file.truncate(self._end)
+            self._end = None
+        else:
+            file = open(self.filename, 'wb')
+            file.write(MAGIC)
+            self._append = True
         try:
-            for name in self._traces.iterkeys():
-                container[name] = self._traces[name]._trace
-            container['_state_'] = self._state_
-
-            file = open(self.filename, 'w')
-            cPickle.dump(container, file)
+            for name, trace in self._traces.iteritems():
+                for chain, start, values in trace._uncommitted():
+                    _write_frame(file, name, chain, start, len(values), values)
+            state = getattr(self, '_state_', None)
+            if state is not None and state is not self._committed_state:
+                _write_frame(file, '_state_', -1, 0, 0, state)
+                self._committed_state = state
+        finally:
             file.close()
-        except AttributeError:
-            pass
 
 
 def load(filename):
     """Load a pickled database.
 
-    Return a Database instance.
+    Return a Database instance. The trace values are read from the file
+    when they are first accessed.
     """
-    file = open(filename, 'r')
-    container = cPickle.load(file)
-    file.close()
-    db = Database(file.name)
+    file = open(filename, 'rb')
+    try:
+        if file.read(len(MAGIC)) != MAGIC:
+            file.seek(0)
+            return _load_container(filename, cPickle.load(file))
+
+        db = Database(filename)
+        db._append = True
+        blocks = {}
+        end = file.tell()
+        while True:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            namelen, chain, start, rows, size = HEADER.unpack(header)
+            name = file.read(namelen)
+            offset = file.tell()
+            data_end = offset + size
+            if len(name) < namelen or data_end > os.path.getsize(filename):
+                break
+            if name == '_state_':
+                db._state_ = cPickle.loads(file.read(size))
+                db._committed_state = db._state_
+            else:
+                blocks.setdefault(name, {}).setdefault(chain, []).append((start, rows, offset, size))
+                file.seek(size, 1)
+            end = data_end
+    finally:
+        file.close()
+
+    # An incomplete frame left by an interrupted commit is ignored, and
+    # dropped at the next commit.
+    db._end = end
+
+    chains = 0
+    for name, frames in blocks.iteritems():
+        db._traces[name] = Trace(name=name, db=db, blocks=frames)
+        setattr(db, name, db._traces[name])
+        chains = max([chains] + [c+1 for c in frames.keys()])
+
+    db.chains = chains
+    db.trace_names = chains*[blocks.keys()]
+
+    return db
+
+def _load_container(filename, container):
+    """Create a Database from a dictionary pickled by earlier versions. The
+    file is rewritten in the current format at the next commit."""
+    db = Database(filename)
     chains = 0
     funs = set()
     for k,v in container.iteritems():
@@ -77,6 +252,7 @@ def load(filename):
            db._state_ = v
         else:
             db._traces[k] = Trace(name=k, value=v, db=db)
+            db._traces[k]._committed = {}
             setattr(db, k, db._traces[k])
             chains = max(chains, len(v))
             funs.add(k)
@@ -85,5 +261,3 @@ def load(filename):
     db.trace_names = chains*[list(funs)]
 
     return db
-
-
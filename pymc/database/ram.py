@@ -10,6 +10,11 @@ append values to a stack. It might be worthwhile to use a list instead
 of a NumPy array to 1. simplify this backend, 2. standardize the
 `Trace model` and 3. remove the need for a truncate method.
 We would need to catch MemoryError exceptions though.
+
+Alternatively, passing `dbchunk` to the Database stores each chain in
+fixed-size chunks that are allocated as sampling proceeds (ChunkedTrace).
+Chains then need no preallocation or truncation, and slices lying within
+a single chunk are returned as read-only views rather than copies.
 """
 
 import pymc
@@ -17,7 +22,7 @@ from numpy import zeros,shape,concatenate, ndarray,dtype
 import base
 import numpy as np
 
-__all__ = ['Trace', 'Database']
+__all__ = ['Trace', 'ChunkedTrace', 'Database']
 
 class Trace(base.Trace):
     """RAM Trace
@@ -94,6 +99,19 @@ class Trace(base.Trace):
             self._trace[chain][self._index[chain]] = value
         self._index[chain] += 1
 
+    def tally_block(self, chain, values):
+        """Store a block of values to a chain.
+
+        :Parameters:
+        chain : integer
+          Chain index.
+        values : array
+          The values to store, one per row.
+        """
+        i = self._index[chain]
+        self._trace[chain][i:i+len(values)] = values
+        self._index[chain] += len(values)
+
     def truncate(self, index, chain):
         """
         Truncate the trace array to some index.
@@ -142,16 +160,165 @@ class Trace(base.Trace):
         else:
             return sum([t.shape[0] for t in self._trace.values()])
 
+class ChunkedTrace(Trace):
+    """RAM Trace storing each chain in chunks.
+
+    Chunks of db.chunk samples are allocated as they are needed, so
+    that chains can grow without copying the samples already stored.
+    """
+
+    def __init__(self, name, getfunc=None, db=None, value=None):
+        """Create a ChunkedTrace instance.
+
+        :Parameters:
+        name : string
+          The trace object name. This name should uniquely identify
+          the pymc variable.
+        getfunc : function
+          A function returning the value to tally.
+        db : Database instance
+          The database owning this Trace.
+        value : list
+          Not used."""
+        self._chunks = {}
+        self._layout = {}
+        Trace.__init__(self, name=name, getfunc=getfunc, db=db)
+
+    def _initialize(self, chain, length):
+        """Start a new chain with a single empty chunk. length is ignored."""
+        if self._getfunc is None:
+            self._getfunc = self.db.model._funs_to_tally[self.name]
+
+        value = np.array(self._getfunc())
+        self._layout[chain] = (shape(value), value.dtype)
+        self._chunks[chain] = []
+        self._index[chain] = 0
+        self._new_chunk(chain)
+
+    def _new_chunk(self, chain):
+        value_shape, value_dtype = self._layout[chain]
+        self._current = zeros((self.db.chunk,) + value_shape, value_dtype)
+        self._row = 0
+        self._chunks[chain].append(self._current)
+
+    def tally(self, chain):
+        """Store the object's current value to a chain.
+
+        :Parameters:
+        chain : integer
+          Chain index. Values can only be appended to the last chain.
+        """
+        if self._row == self.db.chunk:
+            self._new_chunk(chain)
+        self._current[self._row] = self._getfunc()
+        self._row += 1
+        self._index[chain] += 1
+
+    def tally_block(self, chain, values):
+        """Store a block of values to a chain, filling chunks as needed.
+
+        :Parameters:
+        chain : integer
+          Chain index. Values can only be appended to the last chain.
+        values : array
+          The values to store, one per row.
+        """
+        start = 0
+        while start < len(values):
+            if self._row == self.db.chunk:
+                self._new_chunk(chain)
+            n = min(len(values) - start, self.db.chunk - self._row)
+            self._current[self._row:self._row+n] = values[start:start+n]
+            self._row += n
+            start += n
+        self._index[chain] += len(values)
+
+    def truncate(self, index, chain):
+        """
+        Truncate the trace to some index, releasing the unused chunks.
+
+        :Parameters:
+        index : int
+          The index within the chain after which all values will be removed.
+        chain : int
+          The chain index (>=0).
+        """
+        n = max(1, -(-index // self.db.chunk))
+        del self._chunks[chain][n:]
+        self._index[chain] = min(index, self._index[chain])
+        if chain == self.db.chains - 1:
+            self._current = self._chunks[chain][-1]
+            self._row = self._index[chain] - (n-1) * self.db.chunk
+
+    def _gettrace(self, chain, slicing):
+        # Return a view if the slice lies within a single chunk, a copy otherwise.
+        length = self._index[chain]
+        chunks = self._chunks[chain]
+        start, stop, step = slicing.indices(length)
+        if step > 0 and start < stop and start // self.db.chunk == (stop-1) // self.db.chunk:
+            offset = (start // self.db.chunk) * self.db.chunk
+            view = chunks[start // self.db.chunk][start-offset:stop-offset:step]
+            view.flags['W'] = False
+            return view
+        return concatenate(chunks)[:length][slicing]
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        """Return the trace.
+
+        :Stochastics:
+          - burn (int): The number of transient steps to skip.
+          - thin (int): Keep one in thin.
+          - chain (int): The index of the chain to fetch. If None, return all chains.
+          - slicing: A slice, overriding burn and thin assignement.
+        """
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return self._gettrace(chain, slicing)
+        else:
+            chains = sorted(self._chunks.keys())
+            return concatenate([self._gettrace(c, slice(None)) for c in chains])[slicing]
+
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        """Return the length of the trace.
+
+        :Parameters:
+        chain : int or None
+          The chain index. If None, returns the combined length of all chains.
+        """
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return self._index[chain]
+        else:
+            return sum(self._index.values())
+
 class Database(base.Database):
     """RAM database.
 
     Store the samples in memory. No data is written to disk.
     """
 
-    def __init__(self, dbname):
-        """Create a RAM Database instance."""
+    def __init__(self, dbname, dbchunk=None):
+        """Create a RAM Database instance.
+
+        :Parameters:
+        dbname : string
+          Name of the database.
+        dbchunk : int
+          If given, chains are stored in chunks of this many samples,
+          allocated as they are needed, instead of being preallocated.
+        """
         self.__name__ = 'ram'
-        self.__Trace__ = Trace
+        self.chunk = dbchunk
+        if dbchunk:
+            self.__Trace__ = ChunkedTrace
+        else:
+            self.__Trace__ = Trace
         self.dbname = dbname
         self.trace_names = []   # A list of sequences of names of the objects to tally.
         self._traces = {} # A dictionary of the Trace objects.
@@ -7,14 +7,25 @@ Implementation Notes
 --------------------
 For each object, a table is created with the following format:
 
-key (INT), trace (INT),  v1 (FLOAT), v2 (FLOAT), v3 (FLOAT) ...
+recid (INTEGER), trace (INTEGER), value
 
-For multidimensional objects, ndim>1, eg (2,2) the table has the following format:
+recid is the index of the sample within its chain and trace denotes the
+chain index; both start at 0. (trace, recid) is the primary key of the
+table, so that fetching a slice of a chain is a range scan of its index.
 
-key (INT), trace (INT),  v1_1 (FLOAT), v1_2 (FLOAT), v2_1 (FLOAT), v2_2 (FLOAT)
+Scalar objects store their values in a REAL or INTEGER column. The values
+of array-valued objects are stored as a BLOB holding the raw bytes of the
+array (float64 for float arrays), so the size of the arrays is not limited
+by the number of columns of a table. Object-valued traces are stored as
+pickles. The dtype and shape of each trace are kept in the _pymc_traces
+table.
 
-The key is autoincremented each time a new row is added to the table.
-trace denotes the chain index, and starts at 0.
+Rows are inserted with parameterized `executemany` queries, one block of
+`Database.buffer` iterations at a time, and the database uses write-ahead
+logging so that other processes can read it while sampling proceeds.
+
+Databases written by earlier versions, which store the elements of the
+values in one FLOAT column each, can still be loaded and appended to.
 
 Additional Dependencies
 -----------------------
@@ -28,70 +39,185 @@ DB API changes, October 2008, DH.
 Added support for multidimensional arrays, DH Oct. 2009
 """
 
-# TODO: Add support for integer valued objects.
-
 import numpy as np
 from numpy import zeros, shape, squeeze, transpose
 import sqlite3
 import base, pickle, ram, pymc
-import pdb,os
+import pdb, os, cPickle
 from pymc.database import base
 
-__all__ = ['Trace', 'Database', 'load']
+__all__ = ['Trace', 'ColumnTrace', 'Database', 'load']
+
+META_TABLE = '_pymc_traces'
 
 class Trace(base.Trace):
     """SQLite Trace class."""
 
-    def _initialize(self, chain, length):
-        """Create an SQL table.
+    def __init__(self, name, getfunc=None, db=None):
+        """Create a Trace instance.
+
+        :Parameters:
+        name : string
+          The trace object name. This name should uniquely identify
+          the pymc variable.
+        getfunc : function
+          A function returning the value to tally.
+        db : Database instance
+          The database owning this Trace.
         """
+        self._index = {}
+        base.Trace.__init__(self, name=name, getfunc=getfunc, db=db)
+
+    def _set_layout(self, dtype, shape):
+        """Set the dtype and shape of the values and the type of the value
+        column."""
+        self._dtype = np.dtype(dtype)
+        self._shape = tuple(shape)
+        if self._shape == () and self._dtype.kind in 'biu':
+            self._column = 'INTEGER'
+        elif self._shape == () and self._dtype.kind == 'f':
+            self._column = 'REAL'
+        else:
+            self._column = 'BLOB'
+
+    def _initialize(self, chain, length):
+        """Create the SQL table if it does not exist yet."""
 
         if self._getfunc is None:
             self._getfunc = self.db.model._funs_to_tally[self.name]
 
+        value = np.asarray(self._getfunc())
+        self._set_layout(value.dtype, value.shape)
+        self._index[chain] = 0
 
-        # Determine size
-        try:
-            self._shape = np.shape(self._getfunc())
-        except TypeError:
-            self._shape = None
+        query = 'CREATE TABLE IF NOT EXISTS "%s" (recid INTEGER NOT NULL, trace INTEGER NOT NULL, value %s, PRIMARY KEY (trace, recid))' % (self.name, self._column)
+        self.db.cur.execute(query)
+        self.db.cur.execute('INSERT OR REPLACE INTO %s VALUES (?, ?, ?)' % META_TABLE, (self.name, self._dtype.str, repr(self._shape)))
+
+    def _encode(self, values):
+        """Return the list of column values storing values."""
+        if self._column == 'REAL':
+            return np.asarray(values, dtype=float).tolist()
+        elif self._column == 'INTEGER':
+            return np.asarray(values, dtype=int).tolist()
+        elif self._dtype == np.dtype(object):
+            return [sqlite3.Binary(cPickle.dumps(v, -1)) for v in values]
+        else:
+            values = np.asarray(values, dtype=self._dtype)
+            return [sqlite3.Binary(v.tostring()) for v in values]
+
+    def _decode(self, data):
+        """Return the array of values stored in the column values data."""
+        if self._column != 'BLOB':
+            return np.array(data, dtype=self._dtype)
+        elif self._dtype == np.dtype(object):
+            values = np.empty(len(data), dtype=object)
+            for i, d in enumerate(data):
+                values[i] = cPickle.loads(str(d))
+            return values
+        else:
+            values = np.fromstring(''.join([str(d) for d in data]), dtype=self._dtype)
+            return values.reshape((len(data),) + self._shape)
 
-        self._vstr = ', '.join(var_str(self._shape))
+    def tally(self, chain):
+        """Adds current value to trace."""
+        self.tally_block(chain, [self._getfunc()])
+
+    def tally_block(self, chain, values):
+        """Adds a block of values to the trace with a single query."""
+        data = self._encode(values)
+        i = self._index[chain]
+        rows = zip(range(i, i+len(data)), [chain]*len(data), data)
+        self.db.cur.executemany('INSERT INTO "%s" (recid, trace, value) VALUES (?, ?, ?)' % self.name, rows)
+        self._index[chain] = i + len(data)
+
+    def truncate(self, index, chain):
+        """Delete the samples of the chain from index on."""
+        self.db.cur.execute('DELETE FROM "%s" WHERE trace=? AND recid>=?' % self.name, (chain, index))
+        self._index[chain] = min(index, self._index.get(chain, index))
+
+    def _fetch(self, query, params=()):
+        """Execute a SELECT query and return the rows."""
+        self.db.cur.execute(query, params)
+        return self.db.cur.fetchall()
+
+    def _select(self, chain, slicing):
+        """Return the values of a chain selected by slicing, fetching only
+        the rows in the slice."""
+        start, stop, step = slicing.indices(self.length(chain))
+        recids = xrange(start, stop, step)
+        if len(recids) == 0:
+            return zeros((0,) + self._shape, self._dtype)
+        lo, hi = min(recids), max(recids)
+        query = 'SELECT value FROM "%s" WHERE trace=? AND recid BETWEEN ? AND ?' % self.name
+        params = [chain, lo, hi]
+        if abs(step) > 1:
+            query += ' AND (recid - ?) % ? = 0'
+            params += [lo, abs(step)]
+        query += ' ORDER BY recid'
+        if step < 0:
+            query += ' DESC'
+        return self._decode([row[0] for row in self._fetch(query, params)])
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        """Return the trace (last by default).
+
+        Input:
+          - burn (int): The number of transient steps to skip.
+          - thin (int): Keep one in thin.
+          - chain (int): The index of the chain to fetch. If None, return all
+            chains. By default, the last chain is returned.
+          - slicing: A slice, overriding burn and thin assignement.
+        """
 
-        # If the table already exists, exit now.
-        if chain != 0:
-            return
+        if not slicing:
+            slicing = slice(burn, None, thin)
 
-        # Create the variable name strings.
-        vstr = ', '.join(v + ' FLOAT' for v in var_str(self._shape))
+        # If chain is None, get the data from all chains.
+        if chain is None:
+            trace = np.concatenate([self._select(c, slice(None)) for c in range(self.db.chains)])
+            return trace[slicing]
+        else:
+            # Deal with negative chains (starting from the end)
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return self._select(chain, slicing)
 
-        query = "create table %s (recid INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, trace  int(5), %s )" % (self.name, vstr)
 
-        self.db.cur.execute(query)
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        """Return the sample length of given chain. If chain is None,
+        return the total length of all chains."""
+        if chain is None:
+            rows = self._fetch('SELECT COUNT(*) FROM "%s"' % self.name)
+        else:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            rows = self._fetch('SELECT COUNT(*) FROM "%s" WHERE trace=?' % self.name, (chain,))
+        return rows[0][0]
 
+class ColumnTrace(base.Trace):
+    """Trace stored in one FLOAT column per element, as written by earlier
+    versions of this backend."""
 
+    def _initialize(self, chain, length):
+        """Check that the values fit the columns of the existing table."""
+        base.Trace._initialize(self, chain, length)
+        size = np.size(self._getfunc())
+        if size != np.prod(self._shape):
+            raise ValueError, "The values of %s have %d elements, but its table in the old one-column-per-element layout has %d columns. Sample with dbmode='w' to start a new database." % (self.name, size, np.prod(self._shape))
+        self._vstr = ', '.join(var_str(self._shape))
 
     def tally(self, chain):
         """Adds current value to trace."""
+        self.tally_block(chain, [self._getfunc()])
 
-        try:
-            # I changed str(x) to '%f'%x to solve a bug appearing due to
-            # locale settings. In french for instance, str prints a comma
-            # instead of a colon to indicate the decimal, which confuses
-            # the database into thinking that there are more values than there
-            # is.  A better solution would be to use another delimiter than the
-            # comma. -DH
-            valstring = ', '.join(['%f'%x for x in np.ravel(self._getfunc())])
-        except:
-            valstring = str(self._getfunc())
-
-
-        # Add value to database
-        query = "INSERT INTO %s (recid, trace, %s) values (NULL, %s, %s)" % \
-            (self.name, self._vstr, chain, valstring)
-        self.db.cur.execute(query)
-
-
+    def tally_block(self, chain, values):
+        """Adds a block of values to the trace with a single query."""
+        rows = [[chain] + np.ravel(v).astype(float).tolist() for v in values]
+        marks = ', '.join(['?'] * len(rows[0]))
+        self.db.cur.executemany('INSERT INTO %s (recid, trace, %s) VALUES (NULL, %s)' % (self.name, self._vstr, marks), rows)
 
     def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
         """Return the trace (last by default).
@@ -125,19 +251,6 @@ class Trace(base.Trace):
 
     __call__ = gettrace
 
-#    def nchains(self):
-#        """Return the number of existing chains, completed or not."""
-#        try:
-#            self.db.cur.execute('SELECT MAX(trace) FROM %s'%self.name)
-#            trace = self.db.cur.fetchall()[0][0]
-#
-#            if trace is None:
-#                return 0
-#            else:
-#                return trace + 1
-#        except:
-#           return 0
-
     def length(self, chain=-1):
         """Return the sample length of given chain. If chain is None,
         return the total length of all chains."""
@@ -147,6 +260,9 @@ class Database(base.Database):
     """SQLite database.
     """
 
+    # Insert the samples in blocks of this many iterations.
+    buffer = 1000
+
     def __init__(self, dbname, dbmode='a'):
         """Open or create an SQL database.
 
@@ -170,6 +286,9 @@ class Database(base.Database):
 
         self.DB = sqlite3.connect(dbname, check_same_thread=False)
         self.cur = self.DB.cursor()
+        self.cur.execute('PRAGMA journal_mode=WAL')
+        self.cur.execute('PRAGMA synchronous=NORMAL')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY, dtype TEXT, shape TEXT)' % META_TABLE)
 
     def commit(self):
         """Commit updates to database"""
@@ -216,15 +335,23 @@ def load(dbname):
 
     # Get the name of the objects
     tables = get_table_list(db.cur)
+    db.cur.execute('SELECT name, dtype, shape FROM %s' % META_TABLE)
+    layouts = dict([(name, (dtype, eval(shape))) for name, dtype, shape in db.cur.fetchall()])
 
     # Create a Trace instance for each object
     chains = 0
     for name in tables:
-        db._traces[name] = Trace(name=name, db=db)
-        db._traces[name]._shape = get_shape(db.cur, name)
+        if layouts.has_key(name):
+            db._traces[name] = Trace(name=name, db=db)
+            db._traces[name]._set_layout(*layouts[name])
+        else:
+            db._traces[name] = ColumnTrace(name=name, db=db)
+            db._traces[name]._shape = get_shape(db.cur, name)
         setattr(db, name, db._traces[name])
-        db.cur.execute('SELECT MAX(trace) FROM %s'%name)
-        chains = max(chains, db.cur.fetchall()[0][0]+1)
+        db.cur.execute('SELECT MAX(trace) FROM "%s"'%name)
+        last = db.cur.fetchall()[0][0]
+        if last is not None:
+            chains = max(chains, last+1)
 
     db.chains=chains
     db.trace_names = chains * [tables,]
@@ -236,11 +363,11 @@ def load(dbname):
 def get_table_list(cursor):
     """Returns a list of table names in the current database."""
     # Skip the sqlite_sequence system table used for autoincrement key
-    # generation.
+    # generation, and the table holding the layout of the traces.
     cursor.execute("""
         SELECT name FROM sqlite_master
-        WHERE type='table' AND NOT name='sqlite_sequence'
-        ORDER BY name""")
+        WHERE type='table' AND NOT name='sqlite_sequence' AND NOT name='%s'
+        ORDER BY name""" % META_TABLE)
     return [row[0] for row in cursor.fetchall()]
 
 def get_shape(cursor, name):
@@ -8,8 +8,13 @@ one file per tallyable object is created containing the values of the object.
 
 Implementation Notes
 --------------------
-The NumPy arrays are saved and loaded using NumPy's `loadtxt` and `savetxt`
-functions.
+By default, the traces are kept in memory and written to the files once
+sampling is completed. With ``dbstream=n``, the values are instead written to
+the files during sampling, in blocks of n rows, so that only the current
+block is held in memory and the rows written before a crash are kept.
+
+Rows are formatted a block at a time with a single string formatting
+operation, and the files are parsed in chunks with `numpy.fromstring`.
 
 Changeset
 ---------
@@ -20,16 +25,82 @@ Oct. 1, 2009: Added support for multidimensional arrays.
 
 
 import base, ram
-import os, datetime, shutil, re
+import os, sys, datetime, shutil, re
 import numpy as np
 from numpy import array
 import string
 
 
-__all__ = ['Trace', 'Database', 'load']
+__all__ = ['Trace', 'StreamTrace', 'Database', 'load']
 
 CHAIN_NAME = 'Chain_%d'
 
+def _write_header(f, name, shape, width=0, date=True):
+    """Write the header of a trace file. The shape is padded to width
+    characters so that it can be rewritten in place, leaving out the date."""
+    print >> f, '# Variable: %s' % name
+    print >> f, '# Sample shape: %s' % str(shape).ljust(width)
+    if date:
+        print >> f, '# Date: %s' % datetime.datetime.now()
+
+def _write_rows(f, arr, block=1000):
+    """Write the values of a 2D array, one row per line. Blocks of rows are
+    formatted at once rather than line by line."""
+    if len(arr) == 0:
+        return
+    if arr.dtype.kind in 'biu':
+        fmt = '%d'
+    else:
+        fmt = '%.18e'
+    line = ','.join([fmt]*arr.shape[1]) + '\n'
+    for i in xrange(0, len(arr), block):
+        rows = arr[i:i+block]
+        f.write((line*len(rows)) % tuple(rows.ravel().tolist()))
+
+def _parse(text):
+    text = text.strip()
+    if not text:
+        return np.zeros(0)
+    return np.fromstring(text.replace('\n', ','), dtype=float, sep=',')
+
+def _read(path, size=2**20):
+    """Read a trace file, parsing size bytes at a time.
+
+    The number of samples is given by the number of complete rows in the
+    file, so files still being written or left by an interrupted run can
+    be read as well.
+    """
+    f = open(path)
+    try:
+        shape = None
+        pos = f.tell()
+        line = f.readline()
+        while line.startswith('#'):
+            if line.startswith('# Sample shape:'):
+                shape = eval(line[16:])
+            pos = f.tell()
+            line = f.readline()
+        f.seek(pos)
+
+        pieces = []
+        rest = ''
+        while True:
+            data = f.read(size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind('\n') + 1
+            rest = data[cut:]
+            pieces.append(_parse(data[:cut]))
+        pieces.append(_parse(rest))
+    finally:
+        f.close()
+
+    values = np.concatenate(pieces)
+    rowsize = int(np.prod(shape[1:]))
+    n = len(values) // rowsize
+    return values[:n*rowsize].reshape((n,) + tuple(shape[1:]))
+
 class Trace(ram.Trace):
     """Txt Trace Class.
 
@@ -57,16 +128,161 @@ class Trace(ram.Trace):
         path = os.path.join(self.db._directory, self.db.get_chains()[chain], self.name+'.txt')
         arr = self.gettrace(chain=chain)
         f = open(path, 'w')
-        print >> f, '# Variable: %s' % self.name
-        print >> f, '# Sample shape: %s' % str(arr.shape)
-        print >> f, '# Date: %s' % datetime.datetime.now()
-        np.savetxt(f, arr.reshape((-1, arr[0].size)), delimiter=',')
-        f.close()
+        try:
+            _write_header(f, self.name, arr.shape)
+            _write_rows(f, arr.reshape((len(arr), int(np.prod(arr.shape[1:])))))
+        finally:
+            f.close()
+
+class StreamTrace(base.Trace):
+    """Txt Trace writing the values to the file as they are tallied.
+
+    Only the samples written to disk are kept; gettrace reads them back
+    from the file.
+    """
+
+    def __init__(self, name, getfunc=None, db=None):
+        """Create a StreamTrace instance.
+
+        :Parameters:
+        name : string
+          The trace object name. This name should uniquely identify
+          the pymc variable.
+        getfunc : function
+          A function returning the value to tally.
+        db : Database instance
+          The database owning this Trace.
+        """
+        self._files = {}
+        self._paths = {}
+        self._shape = {}
+        self._index = {}
+        base.Trace.__init__(self, name=name, getfunc=getfunc, db=db)
+
+    def _initialize(self, chain, length):
+        """Create the file and write its header."""
+        if self._getfunc is None:
+            self._getfunc = self.db.model._funs_to_tally[self.name]
+
+        self._shape[chain] = np.shape(self._getfunc())
+        self._index[chain] = 0
+        self._paths[chain] = os.path.join(self.db._directory, CHAIN_NAME%chain, self.name+'.txt')
+        self._files[chain] = open(self._paths[chain], 'w')
+        self._write_header(chain)
+
+    def _write_header(self, chain):
+        shape = (self._index[chain],) + self._shape[chain]
+        width = len(str((sys.maxint,) + self._shape[chain]))
+        if self._files.has_key(chain):
+            _write_header(self._files[chain], self.name, shape, width)
+        else:
+            f = open(self._paths[chain], 'r+')
+            try:
+                _write_header(f, self.name, shape, width, date=False)
+            finally:
+                f.close()
+
+    def tally(self, chain):
+        """Write the object's current value to the chain's file.
+
+        :Parameters:
+        chain : integer
+          Chain index.
+        """
+        self.tally_block(chain, np.array([self._getfunc()]))
+
+    def tally_block(self, chain, values):
+        """Write a block of values to the chain's file.
+
+        :Parameters:
+        chain : integer
+          Chain index.
+        values : array
+          The values to write, one per row.
+        """
+        values = np.asarray(values)
+        if len(values) == 0:
+            return
+        _write_rows(self._files[chain], values.reshape((len(values), -1)))
+        self._files[chain].flush()
+        self._index[chain] += len(values)
+
+    def commit(self, chain):
+        """Flush the rows written to the chain's file."""
+        if self._files.has_key(chain):
+            self._files[chain].flush()
+
+    def truncate(self, index, chain):
+        """
+        Truncate the trace to some index.
+
+        :Parameters:
+        index : int
+          The index within the chain after which all values will be removed.
+        chain : int
+          The chain index (>=0).
+        """
+        if index >= self._index[chain]:
+            return
+        arr = self.gettrace(chain=chain)[:index]
+        finalized = not self._files.has_key(chain)
+        if not finalized:
+            self._files[chain].close()
+        self._index[chain] = 0
+        self._files[chain] = open(self._paths[chain], 'w')
+        self._write_header(chain)
+        self.tally_block(chain, arr)
+        if finalized:
+            self._finalize(chain)
+
+    def _finalize(self, chain):
+        """Close the file and record the number of samples in its header."""
+        f = self._files.pop(chain, None)
+        if f is not None:
+            f.close()
+        self._write_header(chain)
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        """Return the trace.
+
+        :Stochastics:
+          - burn (int): The number of transient steps to skip.
+          - thin (int): Keep one in thin.
+          - chain (int): The index of the chain to fetch. If None, return all chains.
+          - slicing: A slice, overriding burn and thin assignement.
+        """
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            chains = [chain]
+        else:
+            chains = sorted(self._paths.keys())
+        for c in chains:
+            self.commit(c)
+        return np.concatenate([_read(self._paths[c]) for c in chains])[slicing]
+
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        """Return the length of the trace.
+
+        :Parameters:
+        chain : int or None
+          The chain index. If None, returns the combined length of all chains.
+        """
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return self._index[chain]
+        else:
+            return sum(self._index.values())
 
 class Database(base.Database):
     """Txt Database class."""
 
-    def __init__(self, dbname=None, dbmode='a'):
+    def __init__(self, dbname=None, dbmode='a', dbstream=None):
         """Create a Txt Database.
 
         :Parameters:
@@ -74,11 +290,17 @@ class Database(base.Database):
           Name of the directory where the traces are stored.
         dbmode : {a, r, w}
           Opening mode: a:append, w:write, r:read.
+        dbstream : int
+          If given, the values are written to the files during sampling, in
+          blocks of `dbstream` rows, instead of once sampling is completed.
         """
         self.__name__ = 'txt'
         self._directory = dbname
         self.__Trace__ = Trace
         self.mode = dbmode
+        if dbstream:
+            self.__Trace__ = StreamTrace
+            self.buffer = dbstream
 
         self.trace_names = []   # A list of sequences of names of the objects to tally.
         self._traces = {} # A dictionary of the Trace objects.
@@ -113,6 +335,13 @@ class Database(base.Database):
 
         base.Database._initialize(self, funs_to_tally, length)
 
+    def commit(self):
+        """Flush the rows written to the files of the last chain."""
+        if self.__Trace__ is StreamTrace and self.chains > 0:
+            self._flush_buffer()
+            for name in self.trace_names[-1]:
+                self._traces[name].commit(self.chains-1)
+
     def savestate(self, state):
         """Save the sampler's state in a state.txt file."""
         oldstate = np.get_printoptions()
@@ -144,10 +373,7 @@ def load(dirname):
             name = funname(file)
             if not data.has_key(name):
                 data[name] = {} # This could be simplified using "collections.defaultdict(dict)". New in Python 2.5
-            # Read the shape information
-            f = open(os.path.join(folder, file))
-            f.readline(); shape = eval(f.readline()[16:])
-            data[name][chain] = np.loadtxt(os.path.join(folder, file), delimiter=',').reshape(shape)
+            data[name][chain] = _read(os.path.join(folder, file))
 
 
     # Create the Traces.
@@ -1,13 +1,18 @@
 # Convergence diagnostics and model validation
 # Heidelberger and Welch (1983) ?
 
-__all__ = ['geweke', 'gelman_rubin', 'raftery_lewis', 'validate', 'discrepancy']
+__all__ = ['geweke', 'gelman_rubin', 'rhat', 'effective_n', 'mcse', 'convergence_summary', 'raftery_lewis', 'validate', 'discrepancy']
 
 import numpy as np
 import pymc
 from copy import copy
 import pdb
 
+try:
+    from scipy.special import ndtri
+except ImportError:
+    ndtri = None
+
 def open01(x, limit=1.e-6):
     """Constrain numbers to (0,1) interval"""
     try:
@@ -53,7 +58,7 @@ def diagnostic(f):
     return wrapper
 
 
-def validate(sampler, replicates=20, iterations=10000, burn=5000, thin=1, deterministic=False, db='ram', plot=True, verbose=0):
+def validate(sampler, replicates=20, iterations=10000, burn=5000, thin=1, deterministic=False, db='no_trace', plot=True, verbose=0, n_jobs=1):
     """
     Model validation method, following Cook et al. (Journal of Computational and
     Graphical Statistics, 2006, DOI: 10.1198/106186006X136976).
@@ -66,38 +71,46 @@ def validate(sampler, replicates=20, iterations=10000, burn=5000, thin=1, determ
     Since this relies on the generation of simulated data, all data stochastics
     must have a valid random() method for validation to proceed.
 
+    The quantiles are counted while sampling, so the traces need not be
+    stored.
+
     Parameters
     ----------
     sampler : Sampler
       An MCMC sampler object.
     replicates (optional) : int
       The number of validation replicates (i.e. number of quantiles to be simulated).
-      Defaults to 100.
+      Defaults to 20.
     iterations (optional) : int
-      The number of MCMC iterations to be run per replicate. Defaults to 2000.
+      The number of MCMC iterations to be run per replicate. Defaults to 10000.
     burn (optional) : int
-      The number of burn-in iterations to be run per replicate. Defaults to 1000.
+      The number of burn-in iterations to be run per replicate. Defaults to 5000.
     thin (optional) : int
       The thinning factor to be applied to posterior sample. Defaults to 1 (no thinning)
     deterministic (optional) : bool
       Flag for inclusion of deterministic nodes in validation procedure. Defaults
       to False.
     db (optional) : string
-      The database backend to use for the validation runs. Defaults to 'ram'.
+      The database backend to use for the validation runs. Defaults to
+      'no_trace'. Worker processes always use 'no_trace'.
     plot (optional) : bool
       Flag for validation plots. Defaults to True.
+    n_jobs (optional) : int
+      Number of worker processes running the replicates, default 1. Each
+      worker is forked from the current process and seeded independently.
 
     Returns
     -------
     stats : dict
       Return a dictionary containing tuples with the chi-square statistic and
       associated p-value for each data stochastic.
-      
+
     Notes
     -----
-    This function requires SciPy. 
+    This function requires SciPy.
     """
     import scipy as sp
+    import scipy.special
     # Set verbosity for models to zero
     sampler.verbose = 0
 
@@ -106,10 +119,7 @@ def validate(sampler, replicates=20, iterations=10000, burn=5000, thin=1, determ
     if deterministic:
         # Add deterministics to the mix, if requested
         parameters = parameters.union(sampler.deterministics)
-
-    # Assign database backend
-    original_backend = sampler.db.__name__
-    sampler._assign_database_backend(db)
+    parameters = [p for p in parameters if p in sampler._variables_to_tally]
 
     # Empty lists for quantiles
     quantiles = {}
@@ -117,57 +127,55 @@ def validate(sampler, replicates=20, iterations=10000, burn=5000, thin=1, determ
     if verbose:
         print "\nExecuting Cook et al. (2006) validation procedure ...\n"
 
-    # Loop over replicates
-    for i in range(replicates):
+    kwds = dict(iterations=iterations, burn=burn, thin=thin, verbose=verbose)
 
-        # Sample from priors
-        for p in sampler.stochastics:
-            if not p.extended_parents:
-                p.random()
-
-        # Sample "true" data values
-        for o in sampler.observed_stochastics:
-            # Generate simuated data for data stochastic
-            o.set_value(o.random(), force=True)
-            if verbose:
-                print "Data for %s is %s" % (o.__name__, o.value)
-
-        param_values = {}
-        # Record data-generating parameter values
-        for s in parameters:
-            param_values[s] = s.value
+    if n_jobs > 1:
 
         try:
-            # Fit models given parameter values
-            sampler.sample(iterations, burn=burn, thin=thin)
-
-            for s in param_values:
+            import multiprocessing
+        except ImportError:
+            raise ImportError, 'Validation with n_jobs > 1 requires the multiprocessing module (Python 2.6 or later).'
+
+        global _validation_sampler
+        _validation_sampler = sampler
+        names = [p.__name__ for p in parameters]
+        seeds = np.random.randint(0, 2**30, size=replicates)
+        pool = multiprocessing.Pool(min(n_jobs, replicates))
+        try:
+            for i, q in enumerate(pool.imap_unordered(_validation_worker, [(seed, names, kwds) for seed in seeds])):
+                for name in q:
+                    quantiles.setdefault(name, []).append(q[name])
 
-                if not i:
-                    # Initialize dict
-                    quantiles[s.__name__] = []
-                trace = s.trace()
-                q = sum(trace<param_values[s], 0)/float(len(trace))
-                quantiles[s.__name__].append(open01(q))
+                if not i % 10 and i and verbose:
+                    print "\tCompleted validation replicate", i
+        finally:
+            pool.close()
+            pool.join()
+            _validation_sampler = None
 
-            # Replace data values
-            for o in sampler.observed_stochastics:
-                o.revert()
+    else:
 
-        finally:
-            # Replace data values
-            for o in sampler.observed_stochastics:
-                o.revert()
+        # Assign database backend
+        original_db = sampler.db
+        _validation_backend(sampler, db)
 
-            # Replace backend
-            sampler._assign_database_backend(original_backend)
+        try:
+            # Loop over replicates
+            for i in range(replicates):
 
-        if not i % 10 and i and verbose:
-            print "\tCompleted validation replicate", i
+                q = _validation_replicate(sampler, parameters, **kwds)
+                for name in q:
+                    quantiles.setdefault(name, []).append(q[name])
 
+                if not i % 10 and i and verbose:
+                    print "\tCompleted validation replicate", i
 
-    # Replace backend
-    sampler._assign_database_backend(original_backend)
+        finally:
+            # Replace backend
+            sampler.db = original_db
+            for v in sampler._variables_to_tally:
+                if original_db._traces.has_key(v.__name__):
+                    v.trace = original_db._traces[v.__name__]
 
     stats = {}
     # Calculate chi-square statistics
@@ -189,6 +197,67 @@ def validate(sampler, replicates=20, iterations=10000, burn=5000, thin=1, determ
 
     return stats
 
+def _validation_backend(sampler, db):
+    """Give the sampler a new database of the given backend, keeping online
+    summaries of the tallied variables."""
+    module = getattr(pymc.database, db)
+    sampler.db = module.Database(sampler.__name__ + '.validate.' + db)
+    sampler.db.online = True
+    sampler.db.connect_model(sampler)
+
+def _validation_replicate(sampler, parameters, iterations, burn, thin, verbose=0):
+    """
+    Run one validation replicate: simulate the parameters and the data from
+    the priors, sample the posterior, and return a dictionary of the
+    fractions of the samples of each parameter smaller than its simulated
+    value.
+    """
+    # Sample from priors
+    for p in sampler.stochastics:
+        if not p.extended_parents:
+            p.random()
+
+    # Sample "true" data values
+    for o in sampler.observed_stochastics:
+        # Generate simuated data for data stochastic
+        o.set_value(o.random(), force=True)
+        if verbose:
+            print "Data for %s is %s" % (o.__name__, o.value)
+
+    # Record data-generating parameter values, which the summaries of the
+    # traces compare the samples to.
+    sampler.db.references = dict([(s.__name__, copy(s.value)) for s in parameters])
+
+    try:
+        # Fit models given parameter values
+        sampler.sample(iterations, burn=burn, thin=thin)
+
+        quantiles = {}
+        for s in parameters:
+            quantiles[s.__name__] = open01(sampler.db._traces[s.__name__].summary.below())
+        return quantiles
+
+    finally:
+        # Replace data values
+        for o in sampler.observed_stochastics:
+            o.revert()
+
+# The sampler forked by validate. Worker processes inherit it from the
+# parent, so that models need not be picklable.
+_validation_sampler = None
+
+def _validation_worker(args):
+    """
+    Run one validation replicate of the forked sampler in a worker process.
+    """
+    seed, names, kwds = args
+    sampler = _validation_sampler
+    np.random.seed(seed)
+
+    _validation_backend(sampler, 'no_trace')
+    parameters = [p for p in sampler._variables_to_tally if p.__name__ in names]
+    return _validation_replicate(sampler, parameters, **kwds)
+
 
 @diagnostic
 def geweke(x, first=.1, last=.5, intervals=20):
@@ -417,8 +486,257 @@ def discrepancy(observed, simulated, expected):
     return D_obs, D_sim
 
 
-def gelman_rubin(x):
-    raise NotImplementedError
-# x contains multiple chains
-# Transform positive or [0,1] variables using a logarithmic/logittranformation.
+# Multiple chain diagnostics
 #
+# The functions below take draws as arrays of shape (chains, draws, ...) and
+# return one value per element of the sampled variable. They follow
+# Vehtari, Gelman, Simpson, Carpenter and Burkner (2021), Rank-normalization,
+# folding, and localization: An improved R-hat for assessing convergence of
+# MCMC, Bayesian Analysis, 16(2), 667-718.
+
+def _as_chains(x):
+    """Return x as an array of shape (chains, draws, elements), and the shape
+    of the elements."""
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        x = x[np.newaxis]
+    shape = x.shape[2:]
+    return x.reshape(x.shape[:2] + (-1,)), shape
+
+def _split(x):
+    """Split each chain of x in two halves, dropping the middle draw of odd
+    length chains."""
+    m, n = x.shape[:2]
+    half = n // 2
+    return np.concatenate((x[:, :half], x[:, n-half:]))
+
+def _rank(x):
+    """Return the ranks of the draws of each element, pooling all chains. Tied
+    values get the average of their ranks."""
+    m, n, k = x.shape
+    N = m * n
+    flat = x.reshape(N, k)
+    order = flat.argsort(0, kind='mergesort')
+    cols = np.arange(k)
+    s = flat[order, cols]
+
+    # Position of the first and last draw of each group of tied values.
+    index = np.arange(N)[:, np.newaxis] * np.ones(k, dtype=int)
+    start = np.ones((N, k), dtype=bool)
+    start[1:] = s[1:] != s[:-1]
+    first = np.maximum.accumulate(np.where(start, index, 0), 0)
+    end = np.ones((N, k), dtype=bool)
+    end[:-1] = start[1:]
+    last = N - 1 - np.maximum.accumulate(np.where(end[::-1], index, 0), 0)[::-1]
+
+    ranks = np.empty((N, k))
+    ranks[order, cols] = (first + last) / 2.
+    return ranks.reshape(m, n, k)
+
+def _normal_scores(x):
+    """Rank-normalize the draws."""
+    N = x.shape[0] * x.shape[1]
+    p = (_rank(x) + 1 - 3./8) / (N + 1./4)
+    if ndtri is not None:
+        return ndtri(p)
+    return pymc.utils.invcdf(p.ravel()).reshape(p.shape)
+
+def _autocovariance(x):
+    """Return the autocovariance of each chain and element of x, shaped
+    (chains, draws, elements), at all lags, computed by FFT."""
+    return pymc.utils.autocov_all(x.swapaxes(0, 1)).swapaxes(0, 1)
+
+def _ess(x):
+    """Effective sample size of the draws x, shaped (chains, draws, elements),
+    using Geyer's initial monotone sequence estimator."""
+    m, n = x.shape[:2]
+    acov = _autocovariance(x)
+    chain_mean = x.mean(1)
+    chain_var = acov[:, 0] * n / (n - 1.)
+    mean_var = chain_var.mean(0)
+    var_plus = mean_var * (n - 1.) / n
+    if m > 1:
+        var_plus = var_plus + chain_mean.var(0, ddof=1)
+
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        rho = 1 - (mean_var - acov.mean(0)) / var_plus
+        rho[0] = 1
+
+        # Sums of autocorrelations at successive pairs of lags, kept up to the
+        # first negative pair and made monotone.
+        T = (n // 2) * 2
+        pairs = rho[0:T:2] + rho[1:T:2]
+        positive = np.logical_and.accumulate(pairs > 0, 0)
+        pairs = np.minimum.accumulate(np.where(positive, pairs, 0), 0)
+        tau = -1 + 2 * (pairs * positive).sum(0)
+        tau = np.maximum(tau, 1. / np.log10(m * n))
+        ess = m * n / tau
+        ess[var_plus == 0] = np.nan
+    finally:
+        np.seterr(**olderr)
+    return ess
+
+def _rhat(x):
+    """Potential scale reduction factor of the draws x, shaped (chains, draws,
+    elements)."""
+    m, n = x.shape[:2]
+    B = n * x.mean(1).var(0, ddof=1)
+    W = x.var(1, ddof=1).mean(0)
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        return np.sqrt(((n - 1.) / n * W + B / n) / W)
+    finally:
+        np.seterr(**olderr)
+
+def gelman_rubin(x, split=True):
+    """Return the potential scale reduction factor (R-hat) of Gelman and
+    Rubin (1992).
+
+    :Parameters:
+      x : array
+        Draws of shape (chains, draws, ...).
+      split : bool
+        If True, each chain is split in two halves, so that trends within
+        the chains are also detected.
+
+    :Returns:
+      R : array
+        R-hat for each element of the variable. Values close to 1 indicate
+        convergence.
+
+    :Note:
+      rhat gives a more robust version based on rank-normalized draws.
+    """
+    x, shape = _as_chains(x)
+    if split:
+        x = _split(x)
+    return _rhat(x).reshape(shape)
+
+def rhat(x):
+    """Return the rank-normalized split R-hat of Vehtari et al. (2021), the
+    maximum of the R-hat of the rank-normalized draws and of the
+    rank-normalized distances to the median.
+
+    :Parameters:
+      x : array
+        Draws of shape (chains, draws, ...).
+    """
+    x, shape = _as_chains(x)
+    x = _split(x)
+    folded = np.abs(x - np.median(x.reshape(-1, x.shape[2]), 0))
+    R = np.maximum(_rhat(_normal_scores(x)), _rhat(_normal_scores(folded)))
+    return R.reshape(shape)
+
+def effective_n(x, method='bulk'):
+    """Return the effective sample size of the draws.
+
+    :Parameters:
+      x : array
+        Draws of shape (chains, draws, ...).
+      method : {'bulk', 'tail', 'mean'}
+        'bulk' : ESS of the rank-normalized split chains, measuring the
+          efficiency of location estimates;
+        'tail' : minimum of the ESS of the 5% and 95% quantile indicators,
+          measuring the efficiency of tail quantile estimates;
+        'mean' : ESS of the split chains, for the estimation of the mean.
+    """
+    x, shape = _as_chains(x)
+    x = _split(x)
+    if method == 'bulk':
+        ess = _ess(_normal_scores(x))
+    elif method == 'tail':
+        flat = x.reshape(-1, x.shape[2])
+        low, high = np.percentile(flat, 5, 0), np.percentile(flat, 95, 0)
+        ess = np.minimum(_ess((x <= low).astype(float)), _ess((x <= high).astype(float)))
+    elif method == 'mean':
+        ess = _ess(x)
+    else:
+        raise ValueError, 'Unknown method %s' % method
+    return ess.reshape(shape)
+
+def mcse(x):
+    """Return the Monte Carlo standard errors of the posterior mean and
+    standard deviation estimated from the draws.
+
+    :Parameters:
+      x : array
+        Draws of shape (chains, draws, ...).
+
+    :Returns:
+      mcse_mean, mcse_sd : arrays
+    """
+    x, shape = _as_chains(x)
+    split = _split(x)
+    sd = x.reshape(-1, x.shape[2]).std(0, ddof=1)
+    ess_mean = _ess(split)
+    ess_sd = np.minimum(ess_mean, _ess(split**2))
+    mcse_mean = sd / np.sqrt(ess_mean)
+    mcse_sd = sd * np.sqrt(np.e * (1 - 1. / ess_sd)**(ess_sd - 1) - 1)
+    return mcse_mean.reshape(shape), mcse_sd.reshape(shape)
+
+def convergence_summary(db, burn=0, thin=1, variables=None):
+    """Compute convergence diagnostics for the traced variables, using all
+    the chains of a database.
+
+    :Parameters:
+      db : Database or Sampler
+        The database holding the chains, or a sampler using it.
+      burn : int
+        Number of draws discarded at the beginning of each chain.
+      thin : int
+        Keep one draw in thin.
+      variables : sequence
+        Names of the variables. Defaults to all variables traced in every
+        chain. Variables whose values are not numerical are skipped.
+
+    :Returns:
+      stats : dict
+        For each variable, a dictionary of arrays with the shape of the
+        variable's value, with keys 'mean', 'sd', 'rhat', 'ess_bulk',
+        'ess_tail', 'mcse_mean' and 'mcse_sd'.
+
+    :Note:
+      Chains of different lengths are cut to the length of the shortest. The
+      variables are loaded one at a time, and every statistic is computed for
+      all the elements of a variable at once.
+    """
+    db = getattr(db, 'db', db)
+    chains = range(db.chains)
+    if variables is None:
+        variables = set(db.trace_names[0])
+        for names in db.trace_names[1:]:
+            variables &= set(names)
+        variables = sorted(variables)
+
+    stats = {}
+    for name in variables:
+        trace = db._traces[name]
+        draws = [np.asarray(trace.gettrace(burn=burn, thin=thin, chain=c)) for c in chains]
+        if draws[0].dtype == np.dtype(object):
+            continue
+        n = min([len(d) for d in draws])
+        x, shape = _as_chains(np.array([d[:n] for d in draws]))
+
+        split = _split(x)
+        flat = x.reshape(-1, x.shape[2])
+        folded = np.abs(split - np.median(flat, 0))
+        z = _normal_scores(split)
+        low, high = np.percentile(flat, 5, 0), np.percentile(flat, 95, 0)
+        ess_mean = _ess(split)
+        ess_sd = np.minimum(ess_mean, _ess(split**2))
+        sd = flat.std(0, ddof=1)
+
+        s = {}
+        s['mean'] = flat.mean(0)
+        s['sd'] = sd
+        s['rhat'] = np.maximum(_rhat(z), _rhat(_normal_scores(folded)))
+        s['ess_bulk'] = _ess(z)
+        s['ess_tail'] = np.minimum(_ess((split <= low).astype(float)), _ess((split <= high).astype(float)))
+        s['mcse_mean'] = sd / np.sqrt(ess_mean)
+        s['mcse_sd'] = sd * np.sqrt(np.e * (1 - 1. / ess_sd)**(ess_sd - 1) - 1)
+        for k, v in s.iteritems():
+            s[k] = v.reshape(shape)
+        stats[name] = s
+
+    return stats
@@ -2476,6 +2476,289 @@ def wishart_cov_like(X, n, C):
     return flib.blas_wishart_cov(X,n,C)
 
 
+# -----------------------------------------------------------
+# Elementwise likelihoods
+# -----------------------------------------------------------
+# These return the log-likelihood of every element of x separately, after
+# broadcasting x against the parameters, instead of their sum. Elements
+# outside the support get -inf. They are attached to the corresponding
+# likelihoods as an `elementwise` attribute, which is carried over to the
+# logp functions of the Stochastic classes created by stochastic_from_dist.
+# Model.logp_batch uses them to evaluate many points in a single call.
+
+_lanczos_coef = [76.18009172947146, -86.50532032941677, 24.01409824083091,
+                 -1.231739572450155, .1208650973866179e-2, -.5395239384953e-5]
+
+def gammaln_elementwise(x):
+    """
+    Logarithm of the Gamma function, evaluated elementwise for x > 0.
+
+    Uses the same Lanczos approximation as flib.gamfun.
+    """
+    x = np.asarray(x, dtype=float)
+    tmp = x + 5.5
+    tmp = (x + 0.5) * np.log(tmp) - tmp
+    ser = 1.000000000190015
+    y = x
+    for c in _lanczos_coef:
+        y = y + 1.
+        ser = ser + c / y
+    return tmp + np.log(2.5066282746310005 * ser / x)
+
+def factln_elementwise(n):
+    """
+    Logarithm of n!, evaluated elementwise for n >= 0.
+    """
+    return gammaln_elementwise(np.asarray(n, dtype=float) + 1.)
+
+def _support(ok, logp):
+    # Replace log-likelihoods outside the support by -inf.
+    return np.where(ok, logp, -np.inf)
+
+def normal_like_elementwise(x, mu, tau):
+    x, mu, tau = np.asarray(x, float), np.asarray(mu, float), np.asarray(tau, float)
+    return _support(tau > 0, .5*np.log(tau/(2.*pi)) - .5*tau*(x-mu)**2)
+
+def lognormal_like_elementwise(x, mu, tau):
+    x, mu, tau = np.asarray(x, float), np.asarray(mu, float), np.asarray(tau, float)
+    return _support((x > 0) & (tau > 0), .5*np.log(tau/(2.*pi)) - np.log(x) - .5*tau*(np.log(x)-mu)**2)
+
+def half_normal_like_elementwise(x, tau):
+    x, tau = np.asarray(x, float), np.asarray(tau, float)
+    return _support((x >= 0) & (tau > 0), .5*np.log(2.*tau/pi) - .5*tau*x**2)
+
+def gamma_like_elementwise(x, alpha, beta):
+    x, alpha, beta = np.asarray(x, float), np.asarray(alpha, float), np.asarray(beta, float)
+    return _support((x > 0) & (alpha > 0) & (beta > 0),
+        alpha*np.log(beta) - gammaln_elementwise(alpha) + (alpha-1.)*np.log(x) - beta*x)
+
+def exponential_like_elementwise(x, beta):
+    return gamma_like_elementwise(x, 1., beta)
+
+def inverse_gamma_like_elementwise(x, alpha, beta):
+    x, alpha, beta = np.asarray(x, float), np.asarray(alpha, float), np.asarray(beta, float)
+    return _support((x > 0) & (alpha > 0) & (beta > 0),
+        alpha*np.log(beta) - gammaln_elementwise(alpha) - (alpha+1.)*np.log(x) - beta/x)
+
+def beta_like_elementwise(x, alpha, beta):
+    x, alpha, beta = np.asarray(x, float), np.asarray(alpha, float), np.asarray(beta, float)
+    return _support((x > 0) & (x < 1) & (alpha > 0) & (beta > 0),
+        gammaln_elementwise(alpha+beta) - gammaln_elementwise(alpha) - gammaln_elementwise(beta) \
+        + (alpha-1.)*np.log(x) + (beta-1.)*np.log(1.-x))
+
+def uniform_like_elementwise(x, lower, upper):
+    x, lower, upper = np.asarray(x, float), np.asarray(lower, float), np.asarray(upper, float)
+    return _support((x >= lower) & (x <= upper), -np.log(upper-lower))
+
+def discrete_uniform_like_elementwise(x, lower, upper):
+    x, lower, upper = np.asarray(x, float), np.asarray(lower, float), np.asarray(upper, float)
+    return _support((x >= lower) & (x <= upper), -np.log(upper-lower+1.))
+
+def cauchy_like_elementwise(x, alpha, beta):
+    x, alpha, beta = np.asarray(x, float), np.asarray(alpha, float), np.asarray(beta, float)
+    return _support(beta > 0, -np.log(pi*beta) - np.log(1. + ((x-alpha)/beta)**2))
+
+def laplace_like_elementwise(x, mu, tau):
+    x, mu, tau = np.asarray(x, float), np.asarray(mu, float), np.asarray(tau, float)
+    return _support(tau > 0, np.log(tau/2.) - tau*np.abs(x-mu))
+
+def poisson_like_elementwise(x, mu):
+    x, mu = np.asarray(x, float), np.asarray(mu, float)
+    # 0*log(0) is taken to be 0, as in flib.poisson.
+    xlogmu = np.where(x == 0, 0., x*np.log(np.where(mu > 0, mu, 1.)))
+    return _support((x >= 0) & (mu >= 0) & ((mu > 0) | (x == 0)), xlogmu - mu - factln_elementwise(x))
+
+def binomial_like_elementwise(x, n, p):
+    x, n, p = np.asarray(x, float), np.asarray(n, float), np.asarray(p, float)
+    q = 1. - p
+    xlogp = np.where(x == 0, 0., x*np.log(np.where(p > 0, p, 1.)))
+    ylogq = np.where(x == n, 0., (n-x)*np.log(np.where(q > 0, q, 1.)))
+    ok = (x >= 0) & (n >= 0) & (x <= n) & (p >= 0) & (p <= 1) & ((p > 0) | (x == 0)) & ((p < 1) | (x == n))
+    return _support(ok, xlogp + ylogq + factln_elementwise(n) - factln_elementwise(x) - factln_elementwise(n-x))
+
+def bernoulli_like_elementwise(x, p):
+    x, p = np.asarray(x, bool), np.asarray(p, float)
+    return _support((p >= 0) & (p <= 1), np.log(np.where(x, p, 1.-p)))
+
+for name in ['normal', 'lognormal', 'half_normal', 'gamma', 'exponential', 'inverse_gamma',
+             'beta', 'uniform', 'discrete_uniform', 'cauchy', 'laplace', 'poisson', 'binomial', 'bernoulli']:
+    locals()[name+'_like'].elementwise = locals()[name+'_like_elementwise']
+del name
+
+
+# -----------------------------------------------------------
+# Gradients
+# -----------------------------------------------------------
+# dist_grad_like(x, ...) returns the gradient of dist_like(x, ...) with
+# respect to x, as an array of the same shape as x. These are optional: they
+# are attached to the likelihoods as a `grad` attribute, which is carried
+# over to the logp functions of the Stochastic classes, and are used by
+# gradient-based step methods such as HamiltonianMC. Values outside the
+# support are not checked.
+
+def normal_grad_like(x, mu, tau):
+    return -np.asarray(tau, float) * (np.asarray(x, float) - mu)
+
+def lognormal_grad_like(x, mu, tau):
+    x = np.asarray(x, float)
+    return -(1. + tau*(np.log(x) - mu)) / x
+
+def half_normal_grad_like(x, tau):
+    return -np.asarray(tau, float) * np.asarray(x, float)
+
+def gamma_grad_like(x, alpha, beta):
+    x = np.asarray(x, float)
+    return (alpha - 1.)/x - beta
+
+def exponential_grad_like(x, beta):
+    return gamma_grad_like(x, 1., beta)
+
+def inverse_gamma_grad_like(x, alpha, beta):
+    x = np.asarray(x, float)
+    return -(alpha + 1.)/x + beta/x**2
+
+def beta_grad_like(x, alpha, beta):
+    x = np.asarray(x, float)
+    return (alpha - 1.)/x - (beta - 1.)/(1. - x)
+
+def uniform_grad_like(x, lower, upper):
+    return np.zeros(np.broadcast(np.asarray(x), lower, upper).shape)
+
+def cauchy_grad_like(x, alpha, beta):
+    z = np.asarray(x, float) - alpha
+    return -2.*z / (beta**2 + z**2)
+
+def laplace_grad_like(x, mu, tau):
+    return -np.asarray(tau, float) * np.sign(np.asarray(x, float) - mu)
+
+def t_grad_like(x, nu):
+    x = np.asarray(x, float)
+    return -(nu + 1.) * x / (nu + x**2)
+
+def mv_normal_grad_like(x, mu, tau):
+    return -np.dot(np.asarray(x, float) - mu, np.asarray(tau).T)
+
+for name in ['normal', 'lognormal', 'half_normal', 'gamma', 'exponential', 'inverse_gamma',
+             'beta', 'uniform', 'cauchy', 'laplace', 't', 'mv_normal']:
+    locals()[name+'_like'].grad = locals()[name+'_grad_like']
+del name
+
+# dist_<parent>_grad_like(x, ...) returns the gradient of dist_like(x, ...)
+# with respect to one of its parents, with the same shape as that parent.
+# They are attached to the likelihoods as a `parent_grads` dictionary keyed
+# by parent name. Parents that are missing from it, such as the number of
+# trials of the binomial, are not differentiable.
+
+def digamma_elementwise(x):
+    """
+    digamma_elementwise(x)
+
+    The logarithmic derivative of the gamma function, for positive x.
+    Uses the recurrence psi(x) = psi(x+1) - 1/x up to x >= 6, then
+    the asymptotic expansion.
+    """
+    x = np.array(x, dtype=float)
+    psi = np.zeros(np.shape(x))
+    small = x < 6.
+    while np.any(small):
+        psi -= np.where(small, 1./np.where(small, x, 1.), 0.)
+        x += small
+        small = x < 6.
+    x2 = 1./x**2
+    return psi + np.log(x) - .5/x - x2*(1./12 - x2*(1./120 - x2/252.))
+
+def normal_mu_grad_like(x, mu, tau):
+    return utils.sum_to_shape(tau*(np.asarray(x, float) - mu), mu)
+
+def normal_tau_grad_like(x, mu, tau):
+    return utils.sum_to_shape(.5/tau - .5*(np.asarray(x, float) - mu)**2, tau)
+
+def lognormal_mu_grad_like(x, mu, tau):
+    return utils.sum_to_shape(tau*(np.log(x) - mu), mu)
+
+def lognormal_tau_grad_like(x, mu, tau):
+    return utils.sum_to_shape(.5/tau - .5*(np.log(x) - mu)**2, tau)
+
+def half_normal_tau_grad_like(x, tau):
+    return utils.sum_to_shape(.5/tau - .5*np.asarray(x, float)**2, tau)
+
+def gamma_alpha_grad_like(x, alpha, beta):
+    return utils.sum_to_shape(np.log(beta) - digamma_elementwise(alpha) + np.log(x), alpha)
+
+def gamma_beta_grad_like(x, alpha, beta):
+    return utils.sum_to_shape(np.divide(alpha, beta) - x, beta)
+
+def exponential_beta_grad_like(x, beta):
+    return utils.sum_to_shape(1./np.asarray(beta, float) - x, beta)
+
+def inverse_gamma_alpha_grad_like(x, alpha, beta):
+    return utils.sum_to_shape(np.log(beta) - digamma_elementwise(alpha) - np.log(x), alpha)
+
+def inverse_gamma_beta_grad_like(x, alpha, beta):
+    return utils.sum_to_shape(np.divide(alpha, beta) - 1./np.asarray(x, float), beta)
+
+def beta_alpha_grad_like(x, alpha, beta):
+    return utils.sum_to_shape(digamma_elementwise(np.add(alpha, beta)) - digamma_elementwise(alpha) + np.log(x), alpha)
+
+def beta_beta_grad_like(x, alpha, beta):
+    return utils.sum_to_shape(digamma_elementwise(np.add(alpha, beta)) - digamma_elementwise(beta) + np.log(1.-np.asarray(x, float)), beta)
+
+def uniform_lower_grad_like(x, lower, upper):
+    return utils.sum_to_shape(np.zeros(np.shape(x)) + 1./np.subtract(upper, lower), lower)
+
+def uniform_upper_grad_like(x, lower, upper):
+    return utils.sum_to_shape(np.zeros(np.shape(x)) - 1./np.subtract(upper, lower), upper)
+
+def cauchy_alpha_grad_like(x, alpha, beta):
+    z = np.asarray(x, float) - alpha
+    return utils.sum_to_shape(2.*z / (beta**2 + z**2), alpha)
+
+def cauchy_beta_grad_like(x, alpha, beta):
+    z = np.asarray(x, float) - alpha
+    return utils.sum_to_shape(-1./beta + 2.*z**2 / (beta*(beta**2 + z**2)), beta)
+
+def laplace_mu_grad_like(x, mu, tau):
+    return utils.sum_to_shape(tau*np.sign(np.asarray(x, float) - mu), mu)
+
+def laplace_tau_grad_like(x, mu, tau):
+    return utils.sum_to_shape(1./np.asarray(tau, float) - np.abs(np.asarray(x, float) - mu), tau)
+
+def t_nu_grad_like(x, nu):
+    x2 = np.asarray(x, float)**2
+    nu = np.asarray(nu, float)
+    g = .5*(digamma_elementwise((nu+1.)/2.) - digamma_elementwise(nu/2.) - 1./nu - np.log(1.+x2/nu)) \
+        + .5*(nu+1.)*x2/(nu*(nu+x2))
+    return utils.sum_to_shape(g, nu)
+
+def poisson_mu_grad_like(x, mu):
+    return utils.sum_to_shape(np.divide(x, mu) - 1., mu)
+
+def binomial_p_grad_like(x, n, p):
+    x = np.asarray(x, float)
+    return utils.sum_to_shape(x/p - (n-x)/(1.-np.asarray(p, float)), p)
+
+def bernoulli_p_grad_like(x, p):
+    x = np.asarray(x, float)
+    return utils.sum_to_shape(x/p - (1.-x)/(1.-np.asarray(p, float)), p)
+
+def mv_normal_mu_grad_like(x, mu, tau):
+    d = np.atleast_2d(np.asarray(x, float) - mu)
+    return np.dot(d, tau).sum(0)
+
+def mv_normal_tau_grad_like(x, mu, tau):
+    d = np.atleast_2d(np.asarray(x, float) - mu)
+    return .5*len(d)*np.linalg.inv(tau) - .5*np.dot(d.T, d)
+
+for name, parent_names in [('normal', ['mu', 'tau']), ('lognormal', ['mu', 'tau']), ('half_normal', ['tau']),
+                           ('gamma', ['alpha', 'beta']), ('exponential', ['beta']), ('inverse_gamma', ['alpha', 'beta']),
+                           ('beta', ['alpha', 'beta']), ('uniform', ['lower', 'upper']), ('cauchy', ['alpha', 'beta']),
+                           ('laplace', ['mu', 'tau']), ('t', ['nu']), ('poisson', ['mu']), ('binomial', ['p']),
+                           ('bernoulli', ['p']), ('mv_normal', ['mu', 'tau'])]:
+    locals()[name+'_like'].parent_grads = dict([(pname, locals()['%s_%s_grad_like' % (name, pname)]) for pname in parent_names])
+del name, parent_names, pname
+
+
+
 # -----------------------------------------------------------
 # DECORATORS
 # -----------------------------------------------------------
@@ -6,7 +6,7 @@ __all__ = ['Covariance']
 
 from numpy import *
 from numpy.linalg import cholesky, LinAlgError
-from GPutils import regularize_array, trisolve, square_and_sum
+from GPutils import regularize_array, trisolve, square_and_sum, factor_cache, _freeze, cholupdate, choldelete
 from linalg_utils import diag_call, dpotrf_wrap
 from incomplete_chol import ichol, ichol_continue
 
@@ -32,6 +32,14 @@ class Covariance(object):
     :SeeAlso: Mean, BasisCovariance, SeparableBasisCovariance, Realization, observe
     """
 
+    # Cholesky factors and Uo_Cxo's, shared by all covariances. Covariance
+    # objects are usually created afresh each time their parameters change,
+    # so rejected proposals come back to the same entries.
+    cache = factor_cache()
+
+    # Identifies the observations made on self, or None if they
+    # don't fit in a cache key.
+    _obs_key = None
 
     def __init__(self, eval_fun, relative_precision = 1.0E-15, rank_limit=0, **params):
 
@@ -85,6 +93,8 @@ class Covariance(object):
 
             -   `rank_limit`: If rank_limit > 0, the factor will have at most 
                 rank_limit rows.
+
+        Factors are looked up in Covariance.cache before they are computed.
         """
 
         if regularize:
@@ -102,6 +112,15 @@ class Covariance(object):
             else:
                 return U
 
+        key = self._cache_key(observed, 'cholesky', x, nugget, rank_limit)
+        chol_dict = self.cache.get(key)
+        if chol_dict is not None:
+            U, piv = chol_dict['U'], chol_dict['pivots']
+            if not apply_pivot:
+                return {'pivots': piv.copy(), 'U': U.copy()}
+            else:
+                return U[:,argsort(piv)]
+
         # Create the diagonal and the get-row function differently depending on whether self
         # has been observed. If self hasn't been observed, send the calls straight to eval_fun
         # to skip the extra formatting.
@@ -136,10 +155,13 @@ class Covariance(object):
         if m<0:
             raise ValueError, "Matrix does not appear to be positive semidefinite"
 
+        # Copy the factor, so that the cache doesn't keep all of ichol's output alive.
+        self.cache.put(key, {'pivots': piv, 'U': U[:m,:].copy('F')})
+
         if not apply_pivot:
             # Useful for self.observe and Realization.__call__. U is upper triangular.
             U = U[:m,:]
-            return {'pivots': piv, 'U': U}
+            return {'pivots': piv.copy(), 'U': U.copy()}
         else:
             # Useful for users. U.T*U = C(x,x)
             return U[:m,argsort(piv)]
@@ -304,6 +326,9 @@ class Covariance(object):
         'o' : returns information needed by function observe.
         's' : returns information needed by the Gaussian process
               submodel.
+
+        The factorizations are shared with other covariances with the same
+        parameters through Covariance.cache.
         """
 
         # print 'C.observe called'
@@ -333,17 +358,22 @@ class Covariance(object):
             # Number of observation points so far is 0.
             N_old = 0
 
+            obs_key = self._cache_key(False, 'observe', output_type=='s', obs_mesh, obs_V)
+
             if output_type != 's':
                 obs_dict = self.cholesky(obs_mesh, apply_pivot = False, nugget = obs_V, regularize=False, rank_limit = self.rank_limit)
             else:
-                C_eval = self.__call__(obs_mesh,obs_mesh,regularize=False)
-                U = C_eval.copy('F')
-                for i in xrange(U.shape[0]):
-                    U[i,i] += obs_V[i]
-                info = dpotrf_wrap(U)
-                if info>0:
-                    raise LinAlgError, "Matrix does not appear to be positive definite by row %i. Could not observe with assume_full_rank=True." %info
-                obs_dict = {'U': U,'pivots': arange(U.shape[0]),'U_new':U,'C_eval':C_eval}
+                obs_dict = self.cache.get(obs_key)
+                if obs_dict is None:
+                    C_eval = self.__call__(obs_mesh,obs_mesh,regularize=False)
+                    U = C_eval.copy('F')
+                    for i in xrange(U.shape[0]):
+                        U[i,i] += obs_V[i]
+                    info = dpotrf_wrap(U)
+                    if info>0:
+                        raise LinAlgError, "Matrix does not appear to be positive definite by row %i. Could not observe with assume_full_rank=True." %info
+                    obs_dict = {'U': U,'pivots': arange(U.shape[0]),'U_new':U,'C_eval':C_eval}
+                    self.cache.put(obs_key, obs_dict)
             obs_dict_new = obs_dict
 
             # Rank of self(obs_mesh, obs_mesh)
@@ -399,16 +429,25 @@ class Covariance(object):
             # Number of new observations.
             N_new = obs_mesh.shape[0]
 
+            # Only the GP submodel's continuations are likely to recur.
+            if output_type=='s':
+                obs_key = self._cache_key(True, 'observe', True, obs_mesh, obs_V)
+            else:
+                obs_key = None
+
             # Call to self.continue_cholesky.
-            obs_dict_new = self.continue_cholesky(x=obs_mesh,
-                                                x_old = self.full_obs_mesh,
-                                                chol_dict_old = {'U': self.full_Uo, 'pivots': self.full_piv},
-                                                apply_pivot = False,
-                                                observed = False,
-                                                regularize=False,
-                                                nugget = obs_V,
-                                                assume_full_rank = output_type=='s',
-                                                rank_limit = self.rank_limit)
+            obs_dict_new = self.cache.get(obs_key)
+            if obs_dict_new is None:
+                obs_dict_new = self.continue_cholesky(x=obs_mesh,
+                                                    x_old = self.full_obs_mesh,
+                                                    chol_dict_old = {'U': self.full_Uo, 'pivots': self.full_piv},
+                                                    apply_pivot = False,
+                                                    observed = False,
+                                                    regularize=False,
+                                                    nugget = obs_V,
+                                                    assume_full_rank = output_type=='s',
+                                                    rank_limit = self.rank_limit)
+                self.cache.put(obs_key, obs_dict_new)
 
             if output_type=='s':
                 C_eval = obs_dict_new['C_eval']
@@ -439,6 +478,7 @@ class Covariance(object):
             # Length of obs_mesh_*.
             self.obs_len = m_new
 
+        self._obs_key = obs_key
         self.observed = True
         # Output expected by Realization
         if output_type == 'r':
@@ -452,6 +492,99 @@ class Covariance(object):
         if output_type=='s':
             return obs_dict_new['U_new'], obs_dict_new['C_eval'], self.full_Uo[:m_old, argsort(piv_new)[N_old:]]
 
+    def unobserve(self, indices):
+        """
+        Removes the observations at self.obs_mesh[indices]. The Cholesky
+        factor of self on the observation mesh is downdated in O(n**2)
+        operations per point, rather than recomputed.
+
+        Any Mean observed along with self should be synchronized using
+        M.unobserve(C, indices).
+
+        :SeeAlso: reobserve, observe, Mean.unobserve
+        """
+        if not self.observed:
+            raise ValueError, 'Covariance has not been observed.'
+        if self.basiscov:
+            raise NotImplementedError, 'Basis covariances cannot be unobserved.'
+
+        indices = unique(asarray(indices, dtype=int).ravel())
+        obs_key = self._cache_key(True, 'unobserve', indices)
+
+        full_Uo = self.full_Uo
+        full_piv = self.full_piv
+        full_obs_mesh = self.full_obs_mesh
+
+        # Remove the points in decreasing order, so that the remaining positions stay valid.
+        for i in indices[::-1]:
+            j = full_piv[i]
+            full_Uo = choldelete(full_Uo, i)
+            full_piv = delete(full_piv, i)
+            full_piv[full_piv > j] -= 1
+            full_obs_mesh = delete(full_obs_mesh, j, axis=0)
+
+        m_new = full_Uo.shape[0]
+        if m_new == 0:
+            self.observed = False
+            self.obs_mesh = None
+            self.obs_V = None
+            self.Uo = None
+            self.full_Uo = None
+            self.obs_piv = None
+            self.obs_len = None
+            self.full_piv = None
+            self.full_obs_mesh = None
+            self._obs_key = None
+            return
+
+        self.full_Uo = full_Uo
+        self.Uo = full_Uo[:,:m_new]
+        self.full_piv = full_piv
+        self.obs_piv = full_piv[:m_new]
+        self.full_obs_mesh = full_obs_mesh
+        self.obs_mesh = delete(self.obs_mesh, indices, axis=0)
+        self.obs_V = delete(self.obs_V, indices)
+        self.obs_len = m_new
+        self._obs_key = obs_key
+
+    def reobserve(self, indices, obs_V):
+        """
+        Changes the observation variance at self.obs_mesh[indices] to obs_V.
+        Each change is a rank-one update or downdate of the Cholesky factor
+        of self on the observation mesh, costing O(n**2) operations.
+
+        Any Mean observed along with self is synchronized by its next call
+        to M.observe.
+
+        :SeeAlso: unobserve, observe
+        """
+        if not self.observed:
+            raise ValueError, 'Covariance has not been observed.'
+        if self.basiscov:
+            raise NotImplementedError, 'Basis covariances cannot be reobserved.'
+
+        indices = asarray(indices, dtype=int).ravel()
+        obs_V = resize(obs_V, len(indices))
+        obs_key = self._cache_key(True, 'reobserve', indices, obs_V)
+
+        # The factor may be shared through the cache, so update a copy.
+        full_Uo = asmatrix(array(self.full_Uo, order='F'))
+        self.obs_V = array(self.obs_V, dtype=float)
+        v = empty(full_Uo.shape[1], dtype=float)
+
+        for i, V in zip(indices, obs_V):
+            delta = V - self.obs_V[i]
+            if delta == 0.:
+                continue
+            v.fill(0.)
+            v[i] = sqrt(abs(delta))
+            cholupdate(full_Uo, v, downdate=delta<0.)
+            self.obs_V[i] = V
+
+        self.full_Uo = full_Uo
+        self.Uo = full_Uo[:,:full_Uo.shape[0]]
+        self._obs_key = obs_key
+
 
 
     def __call__(self, x, y=None, observed=True, regularize=True, return_Uo_Cxo=False):
@@ -504,8 +637,7 @@ class Covariance(object):
                     V[i] = self.eval_fun(this_x, this_x, **self.params)
             if self.observed and observed:
                 sqpart = empty(lenx,dtype=float)
-                Cxo = self.eval_fun(self.obs_mesh, x, **self.params)
-                Uo_Cxo = trisolve(self.Uo, Cxo, uplo='U', transa='T')
+                Uo_Cxo = self._Uo_Cxo(x)
                 square_and_sum(Uo_Cxo, sqpart)
                 V -= sqpart
 
@@ -523,8 +655,7 @@ class Covariance(object):
                 C=self.eval_fun(x,x,symm=True,**self.params)
                 # Update return value using observations.
                 if self.observed and observed:
-                    Cxo = self.eval_fun(self.obs_mesh, x, **self.params)
-                    Uo_Cxo = trisolve(self.Uo, Cxo, uplo='U', transa='T')
+                    Uo_Cxo = self._Uo_Cxo(x)
                     C -= Uo_Cxo.T * Uo_Cxo
 
                 if return_Uo_Cxo:
@@ -552,15 +683,47 @@ class Covariance(object):
                 # Update return value using observations.
                 if self.observed and observed:
 
-                    # If there are observation points, prepare self(obs_mesh, y)
+                    # If there are observation points, prepare
+                    # chol(self(obs_mesh, obs_mesh)).T.I * self(obs_mesh, x)
                     # and chol(self(obs_mesh, obs_mesh)).T.I * self(obs_mesh, y)
-                    Cyo = self.eval_fun(self.obs_mesh, y, **self.params)
-                    Uo_Cyo = trisolve(self.Uo, Cyo,uplo='U', transa='T')
+                    # These are the rows requested by ichol, so they aren't cached.
+                    Uo_Cxo = trisolve(self.Uo, self.eval_fun(self.obs_mesh, x, **self.params), uplo='U', transa='T')
+                    Uo_Cyo = trisolve(self.Uo, self.eval_fun(self.obs_mesh, y, **self.params), uplo='U', transa='T')
                     C -= Uo_Cxo.T * Uo_Cyo
 
                 return C
 
 
+    def _cache_key(self, observed, *args):
+        """
+        The key under which results computed from self's parameters and args
+        are stored in Covariance.cache. If observed is True, self's
+        observations are taken into account. Returns None if the key can't
+        be formed.
+        """
+        if self.observed and observed:
+            if self._obs_key is None:
+                return None
+            obs_key = self._obs_key
+        else:
+            obs_key = None
+        try:
+            return (self.__class__, _freeze(self.eval_fun), _freeze(self.params),
+                    getattr(self, 'relative_precision', None), getattr(self, 'rank_limit', None),
+                    _freeze(getattr(self, 'nugget', None)), obs_key) + _freeze(args)
+        except TypeError:
+            return None
+
+    def _Uo_Cxo(self, x):
+        # chol(self(obs_mesh_*, obs_mesh_*)).T.I * self(obs_mesh_*, x)
+        key = self._cache_key(True, 'Uo_Cxo', x)
+        Uo_Cxo = self.cache.get(key)
+        if Uo_Cxo is None:
+            Cxo = self.eval_fun(self.obs_mesh, x, **self.params)
+            Uo_Cxo = trisolve(self.Uo, Cxo, uplo='U', transa='T')
+            self.cache.put(key, Uo_Cxo)
+        return Uo_Cxo
+
     # Methods for Mean instances' benefit:
 
     def _unobs_reg(self, M):
@@ -216,11 +216,20 @@ class FullRankCovariance(Covariance):
             N_old = 0
             N_new = obs_mesh.shape[0]
 
+            obs_key = self._cache_key(False, 'observe', output_type=='s', obs_mesh, obs_V)
+            chol = self.cache.get(obs_key)
+
             if output_type=='s':
-                U, C_eval = self.cholesky(obs_mesh, nugget=obs_V, observed=False, return_eval_also=True)
+                if chol is None:
+                    chol = self.cholesky(obs_mesh, nugget=obs_V, observed=False, return_eval_also=True)
+                    self.cache.put(obs_key, chol)
+                U, C_eval = chol
                 U_new = U
             else:
-                U = self.cholesky(obs_mesh, nugget = obs_V, observed=False)
+                if chol is None:
+                    chol = self.cholesky(obs_mesh, nugget = obs_V, observed=False)
+                    self.cache.put(obs_key, chol)
+                U = chol
 
             # Upper-triangular Cholesky factor of self(obs_mesh, obs_mesh)
             self.full_Uo = U
@@ -256,16 +265,23 @@ class FullRankCovariance(Covariance):
             # Number of new observations.
             N_new = obs_mesh.shape[0]
 
-            # Call to self.continue_cholesky.
+            # Call to self.continue_cholesky. Only the GP submodel's
+            # continuations are likely to recur, so only they are cached.
             if output_type=='s':
-                U, U_new, C_eval = self.continue_cholesky( x=obs_mesh,
-                                                        x_old = self.full_obs_mesh,
-                                                        U_old = self.full_Uo,
-                                                        observed = False,
-                                                        nugget = obs_V,
-                                                        return_eval_also=True)
+                obs_key = self._cache_key(True, 'observe', True, obs_mesh, obs_V)
+                chol = self.cache.get(obs_key)
+                if chol is None:
+                    chol = self.continue_cholesky( x=obs_mesh,
+                                                x_old = self.full_obs_mesh,
+                                                U_old = self.full_Uo,
+                                                observed = False,
+                                                nugget = obs_V,
+                                                return_eval_also=True)
+                    self.cache.put(obs_key, chol)
+                U, U_new, C_eval = chol
                 
             else:
+                obs_key = None
                 U = self.continue_cholesky( x=obs_mesh,
                                             x_old = self.full_obs_mesh,
                                             U_old = self.full_Uo,
@@ -291,6 +307,7 @@ class FullRankCovariance(Covariance):
             # Length of obs_mesh_*.
             self.obs_len = N_old + N_new
 
+        self._obs_key = obs_key
         self.observed = True
         # Output expected by Realization
         if output_type == 'r':
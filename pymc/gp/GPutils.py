@@ -1,8 +1,8 @@
 # Copyright (c) Anand Patil, 2007
 
 __docformat__='reStructuredText'
-__all__ = ['observe', 'plot_envelope', 'predictive_check', 'regularize_array', 'trimult', 'trisolve', 'vecs_to_datmesh', 'caching_call', 'caching_callable',
-            'fast_matrix_copy', 'point_predict','square_and_sum','point_eval']
+__all__ = ['observe', 'unobserve', 'reobserve', 'cholupdate', 'choldelete', 'plot_envelope', 'predictive_check', 'regularize_array', 'trimult', 'trisolve', 'vecs_to_datmesh', 'caching_call', 'caching_callable',
+            'fast_matrix_copy', 'point_predict','square_and_sum','point_eval', 'factor_cache']
 
 
 # TODO: Implement lintrans, allow obs_V to be a huge matrix or an ndarray in observe().
@@ -14,7 +14,7 @@ from linalg_utils import *
 from threading import Thread, Lock
 import sys
 from pymc import thread_partition_array, map_noreturn
-from pymc.gp import chunksize
+from pymc.gp import chunksize, factor_cache_size
 import pymc
 
 try:
@@ -129,6 +129,107 @@ class caching_callable(object):
             self.f_sofar = f_sofar
         return f
 
+class factor_cache(object):
+    """
+    cache = factor_cache([max_bytes])
+
+    A least-recently-used store for Cholesky factors and the other byproducts
+    of Covariance evaluations. When the arrays held exceed max_bytes in total,
+    the entries that were used longest ago are dropped.
+
+    Values are shared between everyone who retrieves them, so they must not
+    be modified in place.
+
+    :SeeAlso: Covariance
+    """
+    def __init__(self, max_bytes=factor_cache_size):
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.order = []
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        Returns the value stored under key, or None.
+        """
+        if key is None:
+            return None
+        self.lock.acquire()
+        try:
+            if not self.entries.has_key(key):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.order.remove(key)
+            self.order.append(key)
+            return self.entries[key][0]
+        finally:
+            self.lock.release()
+
+    def put(self, key, value):
+        """
+        Stores value under key, evicting old entries to stay under max_bytes.
+        Values larger than max_bytes aren't stored.
+        """
+        if key is None:
+            return
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        self.lock.acquire()
+        try:
+            if self.entries.has_key(key):
+                self.nbytes -= self.entries.pop(key)[1]
+                self.order.remove(key)
+            self.entries[key] = (value, nbytes)
+            self.order.append(key)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.entries.pop(self.order.pop(0))[1]
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries = {}
+            self.order = []
+            self.nbytes = 0
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.entries)
+
+def _nbytes(value):
+    "Number of bytes held by the arrays in value."
+    if isinstance(value, ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        value = value.values()
+    if isinstance(value, (tuple, list)):
+        return sum([_nbytes(v) for v in value])
+    return 0
+
+def _freeze(x):
+    """
+    A hashable version of x, for use in factor_cache keys. Arrays are
+    identified by their contents. Raises TypeError if x can't be hashed.
+    """
+    if isinstance(x, ndarray):
+        return (x.dtype.str, x.shape, x.tostring())
+    if isinstance(x, dict):
+        items = x.items()
+        items.sort()
+        return tuple([(k, _freeze(v)) for k, v in items])
+    if isinstance(x, (tuple, list)):
+        return tuple([_freeze(v) for v in x])
+    hash(x)
+    return x
+
 def vecs_to_datmesh(x, y):
     """
     Converts input arguments x and y to a 2d meshgrid,
@@ -176,6 +277,57 @@ def trisolve(U,b,uplo='U',transa='N',alpha=1.,inplace=False):
     dtrsm_wrap(a=U,b=x,uplo=uplo,transa=transa,alpha=alpha)
     return x
 
+def cholupdate(U,v,downdate=False):
+    """
+    cholupdate(U,v[, downdate=False])
+
+
+    Overwrites U, an upper-triangular or upper-trapezoidal factor with
+    U.T*U = C, with the corresponding factor of C + v*v.T, or of C - v*v.T
+    if downdate is True. Takes O(n**2) operations rather than the O(n**3)
+    of a new factorization. v is overwritten.
+
+    The leading elements of v that are zero are skipped, so updates that
+    only touch the last few columns are cheap.
+    """
+    U = asarray(U)
+    v = asarray(v).ravel()
+    if downdate:
+        sign = -1.
+    else:
+        sign = 1.
+    for k in xrange(U.shape[0]):
+        if v[k] == 0.:
+            continue
+        r2 = U[k,k]**2 + sign*v[k]**2
+        if r2 <= 0.:
+            raise LinAlgError, 'Downdated matrix does not appear to be positive definite by row %i.' % k
+        r = sqrt(r2)
+        c = r/U[k,k]
+        s = v[k]/U[k,k]
+        U[k,k] = r
+        U[k,k+1:] = (U[k,k+1:] + sign*s*v[k+1:])/c
+        v[k+1:] = c*v[k+1:] - s*U[k,k+1:]
+
+def choldelete(U,i):
+    """
+    U_new = choldelete(U,i)
+
+
+    U is an upper-triangular or upper-trapezoidal factor with U.T*U = C.
+    Returns the factor of C with row and column i removed, using a rank-one
+    update of the trailing rows in O(n**2) operations. U is not modified.
+    """
+    m, n = U.shape
+    U = asarray(U)
+    U_new = asmatrix(empty((m-1, n-1), order='F'))
+    U_new[:i,:i] = U[:i,:i]
+    U_new[:i,i:] = U[:i,i+1:]
+    U_new[i:,:i] = 0.
+    U_new[i:,i:] = U[i+1:,i+1:]
+    cholupdate(U_new[i:,i:], U[i,i+1:].copy())
+    return U_new
+
 def regularize_array(A):
     """
     Takes an ndarray as an input.
@@ -288,6 +440,36 @@ def observe(M, C, obs_mesh, obs_vals, obs_V = 0, lintrans = None, cross_validate
                 raise ValueError, "These data seem extremely improbable given your GP prior. \n Suggestions: decrease observation precision, or adjust the covariance to \n allow the function to be less smooth."
 
 
+def unobserve(M, C, indices):
+    """
+    unobserve(M, C, indices)
+
+
+    Removes the observations at C.obs_mesh[indices] from M and C, which must
+    have been observed together. The Cholesky factor of C's evaluation on
+    its observation mesh is downdated rather than recomputed.
+
+
+    :SeeAlso: observe, reobserve
+    """
+    C.unobserve(indices)
+    M.unobserve(C, indices)
+
+def reobserve(M, C, indices, obs_V):
+    """
+    reobserve(M, C, indices, obs_V)
+
+
+    Changes the observation variance at C.obs_mesh[indices] to obs_V. The
+    Cholesky factor of C's evaluation on its observation mesh is updated
+    rather than recomputed.
+
+
+    :SeeAlso: observe, unobserve
+    """
+    C.reobserve(indices, obs_V)
+    M.observe(C, C.obs_mesh[:0], zeros(0), mean_under=zeros(0))
+
 def predictive_check(obs_vals, obs_mesh, M, posdef_indices, tolerance):
     """
     OK = predictive_check(obs_vals, obs_mesh, M, posdef_indices, tolerance)
@@ -51,12 +51,17 @@ class Mean(object):
 
         obs_mesh_new and obs_vals_new should already have
         been sliced, as Covariance.observe(..., output_type='o') does.
+
+        If there are no new observations but C's Cholesky factor has
+        changed, as after C.reobserve, the regression matrix is
+        recomputed from the existing deviations.
         """
 
         self.C = C
         self.obs_mesh = C.obs_mesh
         self.obs_len = C.obs_len
 
+        Uo_old = self.Uo
         self.Uo = C.Uo
 
         # Evaluate the underlying mean function on the new observation mesh.
@@ -87,8 +92,25 @@ class Mean(object):
 
             # Stack deviations of old and new observations from unobserved mean.
             self.dev = hstack((self.dev, dev_new))
+
+        # If C's factor has been updated in place of the observations:
+        elif C.Uo is not Uo_old:
+            self.reg_mat = C._unobs_reg(self)
+
         self.observed = True
 
+    def unobserve(self, C, indices):
+        """
+        Synchronizes self's observation status with C's after
+        C.unobserve(indices).
+        """
+        if not C.observed:
+            self.__init__(self.eval_fun, **self.params)
+            return
+
+        self.dev = delete(self.dev, indices)
+        self.observe(C, C.obs_mesh[:0], zeros(0), mean_under=zeros(0))
+
     def __call__(self, x, observed = True, regularize=True, Uo_Cxo=None):
 
         # Record original shape of x and regularize it.
@@ -4,6 +4,10 @@
 # kept below this limit.
 chunksize = 1e8
 
+# The Cholesky factors that Covariance instances share through Covariance.cache
+# will be kept below this many bytes.
+factor_cache_size = 2e8
+
 __modules__ = [ 'GPutils',
                 'Mean',
                 'Covariance',
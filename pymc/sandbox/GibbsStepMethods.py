@@ -17,6 +17,9 @@ threshold is
     min(1, p(A_p|parents) / p(A|parents)).
 
 Each Gibbs step method has a fully conjugate version and a nonconjugate version.
+
+The fully conjugate step methods have moved to pymc.GibbsStepMethods, where
+they are assigned automatically by MCMC.
 """
 
 from pymc import *
@@ -298,357 +301,11 @@ class StandardGibbs(Gibbs):
             return pymc.nonconjugate_Gibbs_competence
 
 
-# TODO: When allowing mixed conjugacy, allow Categorical children also.
-class DirichletMultinomial(StandardGibbs):
-    """
-    Applies to p in the following submodel:
-
-    d_i ~ind Multinomial(n_i, p)
-    p ~ Dirichlet(theta) [optional]
-    """
-    linear_OK = False
-    child_class = Multinomial
-    parent_label = 'p'
-    target_class = Dirichlet
-    def __init__(self, p, verbose=0):
-
-        StandardGibbs.__init__(self, p, verbose=0)
-
-        @deterministic
-        def like_theta(d=self.d, N_d = self.N_d):
-            out = 0.
-            for i in xrange(N_d):
-                out += d[i]
-            return out
-        self.like_theta = like_theta
-
-
-    def propose(self):
-
-        theta = self.like_theta.value
-        if self.conjugate:
-            theta = theta + self.theta.value
-        else:
-            theta += 1.
-        self.stochastic.value = np.random.dirichlet(theta)
-
-
-
-class WishartMvNormal(StandardGibbs):
-    """
-    Applies to tau in the following submodel:
-
-    d_i ~ind Normal(mu_i, tau)
-    tau ~ Wishart(n, C) [optional]
-
-    where the stochastics d are parametrized by precision, not covariance.
-    """
-    linear_OK = True
-    child_class = MvNormal
-    parent_label = 'tau'
-    target_class = Wishart
-    def __init__(self, tau, verbose=0):
-
-        StandardGibbs.__init__(self, tau, verbose=verbose)
-
-        @deterministic
-        def like_Tau(N_d = self.N_d, d = self.d, parent_dict = self.parent_dict):
-            quad_term = 0.
-            for i in xrange(N_d):
-                delta_now = d[i] - parent_dict['mu'][i]
-                quad_term += np.outer(delta_now, delta_now)
-            return np.asmatrix(quad_term)
-
-        @deterministic
-        def like_lin_Tau(N_ld = self.N_ld, ld = self.ld, lparent_dict = self.lparent_dict, lside = self.lside, lcoef = self.lcoef):
-
-            quad_term = 0.
-
-            for i in xrange(N_ld):
-
-                delta_now = ld[i] - lparent_dict['mu'][i]
-
-                if lcoef[i][0] is not None:
-
-                    if lside[i] == 'L':
-                        quad_term += np.dot(np.outer(delta_now, delta_now), lcoef[i][0])
-                    else:
-                        quad_term += np.dot(lcoef[i][0], np.outer(delta_now, delta_now))
-
-            return np.asmatrix(quad_term)
-
-        self.like_Tau, self.like_lin_Tau = like_Tau, like_lin_Tau
-
-    def propose(self):
-        n = self.N_d
-        Tau = self.like_Tau.value + self.like_lin_Tau.value
-        pdb.set_trace()
-        if self.conjugate:
-            n += self.n.value
-            Tau += self.Tau.value
-        else:
-            n += 1.
-
-        self.stochastic.value = np.asmatrix(rwishart(n, Tau))
-
-
-class BetaX(StandardGibbs):
-    """
-    Base class for conjugacy involving Beta.
-    """
-    linear_OK = False
-    target_class = Beta
-    def __init__(self, stochastic, verbose=0):
-        StandardGibbs.__init__(self, stochastic, verbose=verbose)
-
-    def propose(self):
-        alpha = self.like_alpha.value
-        beta = self.like_beta.value
-        if self.conjugate:
-            alpha = alpha + self.alpha.value
-            beta = beta + self.beta.value
-        else:
-            alpha += 1.
-            beta += 1.
-        self.stochastic.value = np.random.beta(alpha, beta)
-
-class BetaGeometric(BetaX):
-    """
-    Applies to p in the following submodel:
-
-    d_i ~ind Geometric(p)
-    p ~ Beta(alpha, beta) [optional]
-    """
-    child_class = Geometric
-    parent_label = 'p'
-    def __init__(self, p, verbose=0):
-        BetaX.__init__(self, p, verbose)
-
-        @deterministic
-        def like_alpha(N = self.N):
-            return N
-
-        self.like_alpha = like_alpha
-        self.like_beta = self.sum_d
-
-
-# TODO: When allowing mixed conjugacy, allow Bernoulli children also.
-class BetaBinomial(BetaX):
-    """
-    Applies to p in the following submodel:
-
-    d_i ~ind Binomial(n_i, p)
-    p ~ Beta(alpha, beta) [optional]
-    """
-    child_class = Binomial
-    parent_label = 'p'
-    def __init__(self, p, verbose=0):
-
-        BetaX.__init__(self, p, verbose)
-
-        self.like_alpha = self.sum_d
-
-        @deterministic
-        def like_beta(N_d = self.N_d, d = self.d, parent_dict = self.parent_dict):
-            out = 0.
-            for i in xrange(N_d):
-                out += np.sum(parent_dict['n'][i] - d[i])
-            return out
-        self.like_beta = like_beta
-
-
-class GammaX(StandardGibbs):
-    """
-    Base class for conjugacy involving Gamma.
-    """
-    linear_OK = True
-    target_class = Gamma
-    def __init__(self, stochastic, verbose=0):
-
-        StandardGibbs.__init__(self, stochastic, verbose=verbose)
-
-        @deterministic
-        def sum_ld(N_ld = self.N_ld, ld = self.ld, lcoef = self.lcoef, lside=self.lside):
-
-            out = 0.
-            for i in xrange(N_ld):
-
-                if lcoef[i][0] is not None:
-                    if lside[i] == 'L':
-                        out += np.sum(np.dot(np.transpose(lcoef[i][0]), ld[i]))
-                    else:
-                        out += np.sum(np.dot(ld[i], np.transpose(lcoef[i][0])))
-
-            return out
-        self.sum_ld = sum_ld
-
-    def propose(self):
-        alpha = self.like_alpha.value
-        beta = self.like_beta.value
-        if self.conjugate:
-            alpha = alpha + self.alpha.value
-            beta = beta + self.beta.value
-        else:
-            alpha += 1.
-        self.stochastic.value = np.random.gamma(alpha, 1./beta)
-
-
-class GammaExponential(GammaX):
-    """
-    Applies to beta in the following submodel:
-
-    d_i ~ind Exponential(beta)
-    beta ~ Gamma(...) [optional]
-
-    Optionally, can apply to beta in:
-
-    d_i ~ind Exponential(l_i)
-    l_i = LinearCombination([beta],[y_i])
-    beta ~ Gamma(...) [optional]
-
-    where beta is one of the elements of either x or y.
-    """
-    child_class = Exponential
-    parent_label = 'beta'
-    def __init__(self, beta, verbose=0):
-
-        self.stochastic = beta
-        GammaX.__init__(self, beta, verbose)
-
-        @deterministic
-        def like_alpha(N = self.N, lN = self.lN):
-            return N + lN
-        self.like_alpha = like_alpha
-
-        @deterministic
-        def like_beta(sum_ld = self.sum_ld, sum_d = self.sum_d):
-            return sum_d + sum_ld
-        self.like_beta = like_beta
-
-
-class GammaPoisson(GammaX):
-    """
-    Applies to mu in the following submodel:
-
-    d_i ~ind Poisson(mu)
-    mu ~ Gamma(...) [optional]
-
-    Optionally can apply to mu in:
-    d_i ~ind Poisson(l_i)
-    l_i = LinearCombination([mu],[y_i])
-    mu ~ Gamma(...) [optional]
-
-    """
-    child_class = Poisson
-    parent_label = 'mu'
-    def __init__(self, mu, verbose=0):
-
-        self.stochastic = mu
-        GammaX.__init__(self, mu, verbose)
-
-        self.like_alpha = Lambda('like_alpha', lambda sum_d = self.sum_d, sum_ld = self.sum_ld: sum_d + sum_ld)
-
-        @deterministic
-        def like_beta(d = self.ld, lN = self.lN, N = self.N, lcoef = self.lcoef, lside = self.lside):
-            out = N
-            for i in xrange(lN):
-
-                if lcoef[i][0] is not None:
-
-                    if lside[i]=='L':
-                        out += np.sum(np.sum(lcoef[i][0], axis=1))
-                    else:
-                        out += np.sum(np.sum(lcoef[i][0], axis=0))
-
-            return out
-        self.like_beta = like_beta
-
-
-class GammaGamma(GammaX):
-    """
-    Applies to beta in the following submodel:
-
-    d_i ~ind Gamma(alpha_i, beta)
-    beta ~ Gamma(...) [optional]
-
-    Optionally can apply to beta in:
-
-    d_i ~ind Gamma(alpha_i, l_i)
-    l_i = LinearCombination([beta],[y_i])
-    beta ~ Gamma(...) [optional]
-
-    """
-    child_class = Gamma
-    parent_label = 'beta'
-    def __init__(self, beta, verbose=0):
-
-        self.stochastic = beta
-        GammaX.__init__(self, beta, verbose)
-
-        @deterministic
-        def like_alpha(lparent_dict = self.lparent_dict, parent_dict = self.parent_dict, N_d = self.N_d, N_ld = self.N_ld):
-            out = 0.
-            for i in xrange(self.N_d):
-                out += np.sum(parent_dict['alpha'][i])
-            for i in xrange(self.N_ld):
-                out += np.sum(lparent_dict['alpha'][i])
-            return out
-        self.like_alpha = like_alpha
-
-        @deterministic
-        def like_beta(sum_ld = self.sum_ld, sum_d = self.sum_d):
-            return sum_d + sum_ld
-        self.like_beta = like_beta
-
-
-class GammaNormal(GammaX):
-    """
-    Applies to tau in the following submodel:
-
-    d ~ind N(mu, tau * theta)
-    tau ~ Gamma(alpha, beta) [optional]
-
-    Optionally can apply to tau in:
-
-    d ~ind N(mu, l_i * theta)
-    l_i = LinearCombination([tau],[y_i])
-    tau ~ Gamma(...) [optional]
-    """
-    child_class = Normal
-    parent_label = 'tau'
-
-    def __init__(self, tau, verbose=0):
-
-        self.stochastic = tau
-
-        GammaX.__init__(self, tau, verbose)
-
-        @deterministic
-        def like_alpha(N=self.N, lN=self.lN):
-            return .5 * (N + lN)
-
-        @deterministic
-        def like_beta(d=self.d, ld=self.ld, parent_dict=self.parent_dict, lparent_dict=self.lparent_dict, lcoef=self.lcoef,
-            lside=self.lside, N_d=self.N_d, N_ld=self.N_ld):
-            quad_term = 0.
-            for i in xrange(self.N_d):
-                delta_now = d[i] - parent_dict['mu'][i]
-                quad_term += np.dot(delta_now, delta_now)
-
-            for i in xrange(N_ld):
-
-                if lcoef[i][0] is not None:
-
-                    delta_now = ld[i] - lparent_dict['mu'][i]
-                    if lside[i] == 'L':
-                        quad_term += np.dot(np.dot(delta_now, lcoef[i][0]), delta_now)
-                    else:
-                        quad_term += np.dot(delta_now, np.dot(delta_now, lcoef[i][0]))
-
-            return quad_term * .5
-
-        self.like_alpha, self.like_beta = like_alpha, like_beta
-
+# The conjugate step methods DirichletMultinomial, WishartMvNormal,
+# BetaBinomial, BetaGeometric, GammaExponential, GammaPoisson, GammaGamma and
+# GammaNormal are now in pymc.GibbsStepMethods, and imported above with
+# pymc. Their non-conjugate and LinearCombination variants have not been
+# carried over.
 
 
 class BernoulliAnything(Gibbs):
@@ -1,4 +1,4 @@
-__modules__ = ['bayes','EM','parallel','NormalSubmodel','NormalModel','DLM','DP']
+__modules__ = ['bayes','EM','parallel','NormalSubmodel','NormalModel','DP']
 
 for mod in __modules__:
     try:
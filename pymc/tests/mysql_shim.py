@@ -0,0 +1,56 @@
+"""
+Stand-in for the MySQLdb module, storing a single database in a SQLite
+file, so that the mysql backend can be tested without a MySQL server.
+
+Only the statements issued by pymc.database.mysql are translated: CREATE
+DATABASE and USE are ignored, SHOW TABLES lists the SQLite tables, and
+the format parameter style is converted to SQLite's.
+"""
+
+import sqlite3
+
+class Driver(object):
+    """DB-API module stand-in. Every connection opens the same file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def connect(self, **kwds):
+        return Connection(self.filename)
+
+class Connection(object):
+    def __init__(self, filename):
+        self._connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self._connection.text_factory = str
+
+    def cursor(self):
+        return Cursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+class Cursor(object):
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        words = query.split()
+        if words[:2] == ['CREATE', 'DATABASE'] or words[0] == 'USE':
+            return
+        if words == ['SHOW', 'TABLES']:
+            query = "SELECT name FROM sqlite_master WHERE type='table' AND NOT name LIKE 'sqlite_%'"
+        else:
+            query = query.replace('%s', '?').replace('%%', '%')
+        self._cursor.execute(query, tuple(params))
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
@@ -58,8 +58,68 @@ class test_MCMC(TestCase):
         db.close()
         os.remove('MCMC.pickle')
 
+class test_multiple_chains(TestCase):
+
+    def test_sequential(self):
+        M = MCMC(DisasterModel, db='ram')
+        M.sample(200, 100, chains=2)
+        assert_equal(M.db.chains, 2)
+        assert_array_equal(M.e.trace(chain=None).shape, (200,))
+
+    def test_parallel(self):
+        M = MCMC(DisasterModel, db='ram')
+        M.sample(200, 100, chains=3, n_jobs=2)
+        assert_equal(M.db.chains, 3)
+        for chain in range(3):
+            assert_array_equal(M.trace('e', chain=chain)[:].shape, (100,))
+        assert_array_equal(M.e.trace(chain=None).shape, (300,))
+
+        # Each worker is seeded independently.
+        assert (M.trace('e', chain=0)[:] != M.trace('e', chain=1)[:]).any()
+
+        # Sampling can continue in the parent process.
+        M.sample(10)
+        assert_equal(M.db.chains, 4)
+
+class test_compile(TestCase):
+
+    def test_schedule(self):
+        M = MCMC(DisasterModel)
+        schedule = M.compile()
+        for node in schedule.nodes:
+            for i in schedule.parents[schedule.index[node]]:
+                assert schedule.index[node] > i
+
+        for sm in M.step_methods:
+            assert sm._blanket_terms is not None
+            assert_almost_equal(sm.logp_plus_loglike, sum([n.logp for n in sm.markov_blanket]))
+
+        M.sample(200, 100)
+        assert_array_equal(M.e.trace().shape, (100,))
+
+
+class test_logp_cache(TestCase):
+
+    def test_cached_sums(self):
+        M = MCMC(DisasterModel)
+        M.assign_step_methods()
+        sm = M.step_method_dict[M.e][0]
+        logp = sm.logp_plus_loglike
+        loglike = sm.loglike
+
+        # A proposal for the step method's own stochastic.
+        M.e.value = M.e.value * 2.
+        assert_almost_equal(sm.logp_plus_loglike, sum([n.logp for n in sm.markov_blanket]))
+        M.e.revert()
+        assert_equal(sm.logp_plus_loglike, logp)
+        assert_equal(sm.loglike, loglike)
+
+        # A change made by another step method.
+        M.l.value = M.l.value * 2.
+        assert_almost_equal(sm.logp_plus_loglike, sum([n.logp for n in sm.markov_blanket]))
+        assert_almost_equal(sm.loglike, M.D.logp)
+
 
 if __name__ == '__main__':
     warnings.simplefilter('ignore',  FutureWarning)
     nose.runmodule()
-
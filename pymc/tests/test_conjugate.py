@@ -0,0 +1,87 @@
+"""Test the conjugate Gibbs step methods."""
+
+from numpy.testing import *
+import numpy as np
+import pymc
+from pymc import *
+
+def draws(stepper, n=5000):
+    values = []
+    for i in xrange(n):
+        stepper.step()
+        values.append(np.copy(stepper.stochastic.value))
+    return np.array(values)
+
+class test_conjugate_Gibbs(TestCase):
+
+    def test_assignment(self):
+        mu = Normal('mu', 0, .01)
+        tau = Gamma('tau', 1, 1)
+        sd = Lambda('sd', lambda tau=tau: 1./np.sqrt(tau))
+        y = Normal('y', mu, tau, value=np.random.normal(size=20), observed=True)
+        M = MCMC([mu, tau, sd, y])
+        M.assign_step_methods()
+        assert isinstance(M.step_method_dict[mu][0], NormalNormalMean)
+        assert isinstance(M.step_method_dict[tau][0], GammaNormal)
+        M.sample(100)
+
+    def test_not_conjugate(self):
+        # tau reaches y through a deterministic.
+        tau = Gamma('tau', 1, 1)
+        tau2 = Lambda('tau2', lambda tau=tau: 2*tau)
+        y = Normal('y', 0, tau2, value=np.random.normal(size=20), observed=True)
+        assert_equal(GammaNormal.competence(tau), 0)
+
+        # mu is both parents of z.
+        mu = Gamma('mu', 1, 1)
+        z = Normal('z', 0, mu, value=1., observed=True)
+        w = Normal('w', mu, mu, value=1., observed=True)
+        assert_equal(GammaNormal.competence(mu), 0)
+        assert_equal(NormalNormalMean.competence(mu), 0)
+
+    def test_GammaPoisson(self):
+        mu = Gamma('mu', value=3., alpha=1., beta=1.)
+        d = Poisson('d', mu, value=np.random.poisson(3, size=10), observed=True)
+        alpha = 1. + d.value.sum()
+        beta = 1. + 10
+        values = draws(GammaPoisson(mu))
+        assert(abs(values.mean() - alpha/beta) < .05)
+        assert(abs(values.var() - alpha/beta**2) < .05)
+
+    def test_BetaBinomial(self):
+        p = Beta('p', value=.2, alpha=5., beta=1.)
+        d1 = Binomial('d1', value=np.random.randint(0, 16, 10), n=15, p=p, observed=True)
+        d2 = Bernoulli('d2', value=np.random.random(5) > .5, p=p, observed=True)
+        a = 5. + d1.value.sum() + d2.value.sum()
+        b = 1. + 15*10 - d1.value.sum() + 5 - d2.value.sum()
+        values = draws(BetaBinomial(p))
+        assert(abs(values.mean() - a/(a+b)) < .01)
+
+    def test_vectorized(self):
+        # One precision per element of the data vectors.
+        tau = Gamma('tau', alpha=2., beta=1., value=np.ones(3))
+        y = [Normal('y_%i'%i, 0, tau, value=np.random.normal(size=3) * [1, 2, 3], observed=True) for i in range(50)]
+        values = draws(GammaNormal(tau), 2000)
+        assert_equal(values.shape, (2000, 3))
+        alpha = 2. + 25
+        beta = 1. + .5 * np.sum([d.value**2 for d in y], 0)
+        assert(np.all(np.abs(values.mean(0) / (alpha/beta) - 1) < .05))
+
+        # One mean per group.
+        mu = Normal('mu', 0, 1e-4, value=np.zeros(3))
+        x = [Normal('x_%i'%i, mu, 4., value=np.random.normal(size=3) + [1, 2, 3], observed=True) for i in range(40)]
+        values = draws(NormalNormalMean(mu), 2000)
+        mean = 4. * np.sum([d.value for d in x], 0) / (1e-4 + 4.*40)
+        assert(np.all(np.abs(values.mean(0) - mean) < .03))
+
+    def test_DirichletMultinomial(self):
+        p = Dirichlet('p', theta=np.ones(3))
+        d = Multinomial('d', n=30, p=p, value=[[5, 10, 15], [6, 9, 15]], observed=True)
+        values = draws(DirichletMultinomial(p), 2000)
+        theta = np.array([12., 20., 31.])
+        assert_array_almost_equal(values.mean(0), (theta/theta.sum())[:-1], 2)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.runmodule()
@@ -47,6 +47,70 @@ class test_raftery_lewis(TestCase):
         # nmin should approximately be the same as nprec/kmind
         assert(0.8 < (float(nprec)/kmind) / nmin < 1.2)
 
+class test_multichain(TestCase):
+
+    def test_iid(self):
+        np.random.seed(3)
+        x = np.random.normal(size=(4, 2000, 3))
+        assert(np.all(np.abs(pymc.rhat(x) - 1) < .01))
+        assert(np.all(np.abs(pymc.gelman_rubin(x) - 1) < .01))
+        ess = pymc.effective_n(x)
+        assert_equal(ess.shape, (3,))
+        assert(np.all(ess > 6000))
+        assert(np.all(pymc.effective_n(x, 'tail') > 4000))
+        mcse_mean, mcse_sd = pymc.mcse(x)
+        assert(np.all(np.abs(mcse_mean * np.sqrt(8000) - 1) < .2))
+
+    def test_autocorrelated(self):
+        np.random.seed(4)
+        rho = .9
+        x = np.array([pymc.utils.ar1(rho, 0, 1, 5000) for i in range(4)])
+        # The integrated autocorrelation time of an AR(1) is (1+rho)/(1-rho).
+        ess = pymc.effective_n(x, 'mean')
+        assert(.7 < ess / (20000*(1-rho)/(1+rho)) < 1.3)
+
+    def test_not_mixed(self):
+        np.random.seed(5)
+        x = np.random.normal(size=(4, 1000))
+        x[0] += 3
+        assert(pymc.rhat(x) > 1.1)
+        assert(pymc.gelman_rubin(x) > 1.1)
+
+    def test_summary(self):
+        M = pymc.MCMC(model, 'ram')
+        for i in range(3):
+            M.sample(2000, 500, verbose=0)
+        stats = pymc.convergence_summary(M)
+        assert(set(['a', 'b']) <= set(stats.keys()))
+        for name in ['rhat', 'ess_bulk', 'ess_tail', 'mcse_mean', 'mcse_sd']:
+            assert(np.isfinite(stats['a'][name]))
+        assert(stats['a']['rhat'] < 1.1)
+
+class test_validate(TestCase):
+
+    def model(self):
+        mu = pymc.Normal('mu', 0, 1)
+        y = pymc.Normal('y', mu, 1, value=[.5, 1.], observed=True)
+        return pymc.MCMC([mu, y])
+
+    def check(self, stats):
+        X2, p = stats['mu']
+        assert(X2 >= 0)
+        assert(0 <= p <= 1)
+
+    def test_serial(self):
+        M = self.model()
+        db = M.db
+        self.check(pymc.validate(M, replicates=3, iterations=300, burn=100, plot=False))
+        assert(M.db is db)
+        assert(M.mu.trace is db._traces['mu'])
+
+    def test_parallel(self):
+        M = self.model()
+        self.check(pymc.validate(M, replicates=4, iterations=300, burn=100, plot=False, n_jobs=2))
+
+
+
 if __name__ == "__main__":
     import nose
     C =nose.config.Config(verbosity=1)
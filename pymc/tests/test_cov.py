@@ -16,3 +16,36 @@ class test_cov(TestCase):
 
         assert(D(y).shape == (y.shape[0],))
         assert(D(y,y).shape == (y.shape[0], y.shape[0]))
+
+    def test_cache(self):
+        Covariance.cache.clear()
+        mesh = linspace(-1, 1, 20).reshape((-1,1))
+        U = C.cholesky(mesh)
+
+        # A new covariance with the same parameters reuses the factor.
+        hits = Covariance.cache.hits
+        C2 = Covariance(eval_fun = matern.euclidean, diff_degree = 1.4, amp = .4, scale = 1.)
+        assert_array_almost_equal(C2.cholesky(mesh), U)
+        assert_equal(Covariance.cache.hits, hits+1)
+        C3 = Covariance(eval_fun = matern.euclidean, diff_degree = 1.4, amp = .5, scale = 1.)
+        C3.cholesky(mesh)
+        assert_equal(Covariance.cache.hits, hits+1)
+
+        # So do observations, and evaluations of the observed covariance.
+        Co = copy(C)
+        Co.observe(mesh, zeros(20), output_type='s')
+        Co(x)
+        C2.observe(mesh, zeros(20), output_type='s')
+        assert_equal(Covariance.cache.hits, hits+2)
+        assert_array_almost_equal(C2(x), Co(x))
+        assert_equal(Covariance.cache.hits, hits+4)
+
+    def test_cache_budget(self):
+        cache = factor_cache(max_bytes=100)
+        cache.put('a', zeros(10))
+        cache.put('b', zeros(5))
+        assert(cache.get('a') is None)
+        assert_equal(cache.get('b'), zeros(5))
+        cache.put('c', zeros(20))
+        assert(cache.get('c') is None)
+        assert_equal(len(cache), 1)
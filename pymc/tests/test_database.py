@@ -1,10 +1,11 @@
 """ Test database backends """
 
 import os,sys, pdb
-from numpy.testing import TestCase, assert_array_equal, assert_equal
+from numpy.testing import TestCase, assert_array_equal, assert_equal, assert_almost_equal
 from pymc.examples import DisasterModel
 from pymc import MCMC
 import pymc, pymc.database
+import mysql_shim
 
 import numpy as np
 import nose
@@ -102,6 +103,87 @@ class TestRam(TestBase):
 
         self.S.db.close()
 
+class TestRamChunked(TestRam):
+    @classmethod
+    def setUpClass(self):
+        self.S = pymc.MCMC(DisasterModel, db='ram', dbchunk=3)
+        self.S.use_step_method(pymc.Metropolis, self.S.e, tally=True)
+
+    def test_chunks(self):
+        M = MCMC(DisasterModel, db='ram', dbchunk=4)
+        M.sample(10)
+        trace = M.db._traces['e']
+        assert_equal(len(trace._chunks[0]), 3)
+
+        # Slices within a chunk are views, others are copies.
+        assert_equal(trace.gettrace(slicing=slice(4, 7)).base is trace._chunks[0][1], True)
+        assert_array_equal(trace.gettrace(slicing=slice(2, 9)), trace.gettrace()[2:9])
+        assert_array_equal(trace.gettrace(slicing=slice(1, 10, 3)), trace.gettrace()[1::3])
+
+        M.db.truncate(5)
+        assert_equal(len(trace._chunks[0]), 2)
+        assert_equal(trace.length(), 5)
+
+class TestRamBuffered(TestRam):
+    @classmethod
+    def setUpClass(self):
+        self.S = pymc.MCMC(DisasterModel, db='ram', buffer=4)
+        self.S.use_step_method(pymc.Metropolis, self.S.e, tally=True)
+
+    def test_buffer(self):
+        M = MCMC(DisasterModel, db='ram', dbchunk=3, buffer=4)
+        M.sample(10)
+        assert_equal(M.db._buffered, 0)
+        assert_equal(M.db._block.shape, (4,))
+        assert_equal(M.e.trace.length(), 10)
+
+        # Values are held in the buffer until it is full.
+        M.db._initialize(M._funs_to_tally, 10)
+        M.db.tally()
+        assert_equal(M.e.trace.length(), 0)
+        M.db.truncate(1)
+        assert_array_equal(M.e.trace(), [M.e.value])
+
+class TestOnline(TestCase):
+    def test_summary(self):
+        M = MCMC(DisasterModel, db='ram', online=True, buffer=4)
+        M.sample(200)
+        trace = M.e.trace()
+        stats = M.e.online_stats()
+        assert_equal(stats['n'], 200)
+        assert_almost_equal(stats['mean'], trace.mean())
+        assert_almost_equal(stats['standard deviation'], trace.std())
+        assert_equal(stats['min'], trace.min())
+        assert_equal(stats['max'], trace.max())
+        q = [stats['quantiles'][p] for p in [2.5, 25, 50, 75, 97.5]]
+        assert np.all(np.diff(q) >= 0)
+        assert 'mc error' in stats
+
+        # stats still reads the trace.
+        assert '95% HPD interval' in M.e.stats()
+        assert '90% HPD interval' in M.e.stats(alpha=.1)
+
+        # A new chain starts a new summary.
+        M.sample(10)
+        assert_equal(M.e.online_stats()['n'], 10)
+
+    def test_accuracy(self):
+        x = np.random.normal(size=(5000, 2))
+        s = pymc.database.base.Summary((2,))
+        s.update_block(x[:1000])
+        for value in x[1000:]:
+            s.update(value)
+        assert_almost_equal(s.stats()['mean'], x.mean(0))
+        assert_almost_equal(s.stats()['standard deviation'], x.std(0))
+        assert np.all(np.abs(s.quantiles()[50]) < .1)
+        assert np.all(np.abs(s.quantiles()[97.5] - 1.96) < .2)
+        assert np.all(np.abs(s.mcse() - 1/np.sqrt(5000)) < .01)
+
+    def test_no_trace(self):
+        M = MCMC(DisasterModel, db='no_trace', online=True)
+        M.sample(50)
+        assert_equal(M.stats()['e']['n'], 50)
+
 class TestPickle(TestRam):
     name = 'pickle'
     @classmethod
@@ -147,6 +229,65 @@ class TestPickle(TestRam):
         db = getattr(pymc.database, self.name).load(os.path.join(testdir, 'ND.'+self.name))
         assert_equal(db.trace('nd')[:], a)
 
+class TestPickleCommits(TestCase):
+    def test_append(self):
+        dbname = os.path.join(testdir, 'Commits.pickle')
+        M = MCMC(DisasterModel, db='pickle', dbname=dbname, dbmode='w')
+        M.sample(10)
+        size = os.path.getsize(dbname)
+        M.db.commit()
+        assert_equal(os.path.getsize(dbname), size)
+
+        # Commits only append the rows tallied since the last one.
+        M.db._initialize(M._funs_to_tally, 10)
+        for i in range(4):
+            M.db.tally()
+        M.db.commit()
+        assert os.path.getsize(dbname) > size
+        db = pymc.database.pickle.load(dbname)
+        assert_equal(db._traces['e'].length(chain=1), 4)
+        assert db._traces['e']._blocks.has_key(1)
+        assert_array_equal(db.e(chain=1), M.e.trace(chain=1)[:4])
+
+        M.db.tally()
+        M.db.truncate(2)
+        M.db.commit()
+        db = pymc.database.pickle.load(dbname)
+        assert_array_equal(db.e(chain=1), M.e.trace(chain=1))
+        assert_array_equal(db.e(chain=0), M.e.trace(chain=0))
+
+    def test_incomplete_frame(self):
+        dbname = os.path.join(testdir, 'Incomplete.pickle')
+        M = MCMC(DisasterModel, db='pickle', dbname=dbname, dbmode='w')
+        M.sample(10)
+        file = open(dbname, 'ab')
+        file.write('\x05\x00\x00')
+        file.close()
+        size = os.path.getsize(dbname)
+
+        # Loading doesn't write to the file.
+        db = pymc.database.pickle.load(dbname)
+        assert_equal(os.path.getsize(dbname), size)
+        assert_array_equal(db.e(), M.e.trace())
+
+        # The incomplete frame is dropped when the database is committed.
+        db._state_ = {}
+        db.commit()
+        db = pymc.database.pickle.load(dbname)
+        assert_array_equal(db.e(), M.e.trace())
+        assert_equal(db._state_, {})
+
+    def test_load_old_format(self):
+        import cPickle
+        dbname = os.path.join(testdir, 'Old.pickle')
+        file = open(dbname, 'w')
+        cPickle.dump({'e': {0: np.arange(5.)}, '_state_': {}}, file)
+        file.close()
+        db = pymc.database.pickle.load(dbname)
+        db.commit()
+        db = pymc.database.pickle.load(dbname)
+        assert_array_equal(db.e(chain=0), np.arange(5.))
+
 class TestTxt(TestPickle):
     name = 'txt'
     @classmethod
@@ -161,6 +302,75 @@ class TestTxt(TestPickle):
         return pymc.database.txt.load(os.path.join(testdir, 'Disaster.txt'))
 
 
+class TestNpy(TestPickle):
+    name = 'npy'
+    @classmethod
+    def setUpClass(self):
+        self.S = pymc.MCMC(DisasterModel,
+                           db='npy',
+                           dbname=os.path.join(testdir, 'Disaster.npy'),
+                           dbmode='w', dbchunk=3)
+        self.S.use_step_method(pymc.Metropolis, self.S.e, tally=True)
+
+    def load(self):
+        return pymc.database.npy.load(os.path.join(testdir, 'Disaster.npy'))
+
+    def test_chunks(self):
+        dbname = os.path.join(testdir, 'Chunks.npy')
+        M = MCMC(DisasterModel, db='npy', dbname=dbname, dbmode='w', dbchunk=4)
+        M.use_step_method(pymc.Metropolis, M.e, tally=True)
+        M.sample(10)
+        filename = os.path.join(dbname, 'Chain_0', 'e.npy')
+        assert_array_equal(np.load(filename), M.e.trace())
+
+        # Committed values can be read while the chain is still growing.
+        M.db._initialize(M._funs_to_tally, 10)
+        for i in range(6):
+            M.db.tally()
+        M.db.commit()
+        filename = os.path.join(dbname, 'Chain_1', 'e.npy')
+        assert_equal(np.load(filename, mmap_mode='r').shape, (6,))
+        assert_equal(M.db._traces['e']._capacity[1], 8)
+        M.db._finalize()
+        assert_array_equal(np.load(filename), M.e.trace(chain=1))
+
+
+class TestTxtStream(TestPickle):
+    name = 'txt'
+    @classmethod
+    def setUpClass(self):
+        self.S = pymc.MCMC(DisasterModel,
+                           db='txt',
+                           dbname=os.path.join(testdir, 'DisasterStream.txt'),
+                           dbmode='w', dbstream=4)
+        self.S.use_step_method(pymc.Metropolis, self.S.e, tally=True)
+
+    def load(self):
+        return pymc.database.txt.load(os.path.join(testdir, 'DisasterStream.txt'))
+
+    def test_stream(self):
+        dbname = os.path.join(testdir, 'Stream.txt')
+        M = MCMC(DisasterModel, db='txt', dbname=dbname, dbmode='w', dbstream=4)
+        M.sample(10)
+        db = pymc.database.txt.load(dbname)
+        assert_array_equal(db.e(chain=0), M.e.trace())
+
+        # Blocks are written to the files as soon as they are full.
+        M.db._initialize(M._funs_to_tally, 10)
+        for i in range(6):
+            M.db.tally()
+        db = pymc.database.txt.load(dbname)
+        assert_equal(db.e(chain=1).shape, (4,))
+        M.db.commit()
+        db = pymc.database.txt.load(dbname)
+        assert_equal(db.e(chain=1).shape, (6,))
+        M.db.truncate(3)
+        M.db._finalize()
+        db = pymc.database.txt.load(dbname)
+        assert_array_equal(db.e(chain=1), M.e.trace(chain=1))
+        assert_equal(db.e(chain=1).shape, (3,))
+
+
 class TestSqlite(TestPickle):
     name = 'sqlite'
     @classmethod
@@ -179,31 +389,84 @@ class TestSqlite(TestPickle):
 
     def test_yrestore_state(self):
         raise nose.SkipTest, "Not implemented."
-"""
-    TODO Create more reliable MySQL backend test
-"""
-# class TestMySQL(TestPickle):
-#     @classmethod
-#     def setUpClass(self):
-#         if 'mysql' not in dir(pymc.database):
-#             raise nose.SkipTest
-#         self.S = pymc.MCMC(DisasterModel,
-#                            db='mysql',
-#                            dbname='pymc_test',
-#                            dbuser='pymc',
-#                            dbpass='bayesian',
-#                            dbhost='www.freesql.org',
-#                            dbmode='w')
-#
-#     def load(self):
-#         return pymc.database.mysql.load(dbname='pymc_test',
-#                                         dbuser='pymc',
-#                                         dbpass='bayesian',
-#                                         dbhost='www.freesql.org')
-#
-#     def test_yrestore_state(self):
-#         raise nose.SkipTest, "Not implemented."
 
+    def test_slicing(self):
+        dbname = os.path.join(testdir, 'Slicing.sqlite')
+        M = MCMC([self.NDstoch()], db='sqlite', dbname=dbname, dbmode='w')
+        M.sample(20)
+        M.db.cur.execute('SELECT value FROM nd')
+        assert_equal(len(M.db.cur.fetchall()[0]), 1)
+
+        trace = M.trace('nd')
+        full = trace.gettrace()
+        assert_equal(full.shape, (20,2,2))
+        for s in [slice(3, 11), slice(2, None, 3), slice(-5, None), slice(None, None, -4), slice(30, 40)]:
+            assert_array_equal(trace.gettrace(slicing=s), full[s])
+        M.db.truncate(5)
+        assert_equal(trace.length(), 5)
+
+    def test_append_old_format(self):
+        dbname = os.path.join(testdir, 'Old.sqlite')
+        if os.path.exists(dbname):
+            os.remove(dbname)
+        import sqlite3
+        con = sqlite3.connect(dbname)
+        con.execute('create table nd (recid INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, trace  int(5), v1_1 FLOAT, v1_2 FLOAT, v2_1 FLOAT, v2_2 FLOAT )')
+        con.executemany('INSERT INTO nd (recid, trace, v1_1, v1_2, v2_1, v2_2) values (NULL, 0, ?, ?, ?, ?)', [[i]*4 for i in range(3)])
+        con.commit()
+        con.close()
+
+        db = pymc.database.sqlite.load(dbname)
+        assert isinstance(db.nd, pymc.database.sqlite.ColumnTrace)
+        M = MCMC([self.NDstoch()], db=db)
+        M.sample(5)
+        assert_equal(db.nd(chain=0).shape, (3,2,2))
+        assert_equal(db.nd(chain=1).shape, (5,2,2))
+        assert_array_equal(db.nd(chain=1)[-1], M.nd.value)
+        db.close()
+
+class TestMySQL(TestPickle):
+    """Test the mysql backend against a SQLite-backed stand-in for MySQLdb."""
+    name = 'mysql'
+    @classmethod
+    def setUpClass(self):
+        if 'mysql' not in dir(pymc.database):
+            raise nose.SkipTest
+        self.driver = mysql_shim.Driver(os.path.join(testdir, 'Disaster.mysql'))
+        self.S = pymc.MCMC(DisasterModel,
+                           db='mysql',
+                           dbname='pymc_test',
+                           dbdriver=self.driver,
+                           dbmode='w')
+
+    def load(self):
+        return pymc.database.mysql.load(dbname='pymc_test', dbdriver=self.driver)
+
+    def test_yrestore_state(self):
+        raise nose.SkipTest, "Not implemented."
+
+    def test_nd(self):
+        driver = mysql_shim.Driver(os.path.join(testdir, 'ND.mysql'))
+        M = MCMC([self.NDstoch()], db='mysql', dbname='pymc_test', dbdriver=driver, dbmode='w')
+        M.sample(10)
+        a = M.trace('nd')[:]
+        assert_equal(a.shape, (10,2,2))
+        db = pymc.database.mysql.load(dbname='pymc_test', dbdriver=driver)
+        assert_equal(db.trace('nd')[:], a)
+
+    def test_batches(self):
+        driver = mysql_shim.Driver(os.path.join(testdir, 'Batches.mysql'))
+        M = MCMC(DisasterModel, db='mysql', dbname='pymc_test', dbdriver=driver, dbmode='w', buffer=7)
+        M.db.rows_per_insert = 3
+        M.sample(20)
+        assert_equal(M.e.trace.length(), 20)
+        assert len(M.db._pool._connections) <= 2
+
+        db = pymc.database.mysql.load(dbname='pymc_test', dbdriver=driver)
+        assert_array_equal(db.e(chain=0), M.e.trace())
+        assert_array_equal(db.e(slicing=slice(3, None, 4)), M.e.trace()[3::4])
+        M.db.close()
+        db.close()
 
 
 class TestHDF5(TestPickle):
@@ -255,6 +518,30 @@ class TestHDF5(TestPickle):
         db.close()
         del db
 
+    def test_commit(self):
+        # Samplers commit the database every 1000 iterations, starting with
+        # the first.
+        dbname = os.path.join(testdir, 'Commits.hdf5')
+        S = MCMC(DisasterModel, db='hdf5', dbname=dbname, dbmode='w')
+        S.sample(1200)
+        S.db.commit()
+        assert_equal(S.db._tables[0].nrows, 1200)
+        S.db.close()
+
+        db = pymc.database.hdf5.load(dbname)
+        assert_equal(db.e(chain=0).shape, (1200,))
+        db.close()
+
+    def test_online(self):
+        dbname = os.path.join(testdir, 'Online.hdf5')
+        for buffer in [1, 4]:
+            S = MCMC(DisasterModel, db='hdf5', dbname=dbname, dbmode='w', online=True, buffer=buffer)
+            S.sample(50)
+            stats = S.e.online_stats()
+            assert_equal(stats['n'], 50)
+            assert_almost_equal(stats['mean'], S.e.trace().mean())
+            S.db.close()
+
     def test_zcompression(self):
         db = pymc.database.hdf5.Database(dbname=os.path.join(testdir, 'DisasterModelCompressed.hdf5'),
                                          dbmode='w',
@@ -266,6 +553,26 @@ class TestHDF5(TestPickle):
         db.close()
         del S
 
+    def test_zfilters(self):
+        dbname = os.path.join(testdir, 'DisasterModelFilters.hdf5')
+        S = MCMC(DisasterModel, db='hdf5', dbname=dbname, dbmode='w', dbfilters={'e': ('zlib', 5)})
+        S.sample(45,10,1)
+        assert isinstance(S.db._traces['e'], pymc.database.hdf5.ArrayTrace)
+        assert_equal(S.db._traces['e']._earrays[0].filters.complevel, 5)
+        assert 'e' not in S.db._tables[0].colnames
+        assert S.db._tables[0].chunkshape[0] <= 35
+
+        e = S.e.trace()
+        assert_equal(e.shape, (35,))
+        for s in [slice(3, 20, 4), slice(-10, None), slice(None, None, -3), slice(40, 50)]:
+            assert_array_equal(S.e.trace(slicing=s), e[s])
+            assert_array_equal(S.l.trace(slicing=s), S.l.trace()[s])
+        S.db.close()
+
+        db = pymc.database.hdf5.load(dbname)
+        assert_array_equal(db.e(chain=0), e)
+        db.close()
+
 
 
 class testHDF5Objects(TestCase):
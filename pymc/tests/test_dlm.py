@@ -0,0 +1,88 @@
+"""Test the dynamic linear models and the FFBS step method."""
+
+from numpy.testing import *
+import numpy as np
+from pymc import *
+
+def dense_covariance(F, G, V, W, C_0, T):
+    """Joint covariances of the states and the observations."""
+    p = len(G)
+    S = np.zeros((T*p, T*p))
+    S[:p,:p] = C_0
+    for t in xrange(1, T):
+        S[t*p:(t+1)*p, :t*p] = np.dot(G, S[(t-1)*p:t*p, :t*p])
+        S[:t*p, t*p:(t+1)*p] = S[t*p:(t+1)*p, :t*p].T
+        S[t*p:(t+1)*p, t*p:(t+1)*p] = np.dot(np.dot(G, S[(t-1)*p:t*p, (t-1)*p:t*p]), G.T) + W
+    FF = np.kron(np.eye(T), F)
+    return S, np.dot(np.dot(FF, S), FF.T) + np.kron(np.eye(T), V), np.dot(S, FF.T)
+
+def mv_normal_logp(x, C):
+    sign, logdet = np.linalg.slogdet(C)
+    return -.5 * (len(x)*np.log(2*np.pi) + logdet + np.dot(x, np.linalg.solve(C, x)))
+
+class test_DLM(TestCase):
+    T = 25
+    F = np.array([[1., 0.], [.5, 1.]])
+    G = np.array([[1., 1.], [0., .9]])
+    V = np.array([[1., .3], [.3, .5]])
+    W = np.array([[.2, 0.], [0., .1]])
+    m_0 = np.zeros(2)
+    C_0 = np.eye(2)
+
+    def test_likelihood(self):
+        S, K, SF = dense_covariance(self.F, self.G, self.V, self.W, self.C_0, self.T)
+        y = rdlm(self.F, self.G, self.V, self.W, self.m_0, self.C_0, self.T)
+        assert_equal(y.shape, (self.T, 2))
+        assert_almost_equal(dlm_like(y, self.F, self.G, self.V, self.W, self.m_0, self.C_0), mv_normal_logp(y.ravel(), K))
+
+        theta = rdlm_states(self.G, self.W, self.m_0, self.C_0, self.T)
+        assert_almost_equal(dlm_states_like(theta, self.G, self.W, self.m_0, self.C_0), mv_normal_logp(theta.ravel(), S))
+
+        # Univariate observations are drawn as a vector.
+        assert_equal(rdlm(1., 1., 1., 1., 0., 1., self.T).shape, (self.T,))
+        assert_equal(rdlm_observations(np.ones(self.T), 1., np.ones(self.T)).shape, (self.T,))
+
+        # Parameters given at every time.
+        Gs = np.array([self.G]*self.T)
+        Vs = np.array([self.V]*self.T)
+        assert_almost_equal(dlm_like(y, self.F, Gs, Vs, self.W, self.m_0, self.C_0), mv_normal_logp(y.ravel(), K))
+        assert_almost_equal(dlm_observations_like(y, theta, self.F, Vs), dlm_observations_like(y, theta, self.F, self.V))
+
+    def test_ffbs(self):
+        S, K, SF = dense_covariance(self.F, self.G, self.V, self.W, self.C_0, self.T)
+        y = rdlm(self.F, self.G, self.V, self.W, self.m_0, self.C_0, self.T)
+        mean = np.dot(SF, np.linalg.solve(K, y.ravel()))
+        cov = S - np.dot(SF, np.linalg.solve(K, SF.T))
+
+        m, C, a, R, loglike = kalman_filter(y, self.F, self.G, self.V, self.W, self.m_0, self.C_0)
+        assert_array_almost_equal(m[-1], mean[-2:])
+        assert_array_almost_equal(C[-1], cov[-2:,-2:])
+
+        out = (np.empty((self.T,2)), np.empty((self.T,2,2)), np.empty((self.T,2)), np.empty((self.T,2,2)))
+        draws = np.array([ffbs(y, self.F, self.G, self.V, self.W, self.m_0, self.C_0, out).ravel() for i in xrange(4000)])
+        assert_array_almost_equal(draws.mean(0), mean, 1)
+        assert_array_almost_equal(np.cov(draws.T), cov, 1)
+
+    def test_step_method(self):
+        W = Gamma('W', 2., 2., value=.5)
+        theta = DLMStates('theta', 1., W, 0., 2., T=50)
+        y = DLMObservations('y', theta, 1., 1., value=np.cumsum(np.random.normal(size=50)), observed=True)
+        M = MCMC([W, theta, y])
+        M.assign_step_methods()
+        assert isinstance(M.step_method_dict[theta][0], FFBS)
+        M.sample(50)
+        assert_equal(M.trace('theta')[:].shape, (50, 50, 1))
+
+        # The states integrated out.
+        D = DLM('D', 1., 1., 1., W, 0., 2., value=y.value, observed=True)
+        S, K, SF = dense_covariance(np.eye(1), np.eye(1), np.eye(1), W.value*np.eye(1), 2.*np.eye(1), 50)
+        assert_almost_equal(D.logp, mv_normal_logp(y.value, K))
+
+        # Drawn values of univariate series are vectors.
+        D2 = DLM('D2', 1., 1., 1., W, 0., 2., T=50)
+        assert_equal(D2.value.shape, (50,))
+
+
+if __name__ == '__main__':
+    import nose
+    nose.runmodule()
@@ -0,0 +1,33 @@
+"""Test the ElementwiseMetropolis step method on a random effects model.
+
+Each effect x[i] has a N(0, 1) prior and one N(x[i], 1) observation, so
+that its posterior is N(y[i]/2, 1/2).
+"""
+
+from numpy.testing import TestCase, assert_array_almost_equal, assert_equal
+import pymc
+import numpy as np
+
+
+class RandomEffectsModel:
+    data = np.linspace(-3, 3, 20)
+    x = pymc.Normal('x', mu=0., tau=1., value=np.zeros(20))
+    y = pymc.Normal('y', mu=x, tau=1., value=data, observed=True)
+
+
+class TestElementwiseMetropolis(TestCase):
+    def test_posterior(self):
+        M = pymc.MCMC(RandomEffectsModel)
+        M.use_step_method(pymc.ElementwiseMetropolis, M.x)
+        M.sample(6000, 1000)
+
+        sm = M.step_method_dict[M.x][0]
+        assert_equal(sm.adaptive_scale_factor.shape, (20,))
+        assert_array_almost_equal(M.x.trace().mean(0), RandomEffectsModel.data/2., 0)
+
+    def test_not_elementwise(self):
+        z = pymc.Normal('z', mu=0., tau=1., value=np.zeros(3))
+        @pymc.potential
+        def pot(z=z):
+            return -np.sum(z**2)
+        self.assertRaises(ValueError, pymc.ElementwiseMetropolis, z)
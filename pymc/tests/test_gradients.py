@@ -0,0 +1,93 @@
+"""Test the analytic gradients of the likelihoods against finite differences,
+and their chaining through Deterministics in Model.grad_logp.
+"""
+
+from numpy.testing import TestCase, assert_array_almost_equal
+import pymc
+from pymc import distributions, utils
+import numpy as np
+
+h = 1e-6
+
+def numerical_grad(f, x):
+    x = np.array(x, dtype=float)
+    g = np.zeros(x.shape)
+    for i in xrange(x.size):
+        up = x.copy()
+        up.flat[i] += h
+        down = x.copy()
+        down.flat[i] -= h
+        g.flat[i] = (f(up) - f(down)) / (2*h)
+    return g
+
+# Likelihood name, value, parents.
+cases = [('normal', [.3, -1.2, 2.], {'mu': .5, 'tau': 2.}),
+         ('lognormal', [.3, 1.2, 2.], {'mu': .5, 'tau': 2.}),
+         ('half_normal', [.3, 1.2, 2.], {'tau': 2.}),
+         ('gamma', [.3, 1.2, 2.], {'alpha': 2.5, 'beta': 1.5}),
+         ('exponential', [.3, 1.2, 2.], {'beta': 1.5}),
+         ('inverse_gamma', [.3, 1.2, 2.], {'alpha': 2.5, 'beta': 1.5}),
+         ('beta', [.3, .5, .9], {'alpha': 2.5, 'beta': 1.5}),
+         ('cauchy', [.3, -1.2, 2.], {'alpha': .5, 'beta': 2.}),
+         ('laplace', [.3, -1.2, 2.], {'mu': .5, 'tau': 2.}),
+         ('t', [.3, -1.2, 2.], {'nu': 4.}),
+         ('poisson', [0, 3, 2], {'mu': 1.5}),
+         ('binomial', [0, 3, 2], {'n': 5, 'p': .4}),
+         ('mv_normal', [.3, -1.2], {'mu': np.array([.5, 0.]), 'tau': np.array([[2., .5], [.5, 1.]])})]
+
+
+class TestLikelihoodGradients(TestCase):
+    def test_value_grads(self):
+        for name, x, parents in cases:
+            like = getattr(distributions, name+'_like')
+            if not hasattr(like, 'grad'):
+                continue
+            f = lambda v: like(v, **parents)
+            assert_array_almost_equal(like.grad(np.array(x), **parents), numerical_grad(f, x), 4)
+
+    def test_parent_grads(self):
+        for name, x, parents in cases:
+            like = getattr(distributions, name+'_like')
+            for pname, parent_grad in like.parent_grads.iteritems():
+                # Perturbing single elements of a precision matrix would
+                # make it asymmetric.
+                if name == 'mv_normal' and pname == 'tau':
+                    continue
+                def f(v):
+                    p = parents.copy()
+                    p[pname] = v
+                    return like(np.array(x), **p)
+                assert_array_almost_equal(parent_grad(np.array(x), **parents), numerical_grad(f, parents[pname]), 4)
+
+    def test_sum_to_shape(self):
+        assert_array_almost_equal(utils.sum_to_shape(np.ones((3, 2)), np.zeros(2)), [3., 3.])
+        assert_array_almost_equal(utils.sum_to_shape(np.ones((3, 2)), np.zeros((3, 1))), [[2.], [2.], [2.]])
+        assert_array_almost_equal(utils.sum_to_shape(np.ones((3, 2)), 0.), 6.)
+
+
+class TestModelGradient(TestCase):
+    def test_through_deterministics(self):
+        a = pymc.Normal('a', mu=0., tau=1., value=.3)
+        p = pymc.InvLogit('p', a)
+        y = pymc.Binomial('y', n=10, p=p, value=7, observed=True)
+        b = pymc.Gamma('b', alpha=2., beta=1., value=np.array([.5, 1.5]))
+        c = pymc.Lambda('c', lambda a=a, b=b: a*b, jacobians={'a': lambda a, b: b, 'b': lambda a, b: a})
+        z = pymc.Normal('z', mu=c, tau=1., value=np.array([.2, -.1]), observed=True)
+        M = pymc.Model([a, p, y, b, c, z])
+
+        grads = M.grad_logp()
+        for s in [a, b]:
+            value = s.value
+            def f(v):
+                s.value = v
+                return M.logp
+            numerical = numerical_grad(f, value)
+            s.value = value
+            assert_array_almost_equal(grads[s], numerical, 4)
+
+    def test_missing_jacobian(self):
+        a = pymc.Normal('a', mu=0., tau=1., value=.3)
+        c = pymc.Lambda('c', lambda a=a: a**2)
+        z = pymc.Normal('z', mu=c, tau=1., value=.2, observed=True)
+        M = pymc.Model([a, c, z])
+        self.assertRaises(NotImplementedError, M.grad_logp)
@@ -0,0 +1,34 @@
+"""Test the HamiltonianMC step method on a conjugate normal model.
+
+The mean mu has a N(0, 1) prior and 10 N(mu, 1) observations, so that
+its posterior is N(sum(y)/11, 1/11).
+"""
+
+from numpy.testing import TestCase, assert_almost_equal, assert_array_almost_equal
+import pymc
+import numpy as np
+
+
+class NormalModel:
+    data = np.linspace(0, 2, 10)
+    mu = pymc.Normal('mu', mu=0., tau=1., value=0.)
+    y = pymc.Normal('y', mu=mu, tau=1., value=data, observed=True)
+
+
+class TestHamiltonianMC(TestCase):
+    def test_gradient(self):
+        x = pymc.Normal('x', mu=1., tau=2., value=np.array([0., .5, 3.]))
+        z = pymc.Normal('z', mu=x, tau=1., value=np.ones(3), observed=True)
+        H = pymc.HamiltonianMC(x)
+        # -tau*(x-mu) from the prior, plus (z-x) from the observations.
+        assert_array_almost_equal(H.gradient(), [3., 1.5, -6.], 4)
+
+    def test_posterior(self):
+        M = pymc.MCMC(NormalModel)
+        M.use_step_method(pymc.HamiltonianMC, M.mu, step_size=.2, n_steps=5)
+        M.sample(3000, 500)
+        assert_almost_equal(M.mu.trace().mean(), NormalModel.data.sum()/11., 1)
+
+    def test_not_float(self):
+        n = pymc.Poisson('n', mu=3., value=2)
+        self.assertRaises(ValueError, pymc.HamiltonianMC, n)
@@ -0,0 +1,53 @@
+"""Test the vectorized evaluation of the joint log-probability."""
+
+from numpy.testing import TestCase, assert_almost_equal, assert_equal
+import numpy as np
+import pymc
+from pymc import Model, distributions
+from pymc.examples import DisasterModel
+
+
+class test_elementwise(TestCase):
+    def test_sums(self):
+        x = np.array([.2, .5, 1.3])
+        for like, args in [(distributions.normal_like, (.3, 2.)),
+                           (distributions.gamma_like, (2., 3.)),
+                           (distributions.beta_like, (2., 3.)),
+                           (distributions.exponential_like, (1.5,)),
+                           (distributions.lognormal_like, (.1, 4.))]:
+            assert_almost_equal(like.elementwise(x, *args).sum(), like(x, *args), 6)
+
+    def test_discrete(self):
+        x = np.array([0, 2, 5])
+        assert_almost_equal(distributions.poisson_like.elementwise(x, 2.5).sum(), distributions.poisson_like(x, 2.5), 6)
+        assert_almost_equal(distributions.binomial_like.elementwise(x, 6, .4).sum(), distributions.binomial_like(x, 6, .4), 6)
+
+    def test_support(self):
+        assert_equal(distributions.gamma_like.elementwise(-1., 2., 3.), -np.inf)
+
+
+class test_logp_batch(TestCase):
+    def test_disaster(self):
+        M = Model(DisasterModel)
+        s = np.array([30, 40, 50, 60])
+        e = np.array([2.5, 3., 3.5, -1.])
+        l = np.array([.5, 1., 1.5, 1.])
+        logp = M.logp_batch({'s': s, 'e': e, M.l: l})
+
+        for i in range(len(s)):
+            M.s.value = s[i]
+            M.e.value = e[i]
+            M.l.value = l[i]
+            try:
+                assert_almost_equal(logp[i], M.logp, 6)
+            except pymc.ZeroProbability:
+                assert_equal(logp[i], -np.inf)
+
+    def test_array(self):
+        M = Model(DisasterModel)
+        # Columns are e, l and s, sorted by name.
+        points = np.array([[3., .5, 40], [2., 1., 45]])
+        logp = M.logp_batch(points)
+        for i in range(2):
+            M.e.value, M.l.value, M.s.value = points[i]
+            assert_almost_equal(logp[i], M.logp, 6)
@@ -0,0 +1,87 @@
+"""Test the NormalSubmodel step method."""
+
+from numpy.testing import *
+import numpy as np
+import pymc
+from pymc import *
+
+def random_walk(N=30):
+    """
+    x[0] ~ N(0, 1), x[t] ~ N(x[t-1], 4), y[t] ~ N(x[t], 1), and the exact
+    posterior mean of x.
+    """
+    x = [Normal('x_0', 0., 1., value=0.)]
+    for t in xrange(1, N):
+        x.append(Normal('x_%i'%t, x[-1], 4., value=0.))
+    data = np.cumsum(np.random.normal(size=N))
+    y = [Normal('y_%i'%t, x[t], 1., value=data[t], observed=True) for t in xrange(N)]
+
+    Q = np.eye(N)
+    Q[0,0] += 1.
+    Q[1:,1:] += 4. * np.eye(N-1)
+    Q[:-1,:-1] += 4. * np.eye(N-1)
+    i = np.arange(N-1)
+    Q[i, i+1] = Q[i+1, i] = -4.
+    return x, y, np.linalg.solve(Q, data)
+
+
+class test_NormalSubmodel(TestCase):
+
+    def test_random_walk(self):
+        x, y, mean = random_walk()
+        M = MCMC([x, y])
+        M.assign_step_methods()
+        sm = M.step_method_dict[x[0]][0]
+        assert isinstance(sm, NormalSubmodel)
+        assert_equal(sm.stochastics, set(x))
+        # The precision is tridiagonal.
+        assert_equal(sm.bandwidth, 1)
+
+        M.sample(3000)
+        values = np.array([M.trace(s.__name__)[:] for s in x]).T
+        assert_array_almost_equal(values.mean(0), mean, 1)
+
+    def test_linear_combination(self):
+        X = np.random.normal(size=(50, 2))
+        beta = MvNormal('beta', np.zeros(2), .01*np.eye(2), value=np.zeros(2))
+        mu = LinearCombination('mu', [X], [beta])
+        y = Normal('y', mu, 4., value=np.dot(X, [1., -2.]) + np.random.normal(size=50)*.5, observed=True)
+
+        sm = NormalSubmodel([beta])
+        values = []
+        for i in xrange(3000):
+            sm.step()
+            values.append(beta.value)
+        C = np.linalg.inv(.01*np.eye(2) + 4.*np.dot(X.T, X))
+        assert_array_almost_equal(np.mean(values, 0), np.dot(C, 4.*np.dot(X.T, y.value)), 2)
+        assert_array_almost_equal(np.cov(np.transpose(values)), C, 3)
+
+    def test_factor_cache(self):
+        tau = Gamma('tau', 1., 1., value=1.)
+        x, y, mean = random_walk(5)
+        z = Normal('z', x[-1], tau, value=1., observed=True)
+        sm = NormalSubmodel(x)
+        sm.step()
+        chol = sm._chol
+        sm.step()
+        assert sm._chol is chol
+        tau.value = 2.
+        sm.step()
+        assert sm._chol is not chol
+
+    def test_not_linear(self):
+        a = Normal('a', 0., 1.)
+        b = Normal('b', 0., 1.)
+        c = Normal('c', LinearCombination('ab', [a], [b]), 1., value=1., observed=True)
+        assert_equal(crawl_normal_submodel(a), set())
+
+        d = Normal('d', 0., 1.)
+        e = Normal('e', d, 1.)
+        f = Poisson('f', Lambda('rate', lambda e=e: np.exp(e)), value=1, observed=True)
+        assert_equal(crawl_normal_submodel(d), set([d]))
+        assert_equal(find_normal_submodels([d, e]), [])
+
+
+if __name__ == '__main__':
+    import nose
+    nose.runmodule()
@@ -1,10 +1,13 @@
 from numpy.testing import *
 from pymc.gp import *
 from test_mean import M, x
+from pymc.gp.cov_funs import matern
 from test_cov import C
 from numpy import *
 from copy import copy
 
+M_prior = M
+C_prior = C
 M = copy(M)
 C = copy(C)
 
@@ -27,3 +30,44 @@ class test_observation(TestCase):
             f = Realization(M, C)
             f(x)
 
+class test_downdate(TestCase):
+    obs_x = linspace(-1, 1, 10)
+    data = cos(3*obs_x)
+
+    def observed(self, C_prior, keep, V):
+        M_, C_ = copy(M_prior), copy(C_prior)
+        observe(M_, C_, self.obs_x[keep], self.data[keep], V[keep])
+        return M_, C_
+
+    def test_unobserve(self):
+        V = ones(10) * .1
+        for C_full in [C_prior, FullRankCovariance(matern.euclidean, diff_degree = 1.4, amp = .4, scale = 1.)]:
+            M_, C_ = self.observed(C_full, arange(10), V)
+            kept = delete(C_.obs_piv, [2,5])
+            unobserve(M_, C_, [2,5])
+            M_new, C_new = self.observed(C_full, kept, V)
+            assert_array_almost_equal(C_(x), C_new(x))
+            assert_array_almost_equal(M_(x), M_new(x))
+
+    def test_reobserve(self):
+        V = ones(10) * .1
+        C_full = FullRankCovariance(matern.euclidean, diff_degree = 1.4, amp = .4, scale = 1.)
+        M_, C_ = self.observed(C_full, arange(10), V)
+        reobserve(M_, C_, [1,3], [.5, .01])
+        V[1], V[3] = .5, .01
+        M_new, C_new = self.observed(C_full, arange(10), V)
+        assert_array_almost_equal(C_(x), C_new(x))
+        assert_array_almost_equal(M_(x), M_new(x))
+
+    def test_cholupdate(self):
+        A = random.normal(size=(6,6))
+        S = dot(A, A.T) + eye(6)
+        U = linalg.cholesky(S).T.copy()
+        v = random.normal(size=6)
+        cholupdate(U, v.copy())
+        assert_array_almost_equal(dot(U.T, U), S + outer(v,v))
+        cholupdate(U, v.copy(), downdate=True)
+        assert_array_almost_equal(dot(U.T, U), S)
+        U2 = asarray(choldelete(U, 2))
+        keep = [0,1,3,4,5]
+        assert_array_almost_equal(dot(U2.T, U2), S[keep][:,keep])
@@ -41,6 +41,60 @@ class test_logp_of_set(TestCase):
                 cls,  inst, tb = sys.exc_info()
                 assert(cls is RuntimeError)
 
+class test_autocorr_all(TestCase):
+    def test_matches_autocorr(self):
+        x = cumsum(random.normal(size=500))
+        acf = utils.autocorr_all(x, 20)
+        assert_equal(acf.shape, (20,))
+        assert_almost_equal(acf[0], 1)
+        for lag in [1, 2, 5, 19]:
+            assert_almost_equal(acf[lag], utils.autocorr(x, lag))
+
+    def test_columns(self):
+        x = cumsum(random.normal(size=(300, 2, 3)), 0)
+        acf = utils.autocorr_all(x, 10)
+        assert_equal(acf.shape, (10, 2, 3))
+        for i in range(2):
+            for j in range(3):
+                assert_almost_equal(acf[:,i,j], utils.autocorr_all(x[:,i,j], 10))
+        assert_almost_equal(acf[3,1,2], utils.autocorr(x[:,1,2], 3))
+
+    def test_batchsd(self):
+        x = random.normal(size=(1003, 4))
+        sd = batchsd(x, 10)
+        assert_equal(sd.shape, (4,))
+        for j in range(4):
+            means = x[:1000,j].reshape(10, 100).mean(1)
+            assert_almost_equal(sd[j], std(means)/sqrt(10))
+
+
+class test_summaries(TestCase):
+    def brute_hpd(self, x, alpha):
+        # Narrowest interval containing int(n*(1-alpha)) steps.
+        sx = sort(x)
+        m = int(len(x)*(1-alpha))
+        widths = [sx[i+m] - sx[i] for i in range(len(x)-m)]
+        i = argmin(widths)
+        return [sx[i], sx[i+m]]
+
+    def test_hpd(self):
+        x = random.gamma(2, size=(400, 3, 2))
+        intervals = utils.hpd(x, .05)
+        assert_equal(intervals.shape, (3, 2, 2))
+        for i in range(3):
+            for j in range(2):
+                assert_array_equal(intervals[i,j], self.brute_hpd(x[:,i,j], .05))
+        assert_array_equal(utils.hpd(x[:,0,0], .05), intervals[0,0])
+
+    def test_quantiles(self):
+        x = random.normal(size=(101, 4))
+        q = utils.quantiles(x)
+        sx = sort(x, 0)
+        for p in [2.5, 25, 50, 75, 97.5]:
+            assert_array_equal(q[p], sx[int(101*p/100.)])
+        assert_array_equal(utils.quantiles(x[:,1])[50], sx[50,1])
+
+
 
 if __name__ == '__main__':
     C =nose.config.Config(verbosity=1)
@@ -12,14 +12,14 @@ import flib
 import pdb
 from numpy.linalg.linalg import LinAlgError
 from numpy.linalg import cholesky, eigh, det, inv
-from Node import logp_of_set
+from Node import logp_of_set, logp_of_terms, ContainerBase
 
 from numpy import sqrt, obj2sctype, ndarray, asmatrix, array, pi, prod, exp,\
     pi, asarray, ones, atleast_1d, iterable, linspace, diff, around, log10, \
     zeros, arange, digitize, apply_along_axis, concatenate, bincount, sort, \
     hsplit, argsort, inf, shape, ndim, swapaxes, ravel, transpose as tr
 
-__all__ = ['check_list', 'autocorr', 'calc_min_interval', 'check_type', 'ar1', 'ar1_gen', 'draw_random', 'histogram', 'hpd', 'invcdf', 'make_indices', 'normcdf', 'quantiles', 'rec_getattr', 'rec_setattr', 'round_array', 'trace_generator','msqrt','safe_len', 'log_difference', 'find_generations','crawl_dataless', 'logit', 'invlogit','stukel_logit','stukel_invlogit','symmetrize','value']
+__all__ = ['check_list', 'autocorr', 'autocorr_all', 'autocov_all', 'calc_min_interval', 'check_type', 'ar1', 'ar1_gen', 'draw_random', 'histogram', 'hpd', 'invcdf', 'make_indices', 'normcdf', 'quantiles', 'rec_getattr', 'rec_setattr', 'round_array', 'trace_generator','msqrt','safe_len', 'log_difference', 'find_generations','crawl_dataless', 'logit', 'invlogit','stukel_logit','stukel_invlogit','symmetrize','value']
 
 symmetrize=flib.symmetrize
 
@@ -481,6 +481,8 @@ def ar1(rho, mu, sigma, size=1):
 def autocorr(x, lag=1):
     """Sample autocorrelation at specified lag.
     The autocorrelation is the correlation of x_i with x_{i+lag}.
+
+    To compute many lags, use autocorr_all.
     """
 
     if not lag: return 1
@@ -490,6 +492,48 @@ def autocorr(x, lag=1):
     v = x.var()
     return ((x[:-lag]-mu)*(x[lag:]-mu)).sum()/v/(len(x) - lag)
 
+def autocov_all(x, maxlag=None):
+    """Sample autocovariances of x at lags 0 to maxlag-1, computed with a
+    single FFT for all the elements of the series.
+
+    :Parameters:
+      x : array
+        A series, or a trace of array values. The first axis indexes the
+        samples.
+      maxlag : int
+        Number of lags. Defaults to the length of the series.
+
+    :Returns:
+      The array of sums of (x_i - mu)*(x_{i+lag} - mu), divided by the
+      length of the series, with shape (maxlag,) + x.shape[1:].
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if maxlag is None or maxlag > n:
+        maxlag = n
+    x = x - x.mean(0)
+    nfft = 2**int(np.ceil(np.log2(2*n)))
+    f = np.fft.rfft(x, nfft, axis=0)
+    return np.fft.irfft(f.real**2 + f.imag**2, nfft, axis=0)[:maxlag] / n
+
+def autocorr_all(x, maxlag=None):
+    """Sample autocorrelations of x at lags 0 to maxlag-1, computed with a
+    single FFT for all the elements of the series.
+
+    autocorr_all(x)[lag] equals autocorr(x, lag) for a one-dimensional x.
+
+    :Parameters:
+      x : array
+        A series, or a trace of array values. The first axis indexes the
+        samples.
+      maxlag : int
+        Number of lags. Defaults to the length of the series.
+    """
+    acov = autocov_all(x, maxlag)
+    n = len(x)
+    lags = np.arange(len(acov)).reshape((-1,) + (1,)*(acov.ndim-1))
+    return acov * n / (n - lags) / acov[0]
+
 def trace_generator(trace, start=0, stop=None, step=1):
     """Return a generator returning values from the object's trace.
 
@@ -548,42 +592,23 @@ def rec_setattr(obj, attr, value):
     setattr(reduce(getattr, attrs[:-1], obj), attrs[-1], value)
 
 def hpd(x, alpha):
-    """Calculate HPD (minimum width BCI) of array for given alpha"""
-
-    # Make a copy of trace
-    x = x.copy()
-
-    # For multivariate node
-    if x.ndim>1:
-
-        # Transpose first, then sort
-        tx = tr(x, range(x.ndim)[1:]+[0])
-        dims = shape(tx)
+    """Calculate HPD (minimum width BCI) of array for given alpha
 
-        # Container list for intervals
-        intervals = np.resize(0.0, dims[:-1]+(2,))
-
-        for index in make_indices(dims[:-1]):
-
-            try:
-                index = tuple(index)
-            except TypeError:
-                pass
-
-            # Sort trace
-            sx = sort(tx[index])
+    For multivariate nodes, the traces of all the elements are sorted at
+    once along the first axis, and the intervals are returned in an array
+    of shape x.shape[1:]+(2,).
+    """
 
-            # Append to list
-            intervals[index] = calc_min_interval(sx, alpha)
+    # Sort the trace along the sample axis
+    sx = sort(x, 0)
 
-        # Transpose back before returning
-        return array(intervals)
+    interval = calc_min_interval(sx, alpha)
 
-    else:
-        # Sort univariate node
-        sx = sort(x)
+    if sx.ndim>1 and interval[0] is not None:
+        # Put the interval bounds on the last axis
+        return np.rollaxis(array(interval), 0, sx.ndim)
 
-        return array(calc_min_interval(sx, alpha))
+    return array(interval)
 
 def make_indices(dimensions):
     # Generates complete set of indices for given dimensions
@@ -613,67 +638,61 @@ def make_indices(dimensions):
 
 def calc_min_interval(x, alpha):
     """Internal method to determine the minimum interval of
-    a given width"""
+    a given width
 
-    # Initialize interval
-    min_int = [None,None]
-
-    try:
+    x must be sorted along its first axis. If it has more than one
+    dimension, the intervals of all the elements are computed at once.
+    """
 
-        # Number of elements in trace
-        n = len(x)
+    x = asarray(x)
 
-        # Start at far left
-        start, end = 0, int(n*(1-alpha))
+    # Number of elements in trace
+    n = len(x)
 
-        # Initialize minimum width to large value
-        min_width = inf
+    # Number of steps between the endpoints of the intervals
+    m = int(n*(1-alpha))
 
-        while end < n:
+    if m >= n:
+        print 'Too few elements for interval calculation'
+        return [None,None]
 
-            # Endpoints of interval
-            hi, lo = x[end], x[start]
+    # Widths of all the candidate intervals, and start of the narrowest
+    widths = x[m:] - x[:n-m]
+    start = widths.argmin(0)
 
-            # Width of interval
-            width = hi - lo
+    if x.ndim == 1:
+        return [x[start], x[start+m]]
 
-            # Check to see if width is narrower than minimum
-            if width < min_width:
-                min_width = width
-                min_int = [lo, hi]
+    flat = x.reshape(n, -1)
+    start = start.ravel()
+    columns = np.arange(flat.shape[1])
+    return [flat[start, columns].reshape(x.shape[1:]), flat[start+m, columns].reshape(x.shape[1:])]
 
-            # Increment endpoints
-            start +=1
-            end += 1
+def quantiles(x, qlist=[2.5, 25, 50, 75, 97.5]):
+    """Returns a dictionary of requested quantiles from array
 
-        return min_int
+    Only the requested order statistics are placed, with a partial sort
+    along the first axis where numpy provides one.
+    """
 
-    except IndexError:
-        print 'Too few elements for interval calculation'
-        return [None,None]
+    x = asarray(x)
 
-def quantiles(x, qlist=[2.5, 25, 50, 75, 97.5]):
-    """Returns a dictionary of requested quantiles from array"""
+    # Indices of the order statistics
+    indices = [int(len(x)*q/100.0) for q in qlist]
 
-    # Make a copy of trace
-    x = x.copy()
+    if not len(x) or max(indices) >= len(x):
+        print "Too few elements for quantile calculation"
+        return
 
-    # For multivariate node
-    if x.ndim>1:
-        # Transpose first, then sort, then transpose back
-        sx = tr(sort(tr(x)))
+    if hasattr(np, 'partition'):
+        sx = np.partition(x, sorted(set(indices)), axis=0)
     else:
-        # Sort univariate node
-        sx = sort(x)
+        sx = sort(x, 0)
 
-    try:
-        # Generate specified quantiles
-        quants = [sx[int(len(sx)*q/100.0)] for q in qlist]
+    # Generate specified quantiles
+    quants = [sx[i] for i in indices]
 
-        return dict(zip(qlist, quants))
-
-    except IndexError:
-        print "Too few elements for quantile calculation"
+    return dict(zip(qlist, quants))
 
 def coda_output(pymc_object):
     """Generate output files that are compatible with CODA"""
@@ -835,5 +854,109 @@ def find_generations(container, with_data = False):
             children_remaining = False
     return generations
 
+def find_topological_order(nodes):
+    """
+    Return a list containing nodes and all the variables they depend on,
+    sorted so that every node comes after all its parents.
+    """
+    order = []
+    visited = set()
+    for node in nodes:
+        if node in visited:
+            continue
+        # Depth-first search with an explicit stack to avoid hitting the
+        # recursion limit on long chains of nodes.
+        stack = [(node, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if expanded:
+                order.append(current)
+                continue
+            if current in visited:
+                continue
+            visited.add(current)
+            stack.append((current, True))
+            for parent in current.parents.variables:
+                if parent not in visited:
+                    stack.append((parent, False))
+    return order
+
+def sum_to_shape(g, parent):
+    """
+    Sum a gradient that was broadcast against a larger array back down to the
+    shape of parent.
+    """
+    s = np.shape(parent)
+    g = np.asarray(g, dtype=float)
+    if s == ():
+        return g.sum()
+    if g.ndim < len(s):
+        g = g * ones(s)
+    while g.ndim > len(s):
+        g = g.sum(0)
+    for i, n in enumerate(s):
+        if n == 1 and g.shape[i] != 1:
+            g = np.expand_dims(g.sum(i), i)
+    return g
+
+def _depends_on(obj, stochastic):
+    # Whether the value of obj, a parent of some node, depends on stochastic.
+    if obj is stochastic:
+        return True
+    if isinstance(obj, Deterministic):
+        return stochastic in obj.extended_parents
+    if isinstance(obj, ContainerBase):
+        for variable in obj.variables:
+            if _depends_on(variable, stochastic):
+                return True
+    return False
+
+def _chain_gradient(node, grad, stochastic):
+    # Given grad, a gradient with respect to node's value, return the gradient
+    # with respect to stochastic's value using the Jacobians of the
+    # Deterministics in between.
+    if node is stochastic:
+        return grad
+    total = zeros(shape(stochastic.value))
+    for name, parent in node.parents.iteritems():
+        if not _depends_on(parent, stochastic):
+            continue
+        if not isinstance(parent, Variable) or not node.jacobians.has_key(name):
+            raise NotImplementedError, '%s does not declare a Jacobian with respect to its parent %s.' % (node.__name__, name)
+        jacobian = node.jacobians[name](**node.parents.value)
+        if node.jacobian_formats.get(name, 'broadcast') == 'full':
+            g = np.tensordot(grad, jacobian, ndim(grad))
+        else:
+            g = sum_to_shape(grad * jacobian, parent.value)
+        total = total + _chain_gradient(parent, g, stochastic)
+    return total
 
+def logp_gradient(variable, stochastic):
+    """
+    The gradient of the log-probability of variable, a Stochastic or
+    Potential, with respect to the value of stochastic. Dependence through
+    Deterministics is followed using their Jacobians.
 
+    The gradients come from the `grad` and `parent_grads` attributes of
+    the log-probability functions (see distributions.py). NotImplementedError
+    is raised if any of the gradients or Jacobians needed is unavailable.
+    """
+    logp_fun = getattr(variable, '_logp_fun', None)
+    grad = zeros(shape(stochastic.value))
+
+    if variable is stochastic:
+        value_grad = getattr(logp_fun, 'grad', None)
+        if value_grad is None:
+            raise NotImplementedError, 'The log-probability of %s has no gradient with respect to its value.' % variable.__name__
+        grad = grad + value_grad(variable.value, **variable.parents.value)
+
+    parent_grads = getattr(logp_fun, 'parent_grads', {})
+    for name, parent in variable.parents.iteritems():
+        if not _depends_on(parent, stochastic):
+            continue
+        if not isinstance(parent, Variable) or not parent_grads.has_key(name):
+            raise NotImplementedError, 'The log-probability of %s has no gradient with respect to its parent %s.' % (variable.__name__, name)
+        g = parent_grads[name](variable.value, **variable.parents.value)
+        grad = grad + _chain_gradient(parent, g, stochastic)
+
+    return grad